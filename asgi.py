@@ -0,0 +1,7 @@
+from website.asgi import create_asgi_app
+
+
+# Async alternative to main.py:
+#   uvicorn asgi:app --workers 4
+#   gunicorn -k uvicorn.workers.UvicornWorker -w 4 asgi:app
+app = create_asgi_app()
@@ -0,0 +1,260 @@
+import json
+import os
+import platform
+import subprocess
+import threading
+import time
+from datetime import datetime
+import click
+from .datagen import BENCH_DB, BENCH_HASH_METHOD, bench_app, bench_environment, generate
+from .flows import FLOWS, count_queries, make_client
+from .report import Recorder, compare, git_revision, load, print_table, summarize
+
+
+# Load tests against a generated database, in-process:
+#
+#   python -m bench datagen --products 10000 --customers 100000 --order-items 1000000
+#   python -m bench run --browsers 4 --shoppers 4 --admins 1 --duration 60 -o before.json
+#   python -m bench compare before.json after.json
+#
+# Clients are threads sharing one app, so absolute numbers include GIL
+# contention; compare runs made on the same machine with the same options.
+#
+# `http` drives a real server instead, one connection per client, to
+# compare serving modes under many concurrent connections:
+#
+#   python -m bench http --server wsgi --workers 2 --threads 8 -o wsgi.json
+#   python -m bench http --server asgi --workers 2 -o asgi.json --baseline wsgi.json
+#
+# Scenarios for single subsystems, each run twice and compared:
+#
+#   media serving (ETags, 304s, ranges, hot-file cache):
+#     MEDIA_CACHE_BUDGET=0 python -m bench run --browsers 0 --shoppers 0 --admins 0 --media 8 -o nocache.json
+#     python -m bench run --browsers 0 --shoppers 0 --admins 0 --media 8 --baseline nocache.json
+#
+#   login storm next to browse latency (password hashing slots):
+#     PASSWORD_HASH_CONCURRENCY=0 python -m bench http --server wsgi --browsers 8 --shoppers 0 --logins 16 \
+#         --hash-method pbkdf2:sha256:600000 -o unbounded.json
+#     python -m bench http --server wsgi --browsers 8 --shoppers 0 --logins 16 \
+#         --hash-method pbkdf2:sha256:600000 --baseline unbounded.json
+SERVER_START_TIMEOUT = 60   # seconds for `http --server` to answer its first request
+
+
+@click.group()
+def bench():
+    pass
+
+
+@bench.command('datagen')
+@click.option('--db', 'db_path', default=BENCH_DB, show_default=True)
+@click.option('--products', default=1000, show_default=True)
+@click.option('--customers', default=5000, show_default=True)
+@click.option('--order-items', default=50000, show_default=True)
+@click.option('--seed', default=1, show_default=True)
+def datagen_command(db_path, products, customers, order_items, seed):
+    os.environ.setdefault('JOB_WORKERS', '0')
+    app = bench_app(db_path)
+    started = time.perf_counter()
+    orders = generate(app, products, customers, order_items, seed)
+    click.echo(f'{db_path}: {products} products, {customers} customers, {orders} orders, '
+               f'{order_items} order items in {time.perf_counter() - started:.1f}s')
+
+
+def _client_loop(client, products, deadline, failures):
+    flow = FLOWS[client.role]
+    try:
+        while time.monotonic() < deadline:
+            flow(client, products)
+    except Exception as e:
+        failures.append(f'{client.role}: {e!r}')
+
+
+def _bench_counts(app):
+    from website import db
+    from website.models import Customer, Product
+
+    with app.app_context():
+        return db.session.query(Product).count(), db.session.query(Customer).count()
+
+
+def _measure(app, roles, products, customers, warmup, duration, seed, base_url=None):
+    results = {}
+    failures = []
+
+    for phase, seconds in (('warmup', warmup), ('measure', duration)):
+        if seconds <= 0:
+            continue
+        recorder = Recorder()
+        clients = [make_client(app, recorder, role, index, customers, f'{seed}:{phase}', base_url)
+                   for index, role in enumerate(roles)]
+        deadline = time.monotonic() + seconds
+        threads = [threading.Thread(target=_client_loop, args=(client, products, deadline, failures))
+                   for client in clients]
+
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        results[phase] = (recorder, time.perf_counter() - started)
+
+    recorder, elapsed = results['measure']
+    return recorder, elapsed, failures
+
+
+def _report(result, failures, output, baseline):
+    print_table(result, click.echo)
+    for failure in failures:
+        click.echo(f'client stopped: {failure}', err=True)
+
+    if output:
+        with open(output, 'w') as f:
+            json.dump(result, f, indent=2)
+        click.echo(f'Wrote {output}')
+
+    if baseline:
+        click.echo()
+        compare(load(baseline), result, click.echo)
+
+
+def _meta(app, products, customers, clients, elapsed, seed, failures, **extra):
+    return {
+        'revision': git_revision(),
+        'date': datetime.utcnow().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'cpus': os.cpu_count(),
+        'database': app.config['SQLALCHEMY_DATABASE_URI'],
+        'products': products,
+        'customers': customers,
+        'clients': clients,
+        'duration': round(elapsed, 2),
+        'seed': seed,
+        'client_failures': failures,
+        **extra,
+    }
+
+
+@bench.command('run')
+@click.option('--db', 'db_path', default=BENCH_DB, show_default=True)
+@click.option('--browsers', default=4, show_default=True, help='Anonymous clients browsing and searching.')
+@click.option('--shoppers', default=4, show_default=True, help='Signed-in clients buying.')
+@click.option('--admins', default=1, show_default=True, help='Admin clients reading order lists.')
+@click.option('--media', default=0, show_default=True, help='Clients fetching product photos.')
+@click.option('--logins', default=0, show_default=True, help='Clients logging in and out.')
+@click.option('--hash-method', default=BENCH_HASH_METHOD, show_default=True,
+              help='PASSWORD_HASH_METHOD, e.g. pbkdf2:sha256:600000 for production-cost logins.')
+@click.option('--duration', default=30.0, show_default=True, help='Seconds to run after warm-up.')
+@click.option('--warmup', default=3.0, show_default=True, help='Seconds run first and not recorded.')
+@click.option('--seed', default=1, show_default=True)
+@click.option('-o', '--output', type=click.Path(dir_okay=False), help='Write the results as JSON.')
+@click.option('--baseline', type=click.Path(exists=True, dir_okay=False), help='Compare with an earlier result.')
+def run_command(db_path, browsers, shoppers, admins, media, logins, hash_method, duration, warmup, seed, output, baseline):
+    if not os.path.exists(db_path):
+        raise click.UsageError(f'{db_path} does not exist, run `python -m bench datagen` first')
+
+    app = bench_app(db_path)
+    from website import db
+
+    products, customers = _bench_counts(app)
+    with app.app_context():
+        count_queries(db.engine)
+
+    roles = ['browse'] * browsers + ['shop'] * shoppers + ['admin'] * admins + ['media'] * media + ['login'] * logins
+    recorder, elapsed, failures = _measure(app, roles, products, customers, warmup, duration, seed)
+    routes, total = summarize(recorder, elapsed)
+    clients = {'browse': browsers, 'shop': shoppers, 'admin': admins, 'media': media, 'login': logins}
+    result = {'meta': _meta(app, products, customers, clients, elapsed, seed, failures),
+              'routes': routes, 'total': total}
+    _report(result, failures, output, baseline)
+
+
+########################################
+# HTTP — A REAL SERVER IN ANOTHER PROCESS
+########################################
+SERVERS = {
+    'wsgi': ['gunicorn', '--worker-class', 'gthread', '--workers', '{workers}', '--threads', '{threads}',
+             '--bind', '127.0.0.1:{port}', 'main:app'],
+    'asgi': ['uvicorn', '--workers', '{workers}', '--port', '{port}', '--log-level', 'warning', 'asgi:app'],
+}
+
+
+def _start_server(server, db_path, hash_method, workers, threads, port, profile):
+    env = dict(os.environ, JOB_WORKERS='0', WSGI_THREADS=str(threads), SQL_PROFILER='1' if profile else '0')
+    bench_environment(db_path, hash_method)
+    env.update(DATABASE_URL=os.environ['DATABASE_URL'], PASSWORD_HASH_METHOD=os.environ['PASSWORD_HASH_METHOD'])
+    command = [part.format(workers=workers, threads=threads, port=port) for part in SERVERS[server]]
+    process = subprocess.Popen(command, env=env)
+
+    import requests
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise click.ClickException(f'{server} server exited with {process.returncode}')
+        try:
+            requests.get(f'http://127.0.0.1:{port}/', timeout=5)
+            return process
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    process.terminate()
+    raise click.ClickException(f'{server} server did not answer within {SERVER_START_TIMEOUT}s')
+
+
+@bench.command('http')
+@click.option('--db', 'db_path', default=BENCH_DB, show_default=True)
+@click.option('--server', type=click.Choice(sorted(SERVERS)), help='Start this server on the bench database.')
+@click.option('--url', help='Or use a server that is already running on the bench database.')
+@click.option('--workers', default=2, show_default=True, help='Server processes.')
+@click.option('--threads', default=8, show_default=True, help='Threads per WSGI worker (and per ASGI fallback pool).')
+@click.option('--port', default=8765, show_default=True)
+@click.option('--profile', is_flag=True, help='Run the server with SQL_PROFILER=1 to count queries.')
+@click.option('--browsers', default=16, show_default=True, help='Anonymous connections browsing and searching.')
+@click.option('--shoppers', default=8, show_default=True, help='Signed-in connections buying.')
+@click.option('--admins', default=0, show_default=True, help='Admin connections reading order lists.')
+@click.option('--media', default=0, show_default=True, help='Connections fetching product photos.')
+@click.option('--logins', default=0, show_default=True, help='Connections logging in and out.')
+@click.option('--hash-method', default=BENCH_HASH_METHOD, show_default=True,
+              help='PASSWORD_HASH_METHOD, e.g. pbkdf2:sha256:600000 for production-cost logins.')
+@click.option('--duration', default=30.0, show_default=True, help='Seconds to run after warm-up.')
+@click.option('--warmup', default=3.0, show_default=True, help='Seconds run first and not recorded.')
+@click.option('--seed', default=1, show_default=True)
+@click.option('-o', '--output', type=click.Path(dir_okay=False), help='Write the results as JSON.')
+@click.option('--baseline', type=click.Path(exists=True, dir_okay=False), help='Compare with an earlier result.')
+def http_command(db_path, server, url, workers, threads, port, profile, browsers, shoppers, admins, media, logins,
+                 hash_method,
+                 duration, warmup, seed, output, baseline):
+    if not os.path.exists(db_path):
+        raise click.UsageError(f'{db_path} does not exist, run `python -m bench datagen` first')
+    if bool(server) == bool(url):
+        raise click.UsageError('give either --server or --url')
+
+    # The local app only reads setup data (counts, cart ids) from the same database
+    app = bench_app(db_path)
+    products, customers = _bench_counts(app)
+
+    process = _start_server(server, db_path, hash_method, workers, threads, port, profile) if server else None
+    try:
+        roles = ['browse'] * browsers + ['shop'] * shoppers + ['admin'] * admins + ['media'] * media + ['login'] * logins
+        recorder, elapsed, failures = _measure(app, roles, products, customers, warmup, duration, seed,
+                                               url or f'http://127.0.0.1:{port}')
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    routes, total = summarize(recorder, elapsed)
+    clients = {'browse': browsers, 'shop': shoppers, 'admin': admins, 'media': media, 'login': logins}
+    result = {'meta': _meta(app, products, customers, clients, elapsed, seed, failures,
+                            server=server or url, workers=workers, threads=threads),
+              'routes': routes, 'total': total}
+    _report(result, failures, output, baseline)
+
+
+@bench.command('compare')
+@click.argument('old', type=click.Path(exists=True, dir_okay=False))
+@click.argument('new', type=click.Path(exists=True, dir_okay=False))
+def compare_command(old, new):
+    compare(load(old), load(new), click.echo)
+
+
+if __name__ == '__main__':
+    bench()
@@ -0,0 +1,135 @@
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+from sqlalchemy import insert, text
+
+
+# Synthetic catalog, customers and order history for benchmarks. The data
+# is a pure function of --seed and the scale options, so runs on
+# different commits measure the same database.
+#
+# Customer 1 is the admin (admin@bench.local); every account's password is
+# BENCH_PASSWORD.
+BENCH_DB = os.path.join('instance', 'bench.sqlite3')
+BENCH_PASSWORD = 'bench-password'
+BENCH_HASH_METHOD = 'pbkdf2:sha256:1000'  # logins are setup, not what is measured
+CHUNK = 10000
+
+FISH = ['Tuna', 'Salmon', 'Prawns', 'Squid', 'Galunggong', 'Bangus', 'Tilapia', 'Lapu-Lapu', 'Maya-Maya',
+        'Crab', 'Clams', 'Oyster', 'Mussels', 'Catfish', 'Anchovy', 'Pompano', 'Mackerel', 'Sardines']
+CUTS = ['Whole', 'Fillet', 'Steak', 'Cleaned', 'Smoked', 'Dried', 'Frozen', 'Fresh', 'Jumbo', 'Premium']
+SIZES = ['250g', '500g', '1kg', '2kg', '5kg']
+STATUSES = ['Pending', 'Accepted', 'Ready For Pick-Up', 'Picked-Up', 'Picked-Up', 'Picked-Up', 'Canceled']
+
+
+def bench_environment(db_path=BENCH_DB, hash_method=BENCH_HASH_METHOD):
+    # Must run before create_app() so the app opens the bench database.
+    # A costlier hash_method makes logins rehash the generated passwords.
+    os.environ['DATABASE_URL'] = f'sqlite:///{os.path.abspath(db_path)}'
+    os.environ['PASSWORD_HASH_METHOD'] = hash_method
+
+
+def bench_app(db_path=BENCH_DB, hash_method=BENCH_HASH_METHOD):
+    bench_environment(db_path, hash_method)
+    sys.path.insert(0, os.getcwd())
+    from website import create_app
+    app = create_app()
+    app.config['WTF_CSRF_ENABLED'] = False
+    return app
+
+
+def _chunks(rows):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == CHUNK:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def generate(app, products, customers, order_items, seed=1):
+    from website import db
+    from website.models import Customer, Product, Order, OrderItem
+    from website.sales import rebuild_sales_rollups
+    from website.search import rebuild_search_index
+    from website.passwords import password_hasher
+
+    rng = random.Random(seed)
+    now = datetime.utcnow().replace(microsecond=0)
+    pictures = sorted(name for name in os.listdir(os.path.join(app.root_path, '..', 'media'))
+                      if name.count('.') == 1)
+
+    with app.app_context():
+        password_hash = password_hasher().hash(BENCH_PASSWORD)
+
+        with db.engine.begin() as conn:
+            for table in ('order_items', 'orders', 'cart', 'product', 'customer'):
+                conn.execute(text(f'DELETE FROM {table}'))
+
+            def customer_rows():
+                yield {'id': 1, 'email': 'admin@bench.local', 'username': 'Admin',
+                       'password_hash': password_hash, 'date_joined': now - timedelta(days=730)}
+                for i in range(2, customers + 1):
+                    yield {'id': i, 'email': f'customer{i}@bench.local', 'username': f'customer{i}',
+                           'password_hash': password_hash,
+                           'date_joined': now - timedelta(minutes=rng.randrange(730 * 24 * 60))}
+
+            def product_rows():
+                for i in range(1, products + 1):
+                    price = round(rng.uniform(60, 1500), 2)
+                    yield {'id': i,
+                           'product_name': f'{rng.choice(CUTS)} {rng.choice(FISH)} ({rng.choice(SIZES)}) #{i}',
+                           'current_price': price,
+                           'previous_price': round(price * rng.choice([1, 1, 1.1, 1.25]), 2),
+                           'in_stock': 1000000,
+                           'product_picture': f'./media/{rng.choice(pictures)}',
+                           'flash_sale': rng.random() < 0.05,
+                           'date_added': now - timedelta(minutes=rng.randrange(365 * 24 * 60))}
+
+            for chunk in _chunks(customer_rows()):
+                conn.execute(insert(Customer), chunk)
+            for chunk in _chunks(product_rows()):
+                conn.execute(insert(Product), chunk)
+
+            # Orders of 1-6 lines each until order_items lines exist; popular
+            # products (low ids) sell more, like a real catalog.
+            order_id, line_count = 0, 0
+            orders, lines = [], []
+            while line_count < order_items:
+                order_id += 1
+                size = min(rng.randint(1, 6), order_items - line_count)
+                total = 0.0
+                for _ in range(size):
+                    product_id = min(int(rng.paretovariate(1.2)), products)
+                    quantity = rng.randint(1, 4)
+                    price = round(rng.uniform(60, 1500), 2)
+                    total += quantity * price
+                    lines.append({'order_id': order_id, 'product_id': product_id,
+                                  'quantity': quantity, 'price_each': price})
+                line_count += size
+                orders.append({'id': order_id, 'customer_id': rng.randint(2, max(customers, 2)),
+                               'total_price': round(total, 2), 'payment_method': rng.choice(['cash', 'gcash']),
+                               'status': rng.choice(STATUSES),
+                               'date_created': now - timedelta(minutes=rng.randrange(365 * 24 * 60))})
+
+                if len(lines) >= CHUNK:
+                    conn.execute(insert(Order), orders)
+                    conn.execute(insert(OrderItem), lines)
+                    orders, lines = [], []
+
+            if orders:
+                conn.execute(insert(Order), orders)
+                conn.execute(insert(OrderItem), lines)
+
+            rebuild_sales_rollups(conn)
+
+        rebuild_search_index()
+
+        with db.engine.connect() as conn:
+            conn.execute(text('ANALYZE'))
+
+    return order_id
+
@@ -0,0 +1,197 @@
+import html
+import os
+import random
+import re
+import threading
+import time
+from sqlalchemy import event, select
+from .datagen import BENCH_PASSWORD, FISH
+
+
+# Scripted visits. Every client is a Flask test client (or, for
+# `python -m bench http`, an HTTP session against a running server) with
+# its own session cookie, driven by one thread; each request is timed and
+# its SQL statements counted under a route label.
+ADMIN_EMAIL = 'admin@bench.local'
+CSRF_FIELD = re.compile(rb'name="csrf_token" type="hidden" value="([^"]+)"')
+MEDIA_LINK = re.compile(rb'src="\.?(/media/[^"]+)"')
+NEXT_PAGE_LINK = re.compile(rb'href="([^"]*[?&;]after=[^"]*)"')
+
+_counter = threading.local()
+
+
+def count_queries(engine):
+    # Statements run by the calling thread, reset before every timed request
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _count(conn, cursor, statement, parameters, context, executemany):
+        _counter.queries = getattr(_counter, 'queries', 0) + 1
+
+
+class HttpResponse:
+    # The parts of a test client response the flows use
+    def __init__(self, response):
+        self.response = response
+        self.status_code = response.status_code
+        self.headers = response.headers
+
+    def get_data(self):
+        return self.response.content
+
+    def close(self):
+        self.response.close()
+
+
+class HttpTransport:
+    # test_client().open() over a real connection, for a server in another
+    # process. Queries can't be counted from here: they are read from the
+    # X-SQL-Profile header when the server runs with SQL_PROFILER=1.
+    def __init__(self, base_url):
+        import requests
+        self.base_url = base_url.rstrip('/')
+        self.session = requests.Session()
+
+    def open(self, url, method='GET', data=None, follow_redirects=False, **kwargs):
+        response = self.session.request(method, self.base_url + url, data=data,
+                                        allow_redirects=follow_redirects, **kwargs)
+        profile = response.headers.get('X-SQL-Profile', '')
+        match = re.match(r'queries=(\d+)', profile)
+        _counter.queries = int(match.group(1)) if match else 0
+        return HttpResponse(response)
+
+    def get(self, url, **kwargs):
+        return self.open(url, 'GET', **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.open(url, 'POST', **kwargs)
+
+
+class Client:
+    def __init__(self, app, recorder, rng, base_url=None):
+        self.app = app
+        self.client = app.test_client() if base_url is None else HttpTransport(base_url)
+        self.recorder = recorder
+        self.rng = rng
+
+    def request(self, route, method, url, expect=(200, 302, 304), check=None, **kwargs):
+        # check(response) -> False also counts as an error
+        _counter.queries = 0
+        started = time.perf_counter()
+        response = self.client.open(url, method=method, **kwargs)
+        elapsed = time.perf_counter() - started
+        body = response.get_data()
+        error = response.status_code not in expect or (check is not None and not check(response))
+        self.recorder.record(route, elapsed, _counter.queries, error)
+        response.close()
+        return response, body
+
+    def login_form(self, email):
+        # Not timed. A server in another process checks the CSRF token.
+        data = {'email': email, 'password': BENCH_PASSWORD}
+        token = CSRF_FIELD.search(self.client.get('/login').get_data())
+        if token:
+            data['csrf_token'] = token.group(1).decode()
+        return data
+
+    def login(self, email):
+        # Setup, not timed
+        response = self.client.post('/login', data=self.login_form(email))
+        if response.status_code != 302:
+            raise RuntimeError(f'could not log in as {email}')
+
+
+########################################
+# FLOWS
+########################################
+def browse(client, products):
+    # Anonymous visitor: home page and a few of its pictures, typeahead, a search
+    term = client.rng.choice(FISH)
+    response, body = client.request('home', 'GET', '/')
+    pictures = MEDIA_LINK.findall(body)
+    for picture in client.rng.sample(pictures, min(len(pictures), 2)):
+        client.request('media', 'GET', picture.decode().replace('&amp;', '&'))
+    for length in range(2, min(len(term), 4) + 1):
+        client.request('search_suggest', 'GET', f'/search/suggest?q={term[:length]}')
+    client.request('search', 'POST', '/search', data={'search': term})
+
+
+def shop(client, products):
+    # Signed-in customer: browse, fill the cart, change it, check out
+    from website.models import Cart
+    from website import db
+
+    client.request('home', 'GET', '/')
+    client.request('search', 'POST', '/search', data={'search': client.rng.choice(FISH)})
+
+    for _ in range(client.rng.randint(1, 3)):
+        product_id = min(int(client.rng.paretovariate(1.2)), products)
+        client.request('add_to_cart', 'GET', f'/add-to-cart/{product_id}')
+    client.request('cart', 'GET', '/cart')
+
+    with client.app.app_context():
+        item_ids = db.session.scalars(select(Cart.id).where(Cart.customer_link == client.customer_id)).all()
+    for item_id in client.rng.sample(item_ids, min(len(item_ids), 2)):
+        client.request('update_cart', 'POST', '/update-cart', data={'item_id': item_id, 'action': 'plus'})
+
+    client.request('checkout', 'GET', '/checkout')
+    client.request('place_order', 'POST', '/place-order', data={'payment_method': 'cash'})
+    client.request('orders', 'GET', '/orders')
+
+
+def administer(client, products):
+    # Admin: dashboard and the paginated order and customer lists
+    client.request('admin_page', 'GET', '/admin-page')
+    # Keyset pagination: deeper pages are reached through each page's
+    # "Next" link (?after=<cursor>), as an admin clicking through would
+    _, body = client.request('view_orders', 'GET', '/view-orders')
+    for _ in range(client.rng.randint(1, 5)):
+        link = NEXT_PAGE_LINK.search(body)
+        if link is None:
+            break
+        _, body = client.request('view_orders', 'GET', html.unescape(link.group(1).decode()))
+    client.request('customers', 'GET', '/customers')
+
+
+def view_pictures(client, products):
+    # Product photos as browsers fetch them: a first visit, a revalidation
+    # with the ETag, and a byte range
+    picture = client.rng.choice(client.pictures)
+    response, _ = client.request('media', 'GET', picture)
+    etag = response.headers.get('ETag')
+    if etag:
+        client.request('media_304', 'GET', picture, expect=(304,), headers={'If-None-Match': etag})
+    client.request('media_range', 'GET', picture, expect=(206,), headers={'Range': 'bytes=0-4095'})
+
+
+def log_in(client, products):
+    # Login storm next to the other traffic: every login verifies the
+    # password with the configured hash method. A login that found every
+    # hashing slot busy is sent back to /login and counts as an error.
+    client.request('login', 'POST', '/login', data=client.login_form(client.email),
+                   check=lambda response: not response.headers.get('Location', '').endswith('/login'))
+    client.request('logout', 'GET', '/logout')
+
+
+def _pictures(app):
+    # Originals only, not the resized derivatives
+    directory = os.path.join(app.root_path, '..', 'media')
+    return sorted(f'/media/{name}' for name in os.listdir(directory) if name.count('.') == 1)
+
+
+FLOWS = {'browse': browse, 'shop': shop, 'admin': administer, 'media': view_pictures, 'login': log_in}
+
+
+def make_client(app, recorder, role, index, customers, seed, base_url=None):
+    client = Client(app, recorder, random.Random(f'{seed}:{role}:{index}'), base_url)
+    client.role = role
+    if role == 'shop':
+        # Shoppers use distinct accounts so their carts don't collide
+        client.customer_id = 2 + index % max(customers - 1, 1)
+        client.login(f'customer{client.customer_id}@bench.local')
+    elif role == 'admin':
+        client.login(ADMIN_EMAIL)
+    elif role == 'media':
+        client.pictures = _pictures(app)
+    elif role == 'login':
+        # Taken from the other end of the customer ids than the shoppers'
+        client.email = f'customer{customers - index % max(customers - 1, 1)}@bench.local'
+    return client
@@ -0,0 +1,99 @@
+import json
+import math
+import subprocess
+import threading
+
+
+# Result files are plain JSON so two commits can be compared with
+# `python -m bench compare old.json new.json` or any other tool.
+PERCENTILES = (50, 95, 99)
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.routes = {}
+
+    def record(self, route, seconds, queries, error):
+        with self._lock:
+            samples = self.routes.setdefault(route, {'latencies': [], 'queries': 0, 'errors': 0})
+            samples['latencies'].append(seconds)
+            samples['queries'] += queries
+            samples['errors'] += error
+
+
+def percentile(ordered, p):
+    # Nearest rank on an already sorted list
+    if not ordered:
+        return 0.0
+    rank = max(math.ceil(p / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+def _summary(latencies, queries, errors, duration):
+    ordered = sorted(latencies)
+    count = len(ordered)
+    summary = {
+        'requests': count,
+        'errors': errors,
+        'throughput': round(count / duration, 2),
+        'mean_ms': round(sum(ordered) / count * 1000, 2) if count else 0.0,
+        'queries_per_request': round(queries / count, 2) if count else 0.0,
+    }
+    for p in PERCENTILES:
+        summary[f'p{p}_ms'] = round(percentile(ordered, p) * 1000, 2)
+    return summary
+
+
+def summarize(recorder, duration):
+    routes = {route: _summary(samples['latencies'], samples['queries'], samples['errors'], duration)
+              for route, samples in sorted(recorder.routes.items())}
+
+    latencies = [latency for samples in recorder.routes.values() for latency in samples['latencies']]
+    queries = sum(samples['queries'] for samples in recorder.routes.values())
+    errors = sum(samples['errors'] for samples in recorder.routes.values())
+    return routes, _summary(latencies, queries, errors, duration)
+
+
+def git_revision():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                                capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'],
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ('-dirty' if dirty else '')
+
+
+########################################
+# OUTPUT
+########################################
+def print_table(result, echo):
+    echo(f"{'route':<16}{'requests':>9}{'errors':>7}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}"
+         f"{'p99 ms':>9}{'queries':>9}")
+    for route, row in list(result['routes'].items()) + [('TOTAL', result['total'])]:
+        echo(f"{route:<16}{row['requests']:>9}{row['errors']:>7}{row['throughput']:>9.1f}{row['p50_ms']:>9.1f}"
+             f"{row['p95_ms']:>9.1f}{row['p99_ms']:>9.1f}{row['queries_per_request']:>9.1f}")
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(old, new, echo):
+    # Relative change per route: lower latency and queries, higher req/s are better
+    def change(before, after):
+        if not before:
+            return '      n/a'
+        return f'{(after - before) / before * 100:+8.1f}%'
+
+    echo(f"{old['meta'].get('revision')} -> {new['meta'].get('revision')}")
+    echo(f"{'route':<16}{'p50':>9}{'p95':>9}{'p99':>9}{'req/s':>9}{'queries':>9}")
+    routes = [route for route in new['routes'] if route in old['routes']]
+    for route in routes + ['TOTAL']:
+        before = old['total'] if route == 'TOTAL' else old['routes'][route]
+        after = new['total'] if route == 'TOTAL' else new['routes'][route]
+        echo(f"{route:<16}" + ''.join(change(before[key], after[key]) for key in
+                                     ('p50_ms', 'p95_ms', 'p99_ms', 'throughput', 'queries_per_request')))
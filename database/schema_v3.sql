@@ -0,0 +1,102 @@
+-- ============================================
+-- Schema v3
+-- Matches website/models.py and the migrations in website/migrations.py.
+-- Existing databases are upgraded with `flask db upgrade` (also run on start-up).
+-- ============================================
+
+-- ============================================
+-- Customer Table
+-- Stores customer account information
+-- ============================================
+CREATE TABLE customer (
+	id INTEGER NOT NULL, 
+	email VARCHAR(100), 
+	username VARCHAR(100), 
+	password_hash VARCHAR(150), 
+	date_joined DATETIME, 
+	PRIMARY KEY (id), 
+	UNIQUE (email)
+);
+
+CREATE INDEX ix_customer_date_joined ON customer (date_joined, id);
+
+-- ============================================
+-- Product Table
+-- Stores fish and sea product inventory
+-- ============================================
+CREATE TABLE product (
+	id INTEGER NOT NULL, 
+	product_name VARCHAR(100) NOT NULL, 
+	current_price FLOAT NOT NULL, 
+	previous_price FLOAT NOT NULL, 
+	in_stock INTEGER NOT NULL, 
+	product_picture VARCHAR(1000) NOT NULL, 
+	flash_sale BOOLEAN, 
+	date_added DATETIME, 
+	PRIMARY KEY (id)
+);
+
+CREATE INDEX ix_product_date_added ON product (date_added, id);
+
+-- ============================================
+-- Cart Table
+-- Stores customer shopping cart items
+-- One row per customer/product (add_to_cart upserts on this key)
+-- ============================================
+CREATE TABLE cart (
+	id INTEGER NOT NULL, 
+	quantity INTEGER NOT NULL, 
+	customer_link INTEGER NOT NULL, 
+	product_link INTEGER NOT NULL, 
+	PRIMARY KEY (id), 
+	FOREIGN KEY(customer_link) REFERENCES customer (id), 
+	FOREIGN KEY(product_link) REFERENCES product (id)
+);
+
+CREATE UNIQUE INDEX uq_cart_customer_product ON cart (customer_link, product_link);
+
+-- ============================================
+-- Orders Table
+-- Stores completed customer orders
+-- created_at was folded into date_created (the column models.py uses).
+-- ============================================
+CREATE TABLE orders (
+	id INTEGER PRIMARY KEY AUTOINCREMENT,
+	customer_id INTEGER NOT NULL,
+	total_price FLOAT NOT NULL DEFAULT 0,
+	payment_method VARCHAR(100),
+	status VARCHAR(50) DEFAULT 'pending',
+	payment_reference VARCHAR(200),
+	date_created DATETIME,
+	FOREIGN KEY(customer_id) REFERENCES customer(id)
+);
+
+CREATE INDEX ix_orders_customer_date ON orders (customer_id, date_created);
+CREATE INDEX ix_orders_date_created ON orders (date_created, id);
+
+-- ============================================
+-- Order Items Table
+-- Stores individual items within each order
+-- ============================================
+CREATE TABLE order_items (
+	id INTEGER PRIMARY KEY AUTOINCREMENT,
+	order_id INTEGER NOT NULL,
+	product_id INTEGER NOT NULL,
+	quantity INTEGER NOT NULL,
+	price_each FLOAT,
+	FOREIGN KEY(order_id) REFERENCES orders(id),
+	FOREIGN KEY(product_id) REFERENCES product(id)
+);
+
+CREATE INDEX ix_order_items_order ON order_items (order_id);
+
+-- ============================================
+-- Schema Migrations Table
+-- Versions applied by website/migrations.py
+-- ============================================
+CREATE TABLE schema_migrations (
+	version INTEGER NOT NULL,
+	name VARCHAR(200),
+	applied_at DATETIME,
+	PRIMARY KEY (version)
+);
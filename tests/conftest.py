@@ -0,0 +1,152 @@
+import threading
+import pytest
+from sqlalchemy import event
+
+
+# Every test gets its own app on a temporary SQLite file and instance
+# folder, migrated the way production starts (AUTO_MIGRATE). Job workers
+# are off and passwords use a cheap hash.
+TEST_PASSWORD = 'test-password'
+TEST_ENV = {
+    'JOB_WORKERS': '0',
+    'AUTO_MIGRATE': '1',
+    'PASSWORD_HASH_METHOD': 'pbkdf2:sha256:1000',
+    'TEMPLATE_BYTECODE_CACHE': '0',
+    'TEMPLATE_PRECOMPILE': '0',
+}
+BUYERS = 12    # concurrent checkouts in the oversell tests
+
+
+@pytest.fixture
+def make_app(tmp_path, monkeypatch):
+    created = []
+
+    def make(**env):
+        for name, value in {**TEST_ENV, **env}.items():
+            monkeypatch.setenv(name, value)
+        monkeypatch.setenv('DATABASE_URL', f"sqlite:///{tmp_path / 'test.sqlite3'}")
+
+        from website import create_app
+        app = create_app(instance_path=str(tmp_path / 'instance'))
+        app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+        created.append(app)
+        return app
+
+    yield make
+
+    from website import db
+    for app in created:
+        with app.app_context():
+            db.session.remove()
+            db.engine.dispose()
+
+
+@pytest.fixture
+def app(make_app):
+    return make_app()
+
+
+@pytest.fixture
+def make_customer(app):
+    from website import db
+    from website.models import Customer
+
+    def make(email=None, username='tester'):
+        with app.app_context():
+            # The first account is the admin (id 1), like in production
+            if db.session.get(Customer, 1) is None:
+                admin = Customer(email='admin@test.local', username='admin')
+                admin.password = TEST_PASSWORD
+                db.session.add(admin)
+                db.session.commit()
+            count = db.session.query(Customer).count()
+            customer = Customer(email=email or f'customer{count}@test.local', username=username)
+            customer.password = TEST_PASSWORD
+            db.session.add(customer)
+            db.session.commit()
+            return customer.id, customer.email
+
+    return make
+
+
+@pytest.fixture
+def make_product(app):
+    from website import db
+    from website.models import Product
+
+    def make(name='Tuna', price=100.0, stock=10, flash_sale=False):
+        with app.app_context():
+            product = Product(product_name=name, current_price=price, previous_price=price, in_stock=stock,
+                              product_picture='./media/tuna.jpg', flash_sale=flash_sale)
+            db.session.add(product)
+            db.session.commit()
+            return product.id
+
+    return make
+
+
+@pytest.fixture
+def fill_cart(app):
+    from website import db
+    from website.models import Cart
+
+    def fill(customer_id, quantities):
+        # quantities: {product_id: quantity}
+        with app.app_context():
+            db.session.add_all([Cart(customer_link=customer_id, product_link=product_id, quantity=quantity)
+                                for product_id, quantity in quantities.items()])
+            db.session.commit()
+
+    return fill
+
+
+@pytest.fixture
+def statements(app):
+    # Every SQL statement the app's engine runs, for query-count tests
+    from website import db
+
+    seen = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        seen.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', record)
+    yield seen
+    event.remove(engine, 'before_cursor_execute', record)
+
+
+def login(client, email):
+    response = client.post('/login', data={'email': email, 'password': TEST_PASSWORD})
+    assert response.status_code == 302, f'could not log in as {email}'
+    return client
+
+
+def checkout_concurrently(app, customers):
+    # Every customer checks out at once, each from its own thread. Returns
+    # {customer_id: 'ordered' | ('short', [product ids]) | ('error', repr)}
+    from website import db
+    from website.checkout import place_cart_order, InsufficientStock
+
+    barrier = threading.Barrier(len(customers))
+    outcomes = {}
+
+    def buy(customer_id):
+        with app.app_context():
+            barrier.wait()
+            try:
+                outcomes[customer_id] = 'ordered' if place_cart_order(customer_id, 'cash') else 'empty'
+            except InsufficientStock as e:
+                outcomes[customer_id] = ('short', [s.product_id for s in e.shortages])
+            except Exception as e:
+                outcomes[customer_id] = ('error', repr(e))
+            finally:
+                db.session.remove()
+
+    threads = [threading.Thread(target=buy, args=(customer_id,)) for customer_id in customers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return outcomes
@@ -0,0 +1,65 @@
+import threading
+import pytest
+from conftest import login
+
+
+ADMISSION_ENV = {
+    'ADMISSION_CONTROL': '1',
+    'ADMISSION_CUSTOMER_RATE': '0.01',
+    'ADMISSION_CUSTOMER_BURST': '2',
+}
+
+
+def test_every_cart_write_is_guarded(make_app, make_customer, make_product, fill_cart):
+    from website import db
+    from website.models import Cart
+
+    app = make_app(**ADMISSION_ENV)
+    customer_id, email = make_customer()
+    product = make_product(stock=100)
+    fill_cart(customer_id, {product: 5})
+    with app.app_context():
+        item = db.session.query(Cart.id).filter_by(customer_link=customer_id).scalar()
+
+    requests = {
+        'views.add_to_cart': lambda client: client.get(f'/add-to-cart/{product}'),
+        'views.plus_cart': lambda client: client.get(f'/pluscart?item_id={item}'),
+        'views.minus_cart': lambda client: client.get(f'/minuscart?item_id={item}'),
+        'views.update_cart': lambda client: client.post('/update-cart', data={'item_id': item, 'action': 'plus'}),
+        'views.cart_batch': lambda client: client.post('/cart/batch', json={'ops': [{'item_id': item, 'delta': 1}]}),
+        'views.remove_from_cart': lambda client: client.get(f'/remove-from-cart/{item}'),
+        'views.place_order': lambda client: client.post('/place-order', data={'payment_method': 'cash'}),
+    }
+    assert set(requests) <= set(app.config['ADMISSION_ROUTES'])
+
+    client = login(app.test_client(), email)
+    # The customer's bucket holds two tokens and barely refills
+    statuses = [requests[endpoint](client).status_code for endpoint in requests]
+    assert statuses[2:] == [429] * (len(requests) - 2)
+    assert 429 not in statuses[:2]
+    assert client.get('/cart').status_code == 200
+
+
+@pytest.mark.parametrize('name', ['ADMISSION_CUSTOMER_RATE', 'ADMISSION_IP_RATE'])
+def test_zero_rate_is_refused_at_startup(make_app, name):
+    with pytest.raises(ValueError, match=name):
+        make_app(**{**ADMISSION_ENV, name: '0'})
+
+
+def test_waiter_is_admitted_when_a_slot_frees(make_app):
+    from website.admission import admission_store
+
+    app = make_app(**ADMISSION_ENV)
+    with app.app_context():
+        store = admission_store()
+    held = store.acquire_slot(1, 1, 1, 1)
+
+    admitted = []
+    waiter = threading.Thread(target=lambda: admitted.append(store.acquire_slot(1, 1, 5, 1)))
+    waiter.start()
+    threading.Timer(0.3, store.release_slot, args=(held,)).start()
+    waiter.join()
+
+    assert len(admitted) == 1
+    stats = store.stats()
+    assert (stats['queued'], stats['queue_timeouts'], stats['running'], stats['waiting']) == (1, 0, 1, 0)
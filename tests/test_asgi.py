@@ -0,0 +1,38 @@
+import asyncio
+import pytest
+from conftest import login
+
+pytest.importorskip('aiosqlite')
+pytest.importorskip('httpx')
+
+
+def _on_event_loop():
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+def test_flask_code_runs_off_the_event_loop(app, make_customer, make_product, fill_cart):
+    from starlette.testclient import TestClient
+    from website.asgi import create_asgi_app
+
+    calls = []
+    app.before_request(lambda: calls.append(('before_request', _on_event_loop())))
+    app.context_processor(lambda: calls.append(('template', _on_event_loop())) or {})
+
+    customer_id, email = make_customer()
+    fill_cart(customer_id, {make_product(): 1})
+
+    with TestClient(create_asgi_app(app), follow_redirects=False) as client:
+        login(client, email)
+        calls.clear()
+        for url in ('/', '/orders'):
+            response = client.get(url)
+            assert response.status_code == 200
+        response = client.post('/search', data={'search': 'tuna'})
+        assert response.status_code == 200
+
+    assert {name for name, _ in calls} == {'before_request', 'template'}
+    assert [call for call in calls if call[1]] == []
@@ -0,0 +1,38 @@
+import re
+import pytest
+
+
+@pytest.fixture
+def static_app(app, tmp_path, monkeypatch):
+    from website import assets
+
+    static = tmp_path / 'static'
+    (static / 'css').mkdir(parents=True)
+    (static / 'images').mkdir()
+    (static / 'images' / 'wave.png').write_bytes(b'\x89PNG wave')
+    (static / 'css' / 'style.css').write_text(
+        "body { background: url('../images/wave.png') }\n"
+        "@font-face { src: url(../webfonts/fish.eot?#iefix), url(data:font/woff2;base64,AAAA) }\n")
+    monkeypatch.setattr(assets, 'BUNDLES', {'site.css': ['css/style.css']})
+    app.static_folder = str(static)
+    return app
+
+
+def test_bundled_css_points_at_fingerprinted_files(static_app):
+    from website.assets import build_assets
+
+    manifest = build_assets(static_app)
+    [part] = manifest['bundles']['site.css']
+    client = static_app.test_client()
+    css = client.get(f"/assets/{part['file']}").get_data(as_text=True)
+
+    image = manifest['files']['images/wave.png']
+    assert re.fullmatch(r'images/wave\.[0-9a-f]{12}\.png', image)
+    assert f"url('/assets/{image}')" in css
+    # Not in static/: left on its plain URL, suffix kept
+    assert 'url(/static/webfonts/fish.eot?#iefix)' in css
+    assert 'url(data:font/woff2;base64,AAAA)' in css
+
+    response = client.get(f'/assets/{image}')
+    assert response.status_code == 200
+    assert 'immutable' in response.headers['Cache-Control']
@@ -0,0 +1,29 @@
+from click.testing import CliRunner
+from conftest import TEST_ENV
+
+
+def test_datagen_builds_a_small_database(tmp_path, monkeypatch):
+    from bench.__main__ import bench
+    from website import db
+    from website.models import Customer, OrderItem, Product
+
+    for name, value in TEST_ENV.items():
+        monkeypatch.setenv(name, value)
+    # bench_app() points these at the bench database; undone after the test
+    monkeypatch.setenv('DATABASE_URL', '')
+    monkeypatch.setenv('PASSWORD_HASH_METHOD', '')
+    monkeypatch.chdir(tmp_path)
+
+    db_path = tmp_path / 'bench.sqlite3'
+    result = CliRunner().invoke(bench, ['datagen', '--db', str(db_path), '--products', '5', '--customers', '3',
+                                        '--order-items', '20'])
+    assert result.exit_code == 0, result.output
+    assert '5 products, 3 customers' in result.output
+
+    from bench.datagen import bench_app
+    app = bench_app(str(db_path))
+    with app.app_context():
+        assert db.session.query(Product).count() == 5
+        assert db.session.query(Customer).count() == 3
+        assert db.session.query(OrderItem).count() == 20
+        db.engine.dispose()
@@ -0,0 +1,67 @@
+import pytest
+from conftest import login
+
+
+# Cart routes load the rows with one joined query and total them in SQL,
+# and checkout writes its per-line rows with executemany, so the number of
+# statements must not depend on the number of lines.
+def _cart_with(app, make_customer, make_product, fill_cart, lines):
+    customer_id, email = make_customer()
+    products = [make_product(name=f'Fish {i}', price=10.0 + i) for i in range(lines)]
+    fill_cart(customer_id, {product_id: 2 for product_id in products})
+    with app.app_context():
+        from website import db
+        from website.models import Cart
+        items = [item_id for item_id, in db.session.query(Cart.id).filter_by(customer_link=customer_id)]
+    return customer_id, login(app.test_client(), email), items
+
+
+@pytest.mark.parametrize('request_for, status', [
+    (lambda client, items: client.get('/cart'), 200),
+    (lambda client, items: client.get('/checkout'), 200),
+    (lambda client, items: client.get(f'/pluscart?item_id={items[0]}'), 200),
+    (lambda client, items: client.get(f'/minuscart?item_id={items[0]}'), 200),
+    (lambda client, items: client.post('/update-cart', data={'item_id': items[0], 'action': 'plus'}), 200),
+    (lambda client, items: client.post('/cart/batch', json={'ops': [{'item_id': item, 'delta': 1} for item in items]}),
+     200),
+], ids=['cart', 'checkout', 'pluscart', 'minuscart', 'update_cart', 'cart_batch'])
+def test_cart_queries_do_not_grow_with_the_cart(app, make_customer, make_product, fill_cart, statements,
+                                                request_for, status):
+    counts = {}
+    for lines in (1, 15):
+        _, client, items = _cart_with(app, make_customer, make_product, fill_cart, lines)
+        statements.clear()
+        assert request_for(client, items).status_code == status
+        counts[lines] = len(statements)
+
+    assert counts[1] == counts[15], counts
+
+
+def test_place_order_queries_do_not_grow_with_the_cart(app, make_customer, make_product, fill_cart, statements):
+    from website import db
+    from website.models import Cart, Order, OrderItem
+
+    counts = {}
+    for lines in (1, 15):
+        customer_id, client, _ = _cart_with(app, make_customer, make_product, fill_cart, lines)
+        statements.clear()
+        assert client.post('/place-order', data={'payment_method': 'cash'}).status_code == 302
+        counts[lines] = len(statements)
+
+        with app.app_context():
+            [order] = db.session.query(Order).filter_by(customer_id=customer_id).all()
+            items = db.session.query(OrderItem).filter_by(order_id=order.id).all()
+            assert sorted(item.quantity for item in items) == [2] * lines
+            assert db.session.query(Cart).filter_by(customer_link=customer_id).count() == 0
+
+    assert counts[1] == counts[15], counts
+
+
+def test_cart_totals_are_computed_in_sql(app, make_customer, make_product, fill_cart):
+    from website.cart import cart_totals
+
+    customer_id, _ = make_customer()
+    fill_cart(customer_id, {make_product(price=12.5): 2, make_product(price=3.0): 5})
+
+    with app.app_context():
+        assert cart_totals(customer_id) == (40.0, 7, 2)
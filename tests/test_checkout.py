@@ -0,0 +1,72 @@
+import pytest
+from conftest import BUYERS, checkout_concurrently
+
+
+@pytest.mark.parametrize('stock', [1, 5])
+def test_concurrent_checkouts_never_oversell(app, make_customer, make_product, fill_cart, stock):
+    from website import db
+    from website.models import Cart, Order, OrderItem, Product
+
+    hot = make_product(name='Hot Tuna', stock=stock)
+    plenty = make_product(name='Salmon', stock=1000)
+    customers = [make_customer()[0] for _ in range(BUYERS)]
+    for customer_id in customers:
+        fill_cart(customer_id, {hot: 1, plenty: 2})
+
+    outcomes = checkout_concurrently(app, customers)
+
+    assert not [o for o in outcomes.values() if o[0] == 'error'], outcomes
+    ordered = [customer_id for customer_id, o in outcomes.items() if o == 'ordered']
+    assert len(ordered) == stock
+    # Losers are told which product ran out
+    assert all(o == ('short', [hot]) for customer_id, o in outcomes.items() if customer_id not in ordered)
+
+    with app.app_context():
+        assert db.session.get(Product, hot).in_stock == 0
+        # A failed checkout rolls back everything, the other product's stock included
+        assert db.session.get(Product, plenty).in_stock == 1000 - 2 * stock
+        assert db.session.query(Order).count() == stock
+        assert db.session.query(OrderItem).filter_by(product_id=hot).count() == stock
+        # Winners' carts are emptied, losers keep theirs
+        for customer_id in customers:
+            lines = db.session.query(Cart).filter_by(customer_link=customer_id).count()
+            assert lines == (0 if customer_id in ordered else 2)
+
+
+def test_shortage_report_names_every_short_product(app, make_customer, make_product, fill_cart):
+    from website import db
+    from website.checkout import place_cart_order, InsufficientStock
+    from website.models import Order
+
+    short = make_product(name='Squid', stock=1)
+    empty = make_product(name='Crab', stock=0)
+    fine = make_product(name='Clams', stock=5)
+    customer_id, _ = make_customer()
+    fill_cart(customer_id, {short: 3, empty: 1, fine: 1})
+
+    with app.app_context():
+        with pytest.raises(InsufficientStock) as raised:
+            place_cart_order(customer_id, 'cash')
+        assert {(s.product_name, s.requested, s.available) for s in raised.value.shortages} == \
+            {('Squid', 3, 1), ('Crab', 1, 0)}
+        assert db.session.query(Order).count() == 0
+
+
+def test_checkout_adds_to_the_product_sales_rollup(app, make_customer, make_product, fill_cart):
+    from website import db
+    from website.checkout import place_cart_order
+    from website.models import SalesProduct
+
+    tuna = make_product(name='Tuna', price=10.0)
+    crab = make_product(name='Crab', price=4.0)
+    first, _ = make_customer()
+    second, _ = make_customer()
+    fill_cart(first, {tuna: 2, crab: 1})
+    fill_cart(second, {tuna: 1})
+
+    with app.app_context():
+        # The second order updates a row the first one created
+        place_cart_order(first, 'cash')
+        place_cart_order(second, 'cash')
+        assert {row.product_id: (row.units, row.revenue) for row in db.session.query(SalesProduct)} == \
+            {tuna: (3, 30.0), crab: (1, 4.0)}
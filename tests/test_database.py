@@ -0,0 +1,102 @@
+import threading
+from sqlalchemy.pool import QueuePool
+from conftest import login
+
+
+def test_sqlite_engine_uses_a_tuned_queue_pool(make_app):
+    from website import db
+
+    app = make_app(DB_POOL_SIZE='3', DB_MAX_OVERFLOW='2')
+    with app.app_context():
+        pool = db.engine.pool
+        assert isinstance(pool, QueuePool)
+        assert pool.size() == 3
+        assert pool._max_overflow == 2
+
+        with db.engine.connect() as conn:
+            raw = conn.connection.dbapi_connection
+            assert raw.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+            assert raw.execute('PRAGMA busy_timeout').fetchone()[0] == 5000
+            assert raw.execute('PRAGMA synchronous').fetchone()[0] == 1   # NORMAL
+
+
+def test_database_url_is_normalised(monkeypatch):
+    from website.database import database_uri
+
+    monkeypatch.setenv('DATABASE_URL', 'postgres://shop:pw@db/aquashop')
+    assert database_uri('sqlite:///default.sqlite3') == 'postgresql://shop:pw@db/aquashop'
+    monkeypatch.delenv('DATABASE_URL')
+    assert database_uri('sqlite:///default.sqlite3') == 'sqlite:///default.sqlite3'
+
+
+def test_engine_options_per_dialect(monkeypatch):
+    from website.database import engine_options
+
+    monkeypatch.setenv('DB_POOL_RECYCLE', '60')
+    sqlite = engine_options('sqlite:///shop.sqlite3')
+    assert sqlite['connect_args'] == {'check_same_thread': False}
+    assert 'pool_pre_ping' not in sqlite
+    assert sqlite['pool_recycle'] == 60
+
+    postgres = engine_options('postgresql://shop@db/aquashop')
+    assert postgres['pool_pre_ping'] is True
+    assert 'connect_args' not in postgres
+    assert postgres['pool_size'] == 5
+
+    for uri in ('sqlite://', 'sqlite:///:memory:', 'sqlite:///file:shop?mode=memory&uri=true'):
+        memory = engine_options(uri)
+        assert not {'pool_size', 'max_overflow', 'pool_timeout'} & set(memory), uri
+        assert memory['connect_args'] == {'check_same_thread': False}
+
+
+def test_app_starts_on_an_in_memory_database(tmp_path, monkeypatch):
+    from conftest import TEST_ENV
+    from website import create_app, db
+    from website.models import Product
+
+    for name, value in TEST_ENV.items():
+        monkeypatch.setenv(name, value)
+    monkeypatch.setenv('DATABASE_URL', 'sqlite://')
+
+    app = create_app(instance_path=str(tmp_path / 'instance'))
+    with app.app_context():
+        assert not isinstance(db.engine.pool, QueuePool)
+        # Migrated, and every request thread sees the same database
+        assert db.session.query(Product).count() == 0
+        db.session.remove()
+        db.engine.dispose()
+
+
+CLIENTS = 8
+
+
+def test_parallel_cart_updates_all_land(app, make_customer, make_product, fill_cart):
+    from website import db
+    from website.models import Cart
+
+    product = make_product(stock=1000)
+    customers = [make_customer() for _ in range(CLIENTS)]
+    for customer_id, email in customers:
+        fill_cart(customer_id, {product: 1})
+    with app.app_context():
+        items = {customer_id: db.session.query(Cart.id).filter_by(customer_link=customer_id).scalar()
+                 for customer_id, email in customers}
+
+    barrier = threading.Barrier(CLIENTS)
+    statuses = []
+
+    def shop(customer_id, email):
+        client = login(app.test_client(), email)
+        barrier.wait()
+        for _ in range(5):
+            statuses.append(client.get(f'/pluscart?item_id={items[customer_id]}').status_code)
+
+    threads = [threading.Thread(target=shop, args=customer) for customer in customers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert statuses == [200] * CLIENTS * 5
+    with app.app_context():
+        assert [line.quantity for line in db.session.query(Cart)] == [6] * CLIENTS
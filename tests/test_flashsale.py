@@ -0,0 +1,47 @@
+import pytest
+from conftest import BUYERS, checkout_concurrently
+
+
+@pytest.fixture
+def app(make_app):
+    return make_app(FLASH_SALE_INVENTORY='1')
+
+
+@pytest.mark.parametrize('stock', [1, 5])
+def test_hot_sku_is_never_oversold(app, make_customer, make_product, fill_cart, stock):
+    from website import db
+    from website.catalog import catalog_version
+    from website.flashsale import flush_flash_stock, reload_flash_stock, token_store
+    from website.models import Order, Product
+
+    hot = make_product(name='Bluefin', stock=stock, flash_sale=True)
+    plenty = make_product(name='Salmon', stock=1000)
+    customers = [make_customer()[0] for _ in range(BUYERS)]
+    for customer_id in customers:
+        fill_cart(customer_id, {hot: 1, plenty: 1})
+    with app.app_context():
+        reload_flash_stock()
+
+    outcomes = checkout_concurrently(app, customers)
+
+    assert not [o for o in outcomes.values() if o[0] == 'error'], outcomes
+    ordered = [customer_id for customer_id, o in outcomes.items() if o == 'ordered']
+    assert len(ordered) == stock
+    assert all(o == ('short', [hot]) for customer_id, o in outcomes.items() if customer_id not in ordered)
+
+    with app.app_context():
+        assert token_store().stats()[hot] == {'available': 0, 'reserved': stock, 'released': 0}
+        # The hot row is only written by the flush, which also invalidates cached pages
+        assert db.session.get(Product, hot).in_stock == stock
+        version = catalog_version()
+        assert flush_flash_stock() == 1
+        assert catalog_version() != version
+
+        assert db.session.get(Product, hot).in_stock == 0
+        assert db.session.get(Product, plenty).in_stock == 1000 - stock
+        assert db.session.query(Order).count() == stock
+
+        # Nothing new to apply: no second bump
+        version = catalog_version()
+        assert flush_flash_stock() == 0
+        assert catalog_version() == version
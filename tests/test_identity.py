@@ -0,0 +1,166 @@
+import threading
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from conftest import TEST_PASSWORD, login
+
+
+def _customer_reads(statements):
+    return [s for s in statements if 'FROM customer' in s]
+
+
+########################################
+# SESSION-CACHED IDENTITY
+########################################
+def test_logged_in_requests_do_not_load_the_customer(app, make_customer, make_product, fill_cart, statements):
+    customer_id, email = make_customer()
+    fill_cart(customer_id, {make_product(): 2})
+    client = login(app.test_client(), email)
+
+    statements.clear()
+    for url in ('/', '/cart', '/orders'):
+        assert client.get(url).status_code == 200
+    assert _customer_reads(statements) == []
+
+
+def test_identity_is_rechecked_after_its_ttl(app, make_customer, statements):
+    customer_id, email = make_customer()
+    client = login(app.test_client(), email)
+
+    app.config['IDENTITY_TTL'] = 0
+    statements.clear()
+    assert client.get('/').status_code == 200
+    assert len(_customer_reads(statements)) == 1
+
+
+def _change_password(client, customer_id, new_password):
+    response = client.post(f'/change-password/{customer_id}', data={
+        'current_password': TEST_PASSWORD,
+        'new_password': new_password,
+        'confirm_new_password': new_password,
+    })
+    assert response.status_code == 302
+
+
+def test_password_change_elsewhere_logs_the_session_out(app, make_customer):
+    customer_id, email = make_customer()
+    other = login(app.test_client(), email)
+    client = login(app.test_client(), email)
+
+    _change_password(client, customer_id, 'another-password')
+    assert client.get(f'/profile/{customer_id}').status_code == 200
+
+    # A sensitive route checks right away, without waiting for the TTL
+    response = other.get(f'/profile/{customer_id}')
+    assert response.status_code == 302
+    assert response.headers['Location'].startswith('/login')
+    # Stays logged out once the identity has been dropped
+    assert other.get('/cart').status_code == 302
+
+
+def test_rehash_at_login_keeps_other_sessions(app, make_customer):
+    from website import db
+    from website.models import Customer
+    from website.passwords import normalize_method, password_hasher
+
+    customer_id, email = make_customer()
+    other = login(app.test_client(), email)
+
+    with app.app_context():
+        password_hasher().method = normalize_method('pbkdf2:sha256:2000')
+        old_hash = db.session.get(Customer, customer_id).password_hash
+    login(app.test_client(), email)
+
+    with app.app_context():
+        assert db.session.get(Customer, customer_id).password_hash != old_hash
+    app.config['IDENTITY_TTL'] = 0
+    assert other.get(f'/profile/{customer_id}').status_code == 200
+    assert other.get('/cart').status_code == 200
+
+
+def test_sensitive_routes_pick_up_profile_edits(app, make_customer):
+    from website import db
+    from website.models import Customer
+
+    customer_id, email = make_customer(username='before')
+    client = login(app.test_client(), email)
+
+    with app.app_context():
+        db.session.get(Customer, customer_id).username = 'after'
+        db.session.commit()
+
+    assert client.get(f'/profile/{customer_id}').status_code == 200
+    with client.session_transaction() as session:
+        assert session['identity']['username'] == 'after'
+
+
+########################################
+# LOCK RETRIES
+########################################
+def _hold_write_lock(app, seconds):
+    # Another connection takes the write lock and keeps it for `seconds`
+    import sqlite3
+    path = app.config['SQLALCHEMY_DATABASE_URI'][len('sqlite:///'):]
+    conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+    conn.execute('BEGIN IMMEDIATE')
+    timer = threading.Timer(seconds, lambda: (conn.execute('COMMIT'), conn.close()))
+    timer.start()
+    return timer
+
+
+def _locked_write(calls):
+    from website import db
+    from website.database import retry_on_lock
+
+    @retry_on_lock
+    def write():
+        calls.append(1)
+        db.session.execute(text("UPDATE product SET in_stock = in_stock - 1"))
+        db.session.commit()
+
+    return write
+
+
+@pytest.fixture
+def contended_app(app, make_product):
+    from website import db
+
+    make_product(stock=10)
+    app.config.update(DB_LOCK_RETRIES=4, DB_LOCK_BACKOFF=0.1)
+    # New connections get a short busy_timeout, so lock errors show up quickly
+    app.config['SQLITE_PRAGMAS']['busy_timeout'] = 50
+    with app.app_context():
+        db.engine.dispose()
+    return app
+
+
+def test_retry_on_lock_waits_out_a_held_lock(contended_app):
+    from website import db
+    from website.models import Product
+
+    calls = []
+    timer = _hold_write_lock(contended_app, 0.3)
+    with contended_app.app_context():
+        _locked_write(calls)()
+        assert db.session.query(Product.in_stock).scalar() == 9
+    timer.join()
+    assert len(calls) > 1
+
+
+def test_retry_on_lock_gives_up(contended_app):
+    from website import db
+    from website.models import Product
+
+    calls = []
+    timer = _hold_write_lock(contended_app, 5)
+    try:
+        with contended_app.app_context():
+            with pytest.raises(OperationalError, match='database is locked'):
+                _locked_write(calls)()
+    finally:
+        timer.cancel()
+        timer.function()
+
+    assert len(calls) == 5   # the first try and DB_LOCK_RETRIES retries
+    with contended_app.app_context():
+        assert db.session.query(Product.in_stock).scalar() == 10
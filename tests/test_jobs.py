@@ -0,0 +1,38 @@
+from sqlalchemy import event
+
+
+def _statements(app):
+    from website import db
+
+    seen = []
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute',
+                     lambda conn, cursor, statement, *args: seen.append(statement.split()[0].upper()))
+    return seen
+
+
+def test_idle_poll_only_reads(app):
+    from website.jobs import claim_job
+
+    seen = _statements(app)
+    with app.app_context():
+        assert claim_job('worker', 60) is None
+    assert seen == ['SELECT']
+
+
+def test_claim_leases_a_ready_job_once(app):
+    from website import db
+    from website.jobs import claim_job, enqueue
+
+    with app.app_context():
+        job = enqueue('orders.receipt', {'order_id': 1})
+        db.session.commit()
+        later = enqueue('orders.receipt', {'order_id': 2}, delay=3600)
+        db.session.commit()
+
+        claimed = claim_job('worker-a', 60)
+        assert (claimed.id, claimed.attempts) == (job.id, 1)
+        # Running and not yet due: nothing left for anyone else
+        assert claim_job('worker-b', 60) is None
+        db.session.refresh(later)
+        assert later.status == 'queued'
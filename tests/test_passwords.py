@@ -0,0 +1,29 @@
+import time
+import pytest
+
+
+def test_login_fails_fast_when_every_slot_is_taken(make_app, make_customer):
+    from website.passwords import HasherBusy, password_hasher
+
+    app = make_app(PASSWORD_HASH_CONCURRENCY='1', PASSWORD_HASH_TIMEOUT='0.2')
+    customer_id, email = make_customer()
+    with app.app_context():
+        slots = password_hasher().slots
+    assert slots.timeout == 0.2
+
+    with slots.acquire():
+        started = time.monotonic()
+        with pytest.raises(HasherBusy):
+            with slots.acquire():
+                pass
+        assert time.monotonic() - started < 1
+
+        client = app.test_client()
+        response = client.post('/login', data={'email': email, 'password': 'not-checked'})
+        assert response.status_code == 302
+        assert response.headers['Location'] == '/login'
+        assert b'Too many people are signing in' in client.get('/login').data
+
+    # Free again once the slot is released
+    with slots.acquire():
+        pass
@@ -0,0 +1,95 @@
+import threading
+from sqlalchemy import event, text
+
+
+def test_index_is_recovered_after_a_failed_start(app, make_product):
+    # A worker whose start-up could not set the index up must not skip
+    # index writes later: the index would drift from the product table.
+    from website import db
+    from website.models import Product
+    from website.search import index_product, search_products, FTS_TABLE
+
+    make_product(name='Yellowfin Tuna')
+    with app.app_context():
+        with db.engine.begin() as conn:
+            conn.execute(text(f"DROP TABLE {FTS_TABLE}"))
+        app.extensions['product_search'] = None
+
+        product = Product(product_name='Bluefin Tuna', current_price=1, previous_price=1, in_stock=1,
+                          product_picture='./media/tuna.jpg')
+        db.session.add(product)
+        db.session.flush()
+        index_product(product)
+        db.session.commit()
+
+        # The next search rebuilds the index from the product table
+        assert sorted(p.product_name for p in search_products('tun')) == ['Bluefin Tuna', 'Yellowfin Tuna']
+        assert app.extensions['product_search'] is True
+
+
+def test_index_created_by_another_worker_is_picked_up(app, make_product):
+    from website import db
+    from website.models import Product
+    from website.search import index_product, search_products, FTS_TABLE
+
+    with app.app_context():
+        # This worker failed at start-up; the index itself is fine
+        app.extensions['product_search'] = None
+        app.extensions['product_search_retry'] = float('inf')
+
+        product = Product(product_name='Squid Rings', current_price=1, previous_price=1, in_stock=1,
+                          product_picture='./media/squid.jpg')
+        db.session.add(product)
+        db.session.flush()
+        index_product(product)
+        db.session.commit()
+
+        assert app.extensions['product_search'] is True
+        assert db.session.execute(text(f"SELECT rowid FROM {FTS_TABLE}")).scalars().all() == [product.id]
+        assert [p.product_name for p in search_products('squ')] == ['Squid Rings']
+
+
+def test_suggest_cache_is_shared_safely_between_threads(app, make_product, monkeypatch):
+    from website import search
+
+    for name in ('Tuna', 'Squid', 'Salmon', 'Shrimp'):
+        make_product(name=name)
+    monkeypatch.setattr(search, 'SUGGEST_CACHE_SIZE', 2)
+    errors = []
+
+    def suggest(prefix):
+        try:
+            with app.app_context():
+                for _ in range(50):
+                    search.suggest_products(prefix)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=suggest, args=(prefix,)) for prefix in ('t', 's', 'sa', 'sh', 'sq', 'tu')]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert len(search._suggest_cache) <= 2
+
+
+def test_suggestion_is_not_cached_across_a_catalog_change(app, make_product):
+    from website import db, search
+
+    make_product(name='Tuna')
+
+    def change_catalog(conn, cursor, statement, *args):
+        if 'MATCH' in statement:
+            search._clear_suggestions()
+
+    with app.app_context():
+        search.rebuild_search_index()
+        event.listen(db.engine, 'before_cursor_execute', change_catalog)
+        try:
+            assert [s['name'] for s in search.suggest_products('tun')] == ['Tuna']
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', change_catalog)
+
+    assert 'tun' not in search._suggest_cache
@@ -1,3 +1,4 @@
+import os
 from flask import Flask, render_template
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
@@ -12,12 +13,34 @@ def create_database():
     print('Database Created')
 
 
-def create_app():
-    app = Flask(__name__)
+def create_app(instance_path=None):
+    # instance_path: tests point it at a temporary folder
+    app = Flask(__name__, instance_path=instance_path)
     app.config['SECRET_KEY'] = 'hbnwdvbn ajnbsjn ahe'
-    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{DB_NAME}'
+
+    from .database import database_uri, engine_options, configure_database
+    from .migrations import migrate_on_startup, db_cli
+    from .passwords import init_password_hasher
+    from .jobs import init_jobs, jobs_cli
+    from .flashsale import init_flash_sale
+    from .admission import init_admission
+    from .templating import init_templates, precompile_templates
+    from .profiler import init_profiler
+
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_uri(f'sqlite:///{DB_NAME}')
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
+
+    app.config['AUTO_MIGRATE'] = os.environ.get('AUTO_MIGRATE', '1') != '0'
+    init_templates(app)
 
     db.init_app(app)
+    configure_database(app)
+    init_profiler(app)
+    init_password_hasher(app)
+    migrate_on_startup(app)
+    init_jobs(app)
+    init_flash_sale(app)
+    init_admission(app)
 
     @app.errorhandler(404)
     def page_not_found(error):
@@ -29,16 +52,45 @@ def create_app():
 
     @login_manager.user_loader
     def load_user(id):
-        return Customer.query.get(int(id))
+        return load_identity(int(id))
 
     from .views import views
     from .auth import auth
     from .admin import admin
+    from .api import api
     from .models import Customer, Cart, Product, Order
+    from .cart import inject_cart_summary
+    from .identity import load_identity
+    from .search import init_search_index, search_cli
+    from .catalog import template_stamp
+    from .images import media_srcset, images_cli
+    from .media import init_media, media_url
+    from .sales import sales_cli
+    from .imports import products_cli
+    from .assets import init_assets, asset_stamp, assets_cli
+
+    app.context_processor(inject_cart_summary)
+    app.cli.add_command(search_cli)
+    app.cli.add_command(db_cli)
+    app.cli.add_command(images_cli)
+    app.cli.add_command(sales_cli)
+    app.cli.add_command(products_cli)
+    app.cli.add_command(jobs_cli)
+    app.cli.add_command(assets_cli)
+    app.add_template_global(media_srcset)
+    app.add_template_global(media_url)
+    init_media(app)
+    init_assets(app)
 
     app.register_blueprint(views, url_prefix='/') # localhost:5000/about-us
     app.register_blueprint(auth, url_prefix='/') # localhost:5000/auth/change-password
     app.register_blueprint(admin, url_prefix='/')
+    app.register_blueprint(api, url_prefix='/')
+
+    init_search_index(app)
+    app.config['TEMPLATE_STAMP'] = template_stamp(app) + asset_stamp(app)
+    if app.config['TEMPLATE_PRECOMPILE']:
+        precompile_templates(app)
 
     # with app.app_context():
     #     create_database()
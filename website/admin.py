@@ -1,8 +1,22 @@
-from flask import Blueprint, render_template, flash, send_from_directory, redirect, url_for
+from flask import Blueprint, render_template, flash, redirect, url_for, request, jsonify
 from flask_login import login_required, current_user
-from .forms import ShopItemsForm, OrderForm
+from .forms import ShopItemsForm, OrderForm, ProductImportForm
 from werkzeug.utils import secure_filename
-from .models import Product, Order, Customer
+from .models import Product, Order
+from .listings import order_page, customer_page, product_page
+from .sales import record_status_change, sales_dashboard, order_statuses
+from .search import index_product, unindex_product
+from .catalog import bump_catalog_version, catalog_cache_stats
+from .images import schedule_derivatives
+from .media import serve_media, media_cache
+from .flashsale import reload_flash_stock, token_store
+from .admission import admission_store
+from .profiler import profiler_stats
+from .api import api_cache
+from .templating import render_timings
+from .imports import import_products, import_format
+from .exports import PRODUCT_COLUMNS, ORDER_COLUMNS, FORMATS, ExportError, export_response, product_rows, \
+    order_filters, order_rows
 from . import db
 
 
@@ -11,7 +25,7 @@ admin = Blueprint('admin', __name__)
 
 @admin.route('/media/<path:filename>')
 def get_image(filename):
-    return send_from_directory('../media', filename)
+    return serve_media(filename)
 
 
 @admin.route('/add-shop-items', methods=['GET', 'POST'])
@@ -34,6 +48,7 @@ def add_shop_items():
             file_path = f'./media/{file_name}'
 
             file.save(file_path)
+            schedule_derivatives(file_path)
 
             new_shop_item = Product()
             new_shop_item.product_name = product_name
@@ -46,7 +61,11 @@ def add_shop_items():
 
             try:
                 db.session.add(new_shop_item)
+                db.session.flush()
+                index_product(new_shop_item)
                 db.session.commit()
+                bump_catalog_version()
+                reload_flash_stock()
                 flash(f'{product_name} added Successfully')
                 print('Product Added')
                 return render_template('add_shop_items.html', form=form)
@@ -63,8 +82,8 @@ def add_shop_items():
 @login_required
 def shop_items():
     if current_user.id == 1:
-        items = Product.query.order_by(Product.date_added).all()
-        return render_template('shop_items.html', items=items)
+        page = product_page(request.args)
+        return render_template('shop_items.html', items=page.items, page=page)
     return render_template('404.html')
 
 
@@ -95,6 +114,7 @@ def update_item(item_id):
             file_path = f'./media/{file_name}'
 
             file.save(file_path)
+            schedule_derivatives(file_path)
 
             try:
                 Product.query.filter_by(id=item_id).update(dict(product_name=product_name,
@@ -104,7 +124,10 @@ def update_item(item_id):
                                                                 flash_sale=flash_sale,
                                                                 product_picture=file_path))
 
+                index_product(item_to_update)
                 db.session.commit()
+                bump_catalog_version()
+                reload_flash_stock()
                 flash(f'{product_name} updated Successfully')
                 print('Product Upadted')
                 return redirect('/shop-items')
@@ -123,7 +146,10 @@ def delete_item(item_id):
         try:
             item_to_delete = Product.query.get(item_id)
             db.session.delete(item_to_delete)
+            unindex_product(item_id)
             db.session.commit()
+            bump_catalog_version()
+            reload_flash_stock()
             flash('One Item deleted')
             return redirect('/shop-items')
         except Exception as e:
@@ -138,8 +164,23 @@ def delete_item(item_id):
 @login_required
 def order_view():
     if current_user.id == 1:
-        orders = Order.query.all()
-        return render_template('view_orders.html', orders=orders)
+        page = order_page(request.args)
+        return render_template('view_orders.html', page=page, statuses=order_statuses())
+    return render_template('404.html')
+
+
+@admin.route('/admin/orders/export')
+@login_required
+def export_orders():
+    if current_user.id == 1:
+        export_format = request.args.get('format', 'csv')
+        if export_format not in FORMATS:
+            return jsonify({'error': f'format must be one of {", ".join(FORMATS)}'}), 400
+        try:
+            filters = order_filters(request.args)
+        except ExportError as e:
+            return jsonify({'error': str(e)}), 400
+        return export_response('orders', export_format, ORDER_COLUMNS, order_rows(filters))
     return render_template('404.html')
 
 
@@ -153,6 +194,7 @@ def update_order(order_id):
     order = Order.query.get_or_404(order_id)
 
     if form.validate_on_submit():
+        record_status_change(order, order.status, form.order_status.data)
         order.status = form.order_status.data
         db.session.commit()
         flash(f'Order {order.id} updated successfully', 'success')
@@ -166,8 +208,71 @@ def update_order(order_id):
 @login_required
 def display_customers():
     if current_user.id == 1:
-        customers = Customer.query.all()
-        return render_template('customers.html', customers=customers)
+        page = customer_page(request.args)
+        return render_template('customers.html', page=page)
+    return render_template('404.html')
+
+
+@admin.route('/admin/products/import', methods=['GET', 'POST'])
+@login_required
+def import_shop_items():
+    if current_user.id == 1:
+        form = ProductImportForm()
+        report = None
+
+        if form.validate_on_submit():
+            file = form.products_file.data
+            file_format = import_format(file.filename)
+
+            if file_format is None:
+                flash('Please upload a .csv or .jsonl file', 'danger')
+            else:
+                report = import_products(file.stream, file_format)
+                flash(f'{report.inserted} products added, {report.updated} updated, {report.failed} rows rejected',
+                      'success' if not report.failed else 'warning')
+
+        return render_template('import_products.html', form=form, report=report)
+
+    return render_template('404.html')
+
+
+@admin.route('/admin/products/export')
+@login_required
+def export_shop_items():
+    if current_user.id == 1:
+        export_format = request.args.get('format', 'csv')
+        if export_format not in FORMATS:
+            return jsonify({'error': f'format must be one of {", ".join(FORMATS)}'}), 400
+        return export_response('products', export_format, PRODUCT_COLUMNS, product_rows())
+    return render_template('404.html')
+
+
+@admin.route('/admin/cache-stats')
+@login_required
+def cache_stats():
+    if current_user.id == 1:
+        store = token_store()
+        admission = admission_store()
+        return jsonify({'catalog': catalog_cache_stats(), 'media': media_cache.stats(), 'api': api_cache.stats(),
+                        'flash_sale': store.stats() if store else None,
+                        'admission': admission.stats() if admission else None})
+    return render_template('404.html')
+
+
+@admin.route('/admin/perf', methods=['GET', 'POST'])
+@login_required
+def perf():
+    if current_user.id == 1:
+        stats = profiler_stats()
+        timings = render_timings()
+        if request.method == 'POST':
+            if stats is not None:
+                stats.clear()
+            timings.clear()
+            return redirect(url_for('admin.perf'))
+        routes, flagged = stats.snapshot() if stats else ([], [])
+        return render_template('perf.html', enabled=stats is not None, routes=routes, flagged=flagged,
+                               templates=timings.snapshot())
     return render_template('404.html')
 
 
@@ -175,7 +280,7 @@ def display_customers():
 @login_required
 def admin_page():
     if current_user.id == 1:
-        return render_template('admin.html')
+        return render_template('admin.html', sales=sales_dashboard())
     return render_template('404.html')
 
 
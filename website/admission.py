@@ -0,0 +1,265 @@
+import math
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from flask import current_app, g, make_response, render_template, request
+from flask_login import current_user
+
+
+# ADMISSION_CONTROL=1 guards the write-heavy routes (checkout and cart
+# changes) so a flash sale can't pile more writers on the database than it
+# can take:
+#
+#   - every customer and every client IP has a token bucket
+#     (ADMISSION_CUSTOMER_RATE/BURST, ADMISSION_IP_RATE/BURST, tokens per
+#     second / bucket size);
+#   - at most ADMISSION_CONCURRENCY of these requests run at once across
+#     all workers. Up to ADMISSION_QUEUE_DEPTH more wait, in arrival order,
+#     for ADMISSION_QUEUE_TIMEOUT seconds.
+#
+# Anything over is answered 429 with Retry-After. The buckets, the slots
+# and the counters live in a small SQLite file shared by the workers on
+# the host, like the flash sale stock (flashsale.TokenStore).
+STORE_FILE = 'admission.sqlite3'
+ROUTES = ('views.place_order', 'views.add_to_cart', 'views.update_cart', 'views.cart_batch',
+          'views.plus_cart', 'views.minus_cart', 'views.remove_from_cart')
+POLL_INTERVAL = 0.02      # seconds before a waiter's first check for a free slot;
+MAX_POLL_INTERVAL = 0.2   # doubled after every check that finds none, up to this
+SLOT_TTL = 60             # seconds; slots of a worker that died are reclaimed after this
+PRUNE_EVERY = 1000        # requests between sweeps of idle buckets (per worker)
+COUNTERS = ('admitted', 'queued', 'rejected_customer', 'rejected_ip', 'rejected_queue_full', 'queue_timeouts')
+
+
+class Rejected(Exception):
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionStore:
+    def __init__(self, path, bucket_idle):
+        self.path = path
+        self.bucket_idle = bucket_idle
+        self._local = threading.local()
+        self._taken = 0
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.execute('PRAGMA synchronous = NORMAL')
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS bucket (
+                    key TEXT NOT NULL PRIMARY KEY,
+                    tokens REAL NOT NULL,
+                    updated REAL NOT NULL
+                )""")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS slot (
+                    id INTEGER PRIMARY KEY,
+                    waiting INTEGER NOT NULL,
+                    started REAL NOT NULL
+                )""")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS counter (
+                    name TEXT NOT NULL PRIMARY KEY,
+                    value INTEGER NOT NULL
+                )""")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        # BEGIN IMMEDIATE: the read and the update of a bucket or of the
+        # slot count can't interleave with another worker's.
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def _count(self, conn, name):
+        conn.execute("INSERT INTO counter (name, value) VALUES (?, 1) "
+                     "ON CONFLICT (name) DO UPDATE SET value = value + 1", (name,))
+
+    ########################################
+    # TOKEN BUCKETS
+    ########################################
+    def take_tokens(self, buckets):
+        # buckets: [(reason, key, rate, burst)]. Takes one token from each,
+        # or none of them; raises Rejected with the wait for the emptiest.
+        now = time.time()
+        with self.transaction() as conn:
+            levels = []
+            for reason, key, rate, burst in buckets:
+                row = conn.execute("SELECT tokens, updated FROM bucket WHERE key = ?", (key,)).fetchone()
+                tokens = burst if row is None else min(burst, row[0] + (now - row[1]) * rate)
+                if tokens < 1:
+                    # Committed: only the counter changes
+                    self._count(conn, f'rejected_{reason}')
+                    rejected = Rejected(reason, (1 - tokens) / rate)
+                    break
+                levels.append((key, tokens - 1))
+            else:
+                rejected = None
+                conn.executemany("INSERT INTO bucket (key, tokens, updated) VALUES (?, ?, ?) "
+                                 "ON CONFLICT (key) DO UPDATE SET tokens = excluded.tokens, "
+                                 "updated = excluded.updated",
+                                 [(key, tokens, now) for key, tokens in levels])
+        if rejected is not None:
+            raise rejected
+
+        self._taken += 1
+        if self._taken % PRUNE_EVERY == 0:
+            self.prune()
+
+    def prune(self):
+        # A bucket untouched for bucket_idle seconds is full again: same as no row
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM bucket WHERE updated < ?", (time.time() - self.bucket_idle,))
+
+    ########################################
+    # CONCURRENCY LIMIT AND WAIT QUEUE
+    ########################################
+    def _occupancy(self, conn, queued_before=None):
+        # (running, waiting); with queued_before, only the waiters ahead of that slot
+        waiting = 'waiting = 1' if queued_before is None else 'waiting = 1 AND id < :before'
+        return conn.execute(f"SELECT COALESCE(SUM(waiting = 0), 0), COALESCE(SUM({waiting}), 0) FROM slot",
+                            {'before': queued_before}).fetchone()
+
+    def acquire_slot(self, limit, queue_depth, timeout, retry_after):
+        # Returns the slot id, to be given back to release_slot()
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM slot WHERE started < ?", (time.time() - SLOT_TTL,))
+            running, waiting = self._occupancy(conn)
+            # Newcomers don't overtake the queue
+            if running + waiting < limit:
+                self._count(conn, 'admitted')
+                return conn.execute("INSERT INTO slot (waiting, started) VALUES (0, ?)", (time.time(),)).lastrowid
+            if waiting >= queue_depth:
+                self._count(conn, 'rejected_queue_full')
+                slot_id = None
+            else:
+                self._count(conn, 'queued')
+                slot_id = conn.execute("INSERT INTO slot (waiting, started) VALUES (1, ?)", (time.time(),)).lastrowid
+        if slot_id is None:
+            raise Rejected('busy', retry_after)
+
+        deadline = time.monotonic() + timeout
+        interval = POLL_INTERVAL
+        try:
+            while time.monotonic() < deadline:
+                time.sleep(min(interval, max(deadline - time.monotonic(), 0)))
+                interval = min(interval * 2, MAX_POLL_INTERVAL)
+                # A plain read first: the write lock is only taken when a slot looks free
+                running, ahead = self._occupancy(self._connection(), queued_before=slot_id)
+                if running + ahead >= limit:
+                    continue
+                with self.transaction() as conn:
+                    running, ahead = self._occupancy(conn, queued_before=slot_id)
+                    if running + ahead < limit:
+                        conn.execute("UPDATE slot SET waiting = 0, started = ? WHERE id = ?", (time.time(), slot_id))
+                        self._count(conn, 'admitted')
+                        admitted, slot_id = slot_id, None
+                        return admitted
+            with self.transaction() as conn:
+                self._count(conn, 'queue_timeouts')
+            raise Rejected('busy', retry_after)
+        finally:
+            if slot_id is not None:
+                self.release_slot(slot_id)
+
+    def release_slot(self, slot_id):
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM slot WHERE id = ?", (slot_id,))
+
+    ########################################
+    # STATS
+    ########################################
+    def stats(self):
+        conn = self._connection()
+        counters = dict.fromkeys(COUNTERS, 0)
+        counters.update(conn.execute("SELECT name, value FROM counter"))
+        running, waiting = self._occupancy(conn)
+        return {**counters, 'running': running, 'waiting': waiting,
+                'buckets': conn.execute("SELECT COUNT(*) FROM bucket").fetchone()[0]}
+
+
+def admission_store():
+    return current_app.extensions.get('admission_store')
+
+
+########################################
+# REQUEST HOOKS
+########################################
+def _buckets(config):
+    buckets = [('ip', f'ip:{request.remote_addr}', config['ADMISSION_IP_RATE'], config['ADMISSION_IP_BURST'])]
+    if current_user.is_authenticated:
+        buckets.insert(0, ('customer', f'customer:{current_user.id}',
+                           config['ADMISSION_CUSTOMER_RATE'], config['ADMISSION_CUSTOMER_BURST']))
+    return buckets
+
+
+def _too_many_requests(rejected):
+    retry_after = max(1, math.ceil(rejected.retry_after))
+    response = make_response(render_template('429.html', retry_after=retry_after), 429)
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+
+def _admit():
+    config = current_app.config
+    if request.endpoint not in config['ADMISSION_ROUTES']:
+        return None
+
+    store = admission_store()
+    try:
+        store.take_tokens(_buckets(config))
+        g.admission_slot = store.acquire_slot(config['ADMISSION_CONCURRENCY'], config['ADMISSION_QUEUE_DEPTH'],
+                                              config['ADMISSION_QUEUE_TIMEOUT'], config['ADMISSION_RETRY_AFTER'])
+    except Rejected as e:
+        return _too_many_requests(e)
+    return None
+
+
+def _release(error=None):
+    # In teardown so the slot is given back even when the view raised
+    slot_id = g.pop('admission_slot', None)
+    if slot_id is not None:
+        admission_store().release_slot(slot_id)
+
+
+def init_admission(app):
+    app.config.setdefault('ADMISSION_CONTROL', os.environ.get('ADMISSION_CONTROL', '0') == '1')
+    app.config.setdefault('ADMISSION_ROUTES', [route for route in os.environ.get(
+        'ADMISSION_ROUTES', ','.join(ROUTES)).split(',') if route])
+    app.config.setdefault('ADMISSION_CUSTOMER_RATE', float(os.environ.get('ADMISSION_CUSTOMER_RATE', 2)))
+    app.config.setdefault('ADMISSION_CUSTOMER_BURST', int(os.environ.get('ADMISSION_CUSTOMER_BURST', 10)))
+    app.config.setdefault('ADMISSION_IP_RATE', float(os.environ.get('ADMISSION_IP_RATE', 10)))
+    app.config.setdefault('ADMISSION_IP_BURST', int(os.environ.get('ADMISSION_IP_BURST', 40)))
+    app.config.setdefault('ADMISSION_CONCURRENCY', int(os.environ.get('ADMISSION_CONCURRENCY', 8)))
+    app.config.setdefault('ADMISSION_QUEUE_DEPTH', int(os.environ.get('ADMISSION_QUEUE_DEPTH', 32)))
+    app.config.setdefault('ADMISSION_QUEUE_TIMEOUT', float(os.environ.get('ADMISSION_QUEUE_TIMEOUT', 2)))
+    app.config.setdefault('ADMISSION_RETRY_AFTER', int(os.environ.get('ADMISSION_RETRY_AFTER', 1)))
+
+    if not app.config['ADMISSION_CONTROL']:
+        return
+
+    for name in ('ADMISSION_CUSTOMER_RATE', 'ADMISSION_IP_RATE'):
+        if app.config[name] <= 0:
+            raise ValueError(f'{name} must be more than 0 tokens per second, got {app.config[name]}')
+
+    os.makedirs(app.instance_path, exist_ok=True)
+    # Time for the slowest bucket to refill from empty
+    bucket_idle = max(app.config['ADMISSION_CUSTOMER_BURST'] / app.config['ADMISSION_CUSTOMER_RATE'],
+                      app.config['ADMISSION_IP_BURST'] / app.config['ADMISSION_IP_RATE'])
+    app.extensions['admission_store'] = AdmissionStore(os.path.join(app.instance_path, STORE_FILE), bucket_idle)
+    app.before_request(_admit)
+    app.teardown_request(_release)
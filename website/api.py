@@ -0,0 +1,194 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from datetime import date, datetime
+from flask import Blueprint, Response, request
+from sqlalchemy import select
+from .catalog import catalog_version
+from .exports import PRODUCT_COLUMNS
+from .media import REVALIDATE
+from .models import Product
+from .pagination import PAGE_SIZE, MAX_PAGE_SIZE
+from . import db
+
+
+api = Blueprint('api', __name__)
+
+# Read-only catalog for apps and kiosks:
+#
+#   GET /api/products?fields=id,product_name,current_price&flash_sale=1&in_stock=1&per_page=50&after=120
+#   GET /api/products/<id>?fields=...
+#
+# Pages are walked by id (`after` = last id of the previous page, given as
+# `next`). Every response body is a function of the catalog version and
+# the normalised query, so it doubles as the cache key and the strong
+# ETag: a repeat request is answered from memory, or with a 304, without
+# touching the database.
+API_CACHE_SIZE = 1024
+FALSE_VALUES = ('0', 'false', 'no', 'n', 'off')
+
+
+class ApiError(ValueError):
+    pass
+
+
+class ResponseCache:
+    def __init__(self, size=API_CACHE_SIZE):
+        self.size = size
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self._bodies = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, version, key):
+        with self._lock:
+            if version != self.version:
+                # Bodies built for an older catalog are never served again
+                self._bodies.clear()
+                self.version = version
+            cached = self._bodies.get(key)
+            if cached is None:
+                self.misses += 1
+                return None
+            self._bodies.move_to_end(key)
+            self.hits += 1
+            return cached
+
+    def put(self, version, key, entry):
+        with self._lock:
+            if version != self.version:
+                return
+            self._bodies[key] = entry
+            while len(self._bodies) > self.size:
+                self._bodies.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._bodies), 'size': self.size}
+
+
+api_cache = ResponseCache()
+
+
+def _json_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat(sep=' ')
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+########################################
+# QUERY STRING
+########################################
+def _fields(args):
+    requested = [field.strip() for field in args.get('fields', '').split(',') if field.strip()]
+    unknown = [field for field in requested if field not in PRODUCT_COLUMNS]
+    if unknown:
+        raise ApiError(f'unknown fields: {", ".join(unknown)}; choose from {", ".join(PRODUCT_COLUMNS)}')
+    # Always in PRODUCT_COLUMNS order, so the same set gives the same body
+    return tuple(field for field in PRODUCT_COLUMNS if field in requested) or PRODUCT_COLUMNS
+
+
+def _flag(args, name):
+    value = args.get(name)
+    if value is None or value == '':
+        return None
+    return value.lower() not in FALSE_VALUES
+
+
+def _positive_int(args, name, default):
+    value = args.get(name)
+    if value is None or value == '':
+        return default
+    if not value.isdigit():
+        raise ApiError(f'{name} must be a positive whole number')
+    return int(value)
+
+
+def _list_key(args):
+    return ('list', _fields(args), _flag(args, 'flash_sale'), _flag(args, 'in_stock'),
+            _positive_int(args, 'after', 0), max(1, min(_positive_int(args, 'per_page', PAGE_SIZE), MAX_PAGE_SIZE)))
+
+
+########################################
+# BODIES — ONLY BUILT ON A CACHE MISS
+########################################
+def _columns(fields):
+    # id is always read: it is the page cursor
+    return [Product.id] + [getattr(Product, field) for field in fields if field != 'id']
+
+
+def _row(fields, row):
+    values = dict(zip(['id'] + [field for field in fields if field != 'id'], row))
+    return {field: _json_value(values[field]) for field in fields}
+
+
+def _product_list(fields, flash_sale, in_stock, after, per_page):
+    statement = select(*_columns(fields)).where(Product.id > after)
+    if flash_sale is not None:
+        statement = statement.where(Product.flash_sale.is_(flash_sale))
+    if in_stock is not None:
+        statement = statement.where(Product.in_stock > 0 if in_stock else Product.in_stock <= 0)
+
+    rows = db.session.execute(statement.order_by(Product.id).limit(per_page + 1)).all()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+
+    body = {'data': [_row(fields, row) for row in rows],
+            'next': rows[-1][0] if has_more else None}
+    return 200, body
+
+
+def _product_detail(fields, product_id):
+    row = db.session.execute(select(*_columns(fields)).where(Product.id == product_id)).first()
+    if row is None:
+        return 404, {'error': 'product not found'}
+    return 200, {'data': _row(fields, row)}
+
+
+########################################
+# RESPONSES
+########################################
+def _respond(key, build):
+    version = catalog_version()
+    entry = api_cache.get(version, key)
+    if entry is None:
+        status, body = build()
+        payload = json.dumps(body, separators=(',', ':')).encode()
+        etag = hashlib.sha256(repr((version, key)).encode() + payload).hexdigest()[:32]
+        entry = (status, payload, etag)
+        api_cache.put(version, key, entry)
+
+    status, payload, etag = entry
+    if status == 200 and etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        response = Response(payload, status=status, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = REVALIDATE
+    return response
+
+
+def _error(message):
+    return Response(json.dumps({'error': message}), status=400, mimetype='application/json')
+
+
+@api.route('/api/products')
+def products():
+    try:
+        key = _list_key(request.args)
+    except ApiError as e:
+        return _error(str(e))
+    return _respond(key, lambda: _product_list(*key[1:]))
+
+
+@api.route('/api/products/<int:product_id>')
+def product(product_id):
+    try:
+        key = ('detail', _fields(request.args), product_id)
+    except ApiError as e:
+        return _error(str(e))
+    return _respond(key, lambda: _product_detail(key[1], product_id))
@@ -0,0 +1,314 @@
+import functools
+import mimetypes
+import os
+from contextlib import asynccontextmanager
+import anyio
+from a2wsgi import WSGIMiddleware
+from flask import abort, make_response, render_template, request as flask_request, session
+from flask_login import current_user
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Mount, Route
+from werkzeug.exceptions import HTTPException
+from werkzeug.http import http_date
+from werkzeug.security import safe_join
+from .catalog import cached_fragment, catalog_etag, peek_fragment, record_not_modified
+from .database import apply_pragmas
+from .listings import customer_orders, customer_order, order_items
+from .media import FINGERPRINT_LENGTH, HOT_FILE_MAX, IMMUTABLE, REVALIDATE, media_cache, media_dir
+from .models import Product
+from .profiler import watch_engine
+from .search import search_statement
+from . import db
+
+
+# ASGI entry point (see /asgi.py): uvicorn asgi:app, or
+# gunicorn -k uvicorn.workers.UvicornWorker asgi:app
+#
+# The read-heavy routes below run as async handlers: their queries go
+# through an async engine (aiosqlite) and media files are streamed with
+# async file reads, so a slow disk or a locked database parks a coroutine
+# instead of a worker. Each handler still runs inside a Flask request
+# context (session, current_user, before/after_request hooks, templates),
+# but only the aiosqlite awaits and pure code run on the event loop: the
+# Flask hooks, the identity loader, template rendering (its context
+# processors may read the cart) and anything else that can block go
+# through run_in_threadpool, which carries the request context along.
+# Anything else, and every case a handler doesn't cover (admins, flashes,
+# Range requests...), goes to the unchanged Flask app, run in a thread
+# pool by a2wsgi.
+ASYNC_DRIVERS = {'sqlite': 'sqlite+aiosqlite', 'postgresql': 'postgresql+asyncpg'}
+WSGI_THREADS = 10
+STREAM_CHUNK = 64 * 1024
+
+
+class FlaskFallback(Response):
+    # Returned by a handler to let the Flask app answer instead
+    def __init__(self, wsgi, body):
+        self.wsgi = wsgi
+        self.body = body
+
+    async def __call__(self, scope, receive, send):
+        replayed = False
+
+        async def replay():
+            # The handler already read the request body; hand it over again
+            nonlocal replayed
+            if replayed:
+                return await receive()
+            replayed = True
+            return {'type': 'http.request', 'body': self.body, 'more_body': False}
+
+        await self.wsgi(scope, replay, send)
+
+
+def to_starlette(response):
+    # Flask response (headers set by after_request hooks and the session
+    # cookie included) -> Starlette response
+    converted = Response(response.get_data(), status_code=response.status_code)
+    converted.raw_headers = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                             for name, value in response.headers.items()]
+    return converted
+
+
+def async_database_url(url):
+    return url.set(drivername=ASYNC_DRIVERS[url.get_backend_name()])
+
+
+class Deferred:
+    # Returned by a handler for work that blocks (rendering templates):
+    # _finish calls it in the thread that builds the response
+    def __init__(self, func, *args, **kwargs):
+        self.call = functools.partial(func, *args, **kwargs)
+
+
+def _preprocess(flask_app):
+    # before_request hooks, then the identity loader (current_user is lazy)
+    rv = flask_app.preprocess_request()
+    if rv is None:
+        current_user._get_current_object()
+    return rv
+
+
+def _finish(flask_app, rv):
+    if isinstance(rv, Deferred):
+        try:
+            rv = rv.call()
+        except HTTPException as e:
+            rv = flask_app.handle_user_exception(e)
+    response = to_starlette(flask_app.process_response(flask_app.make_response(rv)))
+    db.session.remove()
+    return response
+
+
+async def _release_session():
+    # The sync session (identity loader, hooks) gives its connection back
+    # from a thread, so the teardown on the loop finds nothing to close
+    if db.session.registry.has():
+        await run_in_threadpool(db.session.remove)
+
+
+def _home_cache(cacheable):
+    # (etag, cached product grid); the grid isn't looked up for a 304
+    etag = catalog_etag()
+    if cacheable and etag in flask_request.if_none_match:
+        return etag, None
+    return etag, peek_fragment('_product_grid.html')
+
+
+async def _stream_file(path):
+    async with await anyio.open_file(path, 'rb') as f:
+        while True:
+            chunk = await f.read(STREAM_CHUNK)
+            if not chunk:
+                break
+            yield chunk
+
+
+class AsyncViews:
+    def __init__(self, flask_app, wsgi_threads=WSGI_THREADS):
+        self.flask_app = flask_app
+        self.wsgi = WSGIMiddleware(flask_app, workers=wsgi_threads)
+
+        with flask_app.app_context():
+            url = async_database_url(db.engine.url)
+        self.engine = create_async_engine(url, **self._engine_options(url))
+        if url.get_backend_name() == 'sqlite':
+            pragmas = flask_app.config['SQLITE_PRAGMAS']
+            event.listen(self.engine.sync_engine, 'connect', lambda conn, record: apply_pragmas(conn, pragmas))
+        if flask_app.config['SQL_PROFILER']:
+            watch_engine(self.engine.sync_engine)
+        self.sessions = async_sessionmaker(self.engine, expire_on_commit=False)
+
+    def _engine_options(self, url):
+        options = dict(self.flask_app.config['SQLALCHEMY_ENGINE_OPTIONS'])
+        # aiosqlite runs each connection on its own thread already
+        options.pop('connect_args', None)
+        if url.get_backend_name() == 'sqlite':
+            # Keep the same bounded pool as the sync engine (aiosqlite defaults to none)
+            options['poolclass'] = AsyncAdaptedQueuePool
+        return options
+
+    def handler(self, view):
+        # Runs `view` inside a Flask request context built from the ASGI
+        # request, like Flask's own full_dispatch_request would.
+        flask_app = self.flask_app
+
+        async def endpoint(request):
+            body = await request.body()
+            client = request.client
+            context = flask_app.test_request_context(
+                request.url.path,
+                base_url=f'{request.url.scheme}://{request.url.netloc}',
+                query_string=request.url.query,
+                method=request.method,
+                headers=list(request.headers.items()),
+                data=body,
+                environ_base={'REMOTE_ADDR': client.host if client else None}
+            )
+
+            with context:
+                try:
+                    rv = await run_in_threadpool(_preprocess, flask_app)
+                    if rv is None:
+                        rv = await view(request, **request.path_params)
+                except HTTPException as e:
+                    rv = await run_in_threadpool(flask_app.handle_user_exception, e)
+
+                if rv is FALLBACK:
+                    await _release_session()
+                    return FlaskFallback(self.wsgi, body)
+                if isinstance(rv, Response):
+                    await _release_session()
+                    return rv
+                return await run_in_threadpool(_finish, flask_app, rv)
+
+        return endpoint
+
+    ########################################
+    # HANDLERS — MIRROR THE FLASK VIEWS
+    ########################################
+    async def home(self, request):
+        # views.home
+        if current_user.is_authenticated and current_user.id == 1:
+            return FALLBACK
+
+        cacheable = not current_user.is_authenticated and '_flashes' not in session
+        etag, product_grid = await run_in_threadpool(_home_cache, cacheable)
+
+        if cacheable and etag in flask_request.if_none_match:
+            record_not_modified()
+            response = make_response('', 304)
+            response.set_etag(etag)
+            return response
+
+        items = None
+        if product_grid is None:
+            async with self.sessions() as s:
+                items = (await s.scalars(select(Product))).all()
+
+        def respond():
+            grid = product_grid or cached_fragment('_product_grid.html', lambda: {'items': items})
+            response = make_response(render_template('home.html', product_grid=grid))
+            if cacheable:
+                response.set_etag(etag)
+                response.headers['Cache-Control'] = 'no-cache'
+            return response
+
+        return Deferred(respond)
+
+    async def search(self, request):
+        # views.search; an empty query flashes and redirects in Flask
+        # search_statement may check the search index with the sync engine
+        statement = await run_in_threadpool(search_statement, flask_request.form.get('search', '').strip())
+        if statement is None:
+            return FALLBACK
+
+        async with self.sessions() as s:
+            items = (await s.scalars(statement)).all()
+        return Deferred(render_template, 'search.html', items=items)
+
+    async def orders(self, request):
+        # views.orders
+        if not current_user.is_authenticated or current_user.id == 1:
+            return FALLBACK
+
+        async with self.sessions() as s:
+            orders = (await s.scalars(customer_orders(current_user.id))).all()
+        return Deferred(render_template, 'orders.html', orders=orders)
+
+    async def order_details(self, request, order_id):
+        # views.order_details
+        if not current_user.is_authenticated:
+            return FALLBACK
+
+        async with self.sessions() as s:
+            order = (await s.scalars(customer_order(current_user.id, order_id))).first()
+            if order is None:
+                abort(404)
+            items = (await s.scalars(order_items(order_id))).all()
+        return Deferred(render_template, 'order_details.html', order=order, items=items)
+
+    async def get_image(self, request, filename):
+        # media.serve_media; byte ranges are left to Flask
+        if 'range' in request.headers:
+            return FALLBACK
+
+        path = safe_join(media_dir(), filename)
+        if path is None or not await anyio.Path(path).is_file():
+            abort(404)
+
+        stat = await anyio.Path(path).stat()
+        etag = await anyio.to_thread.run_sync(media_cache.digest, path, stat)
+        fingerprinted = flask_request.args.get('v') == etag[:FINGERPRINT_LENGTH]
+        headers = {
+            'ETag': f'"{etag}"',
+            'Last-Modified': http_date(stat.st_mtime),
+            'Cache-Control': IMMUTABLE if fingerprinted else REVALIDATE,
+            'Accept-Ranges': 'bytes',
+        }
+
+        if etag in flask_request.if_none_match:
+            return Response(status_code=304, headers=headers)
+
+        media_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        if stat.st_size <= min(HOT_FILE_MAX, media_cache.budget):
+            data = await anyio.to_thread.run_sync(media_cache.read, path, stat)
+            return Response(data, media_type=media_type, headers=headers)
+
+        headers['Content-Length'] = str(stat.st_size)
+        return StreamingResponse(_stream_file(path), media_type=media_type, headers=headers)
+
+    def routes(self):
+        return [
+            Route('/', self.handler(self.home), methods=['GET']),
+            Route('/search', self.handler(self.search), methods=['POST']),
+            Route('/orders', self.handler(self.orders), methods=['GET']),
+            Route('/order/{order_id:int}', self.handler(self.order_details), methods=['GET']),
+            Route('/media/{filename:path}', self.handler(self.get_image), methods=['GET']),
+            Mount('/', app=self.wsgi),
+        ]
+
+
+FALLBACK = object()
+
+
+def create_asgi_app(flask_app=None):
+    if flask_app is None:
+        from . import create_app
+        flask_app = create_app()
+
+    views = AsyncViews(flask_app, int(os.environ.get('WSGI_THREADS', WSGI_THREADS)))
+
+    @asynccontextmanager
+    async def lifespan(app):
+        yield
+        await views.engine.dispose()
+
+    app = Starlette(routes=views.routes(), lifespan=lifespan)
+    app.state.flask_app = flask_app
+    return app
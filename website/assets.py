@@ -0,0 +1,361 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import re
+import urllib.request
+import click
+from flask import abort, current_app, request, send_file, url_for
+from flask.cli import AppGroup
+from werkzeug.security import safe_join
+from .media import IMMUTABLE
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; only .gz siblings are written
+    brotli = None
+
+try:
+    import rjsmin
+except ImportError:  # rjsmin is optional; JS is bundled unminified (most sources are .min already)
+    rjsmin = None
+
+
+# `flask assets build` writes website/static/dist/:
+#   - one file per bundle below, sources concatenated in order, minified,
+#   - a copy of every other static file,
+# all named <name>.<content hash>.<ext>, with .gz (and .br) siblings for
+# text files, plus manifest.json mapping the plain names to the hashed
+# ones. Hashed files are served from /assets/ with a one year immutable
+# Cache-Control; old builds are left in place so pages cached before a
+# deploy still find their files.
+#
+# Without a manifest (or with ASSETS_DEBUG=1) templates get the source
+# files one by one, and CDN URLs for anything not vendored yet.
+DIST_DIR = 'dist'
+MANIFEST = 'manifest.json'
+HASH_LENGTH = 12
+COMPRESSIBLE = ('.css', '.js', '.svg', '.json', '.txt', '.ttf', '.eot', '.otf')
+
+# Third-party files the templates used to load from CDNs. `flask assets
+# vendor` downloads them (and the fonts their CSS points at) into
+# static/vendor/, to be committed so offline deployments have them.
+VENDOR = {
+    'popper': ('https://cdn.jsdelivr.net/npm/@popperjs/core@2.11.8/dist/umd/popper.min.js',
+               'vendor/popper/popper.min.js'),
+    'bootstrap-js': ('https://cdn.jsdelivr.net/npm/bootstrap@5.3.1/dist/js/bootstrap.min.js',
+                     'vendor/bootstrap/bootstrap.min.js'),
+    'bootstrap-icons': ('https://cdnjs.cloudflare.com/ajax/libs/bootstrap-icons/1.10.5/font/bootstrap-icons.min.css',
+                        'vendor/bootstrap-icons/font/bootstrap-icons.min.css'),
+    'font-awesome': ('https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.5.0/css/all.min.css',
+                     'vendor/font-awesome/css/all.min.css'),
+}
+
+# Order matters: it is the order of the old <link>/<script> tags.
+# 'vendor:<name>' refers to VENDOR above.
+BUNDLES = {
+    'site.css': ['vendor:bootstrap-icons', 'css/all.min.css', 'vendor:font-awesome', 'css/bootstrap.min.css',
+                 'css/style.css'],
+    'forms.css': ['vendor:bootstrap-icons', 'css/all.min.css', 'css/bootstrap.min.css', 'css/forms.css'],
+    'head.js': ['vendor:popper', 'vendor:bootstrap-js'],
+    'site.js': ['js/jquery.js', 'js/all.min.js', 'js/myScript.js'],
+}
+
+_css_url = re.compile(r'url\(\s*([\'"]?)([^\'")]+)\1\s*\)')
+_css_tokens = re.compile(r'("(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'|/\*!.*?\*/)|/\*.*?\*/|(\s+)', re.S)
+_css_punctuation = re.compile(r'\s*([{};,])\s*')
+
+
+def _static_dir(app):
+    return app.static_folder
+
+
+def _dist_dir(app):
+    return os.path.join(app.static_folder, DIST_DIR)
+
+
+def _source(entry):
+    # (static path, CDN url or None)
+    if entry.startswith('vendor:'):
+        url, path = VENDOR[entry[len('vendor:'):]]
+        return path, url
+    return entry, None
+
+
+def _is_external(url):
+    return url.startswith(('data:', 'http:', 'https:', '//', '#', '/'))
+
+
+########################################
+# MINIFY
+########################################
+def minify_css(text):
+    # Drops comments (keeping /*! licence */ ones) and spaces that can't
+    # matter; strings are left alone.
+    def token(match):
+        if match.group(1):
+            return match.group(1)
+        return ' ' if match.group(2) else ''
+
+    parts = re.split(r'("(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\')', _css_tokens.sub(token, text))
+    for index in range(0, len(parts), 2):
+        parts[index] = _css_punctuation.sub(r'\1', parts[index])
+    return ''.join(parts).strip()
+
+
+def minify_js(text):
+    return rjsmin.jsmin(text, keep_bang_comments=True) if rjsmin else text
+
+
+def rewrite_css_urls(text, source, files):
+    # url(../webfonts/x.woff2) is relative to the source file; the bundle
+    # lives elsewhere, so point it at the file's fingerprinted /assets/ URL
+    # (files: the manifest's plain -> hashed names). A file missing from
+    # static/ keeps its plain /static/ URL.
+    base = posixpath.dirname(source)
+
+    def rewrite(match):
+        url = match.group(2).strip()
+        if _is_external(url):
+            return match.group(0)
+        # Keep ?#iefix and #fontawesome style suffixes
+        path, suffix = re.match(r'([^?#]*)(.*)', url).groups()
+        resolved = posixpath.normpath(posixpath.join(base, path))
+        if resolved in files:
+            target = url_for('views.get_asset', filename=files[resolved])
+        else:
+            target = url_for('static', filename=resolved)
+        return f'url({match.group(1)}{target}{suffix}{match.group(1)})'
+
+    return _css_url.sub(rewrite, text)
+
+
+########################################
+# BUILD
+########################################
+def _hashed_name(name, data):
+    stem, ext = posixpath.splitext(name)
+    return f'{stem}.{hashlib.sha256(data).hexdigest()[:HASH_LENGTH]}{ext}'
+
+
+def _write(dist, name, data):
+    # Writes name (and compressed siblings) unless a build already did
+    path = os.path.join(dist, *name.split('/'))
+    if os.path.exists(path):
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    outputs = [(path, data)]
+    if name.endswith(COMPRESSIBLE):
+        outputs.append((path + '.gz', gzip.compress(data, 9, mtime=0)))
+        if brotli is not None:
+            outputs.append((path + '.br', brotli.compress(data)))
+
+    # Siblings first: the plain file appearing is what marks the name as complete
+    for output, content in reversed(outputs):
+        tmp = f'{output}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(content)
+        os.replace(tmp, output)
+
+
+def _read_source(static, path, files, minify):
+    with open(os.path.join(static, *path.split('/')), encoding='utf-8') as f:
+        text = f.read()
+    if path.endswith('.css'):
+        text = rewrite_css_urls(text, path, files)
+        if minify and not path.endswith('.min.css'):
+            text = minify_css(text)
+    elif minify and not path.endswith('.min.js'):
+        text = minify_js(text)
+    return text
+
+
+def build_bundle(name, static, dist, files, minify=True):
+    # Returns the bundle's parts: {'file': hashed name} for runs of local
+    # sources, {'url': CDN url} for sources that are not vendored yet.
+    parts, run = [], []
+    separator = '\n' if name.endswith('.css') else ';\n'
+
+    def flush():
+        if run:
+            data = separator.join(run).encode('utf-8')
+            stem, ext = posixpath.splitext(name)
+            hashed = _hashed_name(f'{stem}{"-" + str(len(parts)) if parts else ""}{ext}', data)
+            _write(dist, hashed, data)
+            parts.append({'file': hashed})
+            run.clear()
+
+    for entry in BUNDLES[name]:
+        path, url = _source(entry)
+        if os.path.isfile(os.path.join(static, *path.split('/'))):
+            run.append(_read_source(static, path, files, minify))
+        else:
+            flush()
+            parts.append({'url': url})
+    flush()
+    return parts
+
+
+def build_assets(app, minify=True):
+    static, dist = _static_dir(app), _dist_dir(app)
+    manifest = {'files': {}, 'bundles': {}}
+
+    for root, dirs, files in os.walk(static):
+        dirs[:] = sorted(d for d in dirs if os.path.join(root, d) != dist)
+        for filename in sorted(files):
+            path = os.path.join(root, filename)
+            name = os.path.relpath(path, static).replace(os.sep, '/')
+            with open(path, 'rb') as f:
+                data = f.read()
+            hashed = _hashed_name(name, data)
+            _write(dist, hashed, data)
+            manifest['files'][name] = hashed
+
+    # A request context, so url_for() can build the URLs written into the CSS
+    with app.test_request_context():
+        for name in BUNDLES:
+            manifest['bundles'][name] = build_bundle(name, static, dist, manifest['files'], minify)
+
+    tmp = os.path.join(dist, f'{MANIFEST}.{os.getpid()}.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp, os.path.join(dist, MANIFEST))
+    load_manifest(app)
+    return manifest
+
+
+def vendor_assets(static, echo):
+    # Downloads every VENDOR file, then the files its CSS url()s point at
+    for url, path in VENDOR.values():
+        data = _download(url, static, path, echo)
+        if path.endswith('.css'):
+            base_url, base_path = posixpath.dirname(url), posixpath.dirname(path)
+            for reference in sorted({match.group(2).strip() for match in _css_url.finditer(data.decode('utf-8'))}):
+                if _is_external(reference):
+                    continue
+                relative = reference.split('?')[0].split('#')[0]
+                _download(f'{base_url}/{relative}', static, posixpath.normpath(posixpath.join(base_path, relative)),
+                          echo)
+
+
+def _download(url, static, path, echo):
+    with urllib.request.urlopen(url, timeout=30) as response:
+        data = response.read()
+    target = os.path.join(static, *path.split('/'))
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with open(target, 'wb') as f:
+        f.write(data)
+    echo(f'{url} -> static/{path}')
+    return data
+
+
+########################################
+# TEMPLATE HELPERS
+########################################
+def load_manifest(app):
+    path = os.path.join(_dist_dir(app), MANIFEST)
+    manifest = None
+    if not app.config['ASSETS_DEBUG'] and os.path.isfile(path):
+        with open(path) as f:
+            manifest = json.load(f)
+    app.extensions['assets'] = manifest
+    return manifest
+
+
+def asset_url(endpoint, **values):
+    # Drop-in for url_for: asset_url('static', filename='images/favicon.png')
+    # gives the fingerprinted copy once `flask assets build` has run.
+    manifest = current_app.extensions.get('assets')
+    if endpoint == 'static' and manifest:
+        hashed = manifest['files'].get(values.get('filename'))
+        if hashed:
+            values['filename'] = hashed
+            return url_for('views.get_asset', **values)
+    return url_for(endpoint, **values)
+
+
+def asset_bundle(name):
+    # URLs to load, in order: the built bundle, or its sources one by one
+    manifest = current_app.extensions.get('assets')
+    if manifest and name in manifest['bundles']:
+        return [url_for('views.get_asset', filename=part['file']) if 'file' in part else part['url']
+                for part in manifest['bundles'][name]]
+
+    urls = []
+    for entry in BUNDLES[name]:
+        path, cdn_url = _source(entry)
+        if cdn_url is None or os.path.isfile(os.path.join(_static_dir(current_app), *path.split('/'))):
+            urls.append(url_for('static', filename=path))
+        else:
+            urls.append(cdn_url)
+    return urls
+
+
+def asset_stamp(app):
+    # Part of TEMPLATE_STAMP: pages must revalidate when asset URLs change
+    manifest = app.extensions.get('assets')
+    if not manifest:
+        return ''
+    return hashlib.sha256(json.dumps(manifest, sort_keys=True).encode()).hexdigest()[:8]
+
+
+########################################
+# SERVING — /assets/<hashed name>
+########################################
+def serve_asset(filename):
+    dist = _dist_dir(current_app)
+    path = safe_join(dist, filename)
+    if path is None or filename.endswith(('.gz', '.br', '.tmp')) or not os.path.isfile(path):
+        abort(404)
+
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    encoding = None
+    for candidate, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if request.accept_encodings[candidate] and os.path.isfile(path + suffix):
+            encoding, path = candidate, path + suffix
+            break
+
+    response = send_file(path, mimetype=mimetype, conditional=True)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Cache-Control'] = IMMUTABLE
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def init_assets(app):
+    app.config.setdefault('ASSETS_DEBUG', os.environ.get('ASSETS_DEBUG', '0') == '1')
+    load_manifest(app)
+    app.add_template_global(asset_url)
+    app.add_template_global(asset_bundle)
+
+
+########################################
+# CLI — flask assets build | vendor
+########################################
+assets_cli = AppGroup('assets', help='Static asset bundles and fingerprinting.')
+
+
+@assets_cli.command('build')
+@click.option('--no-minify', is_flag=True, help='Concatenate only.')
+def build_command(no_minify):
+    app = current_app._get_current_object()
+    manifest = build_assets(app, minify=not no_minify)
+
+    for name, parts in manifest['bundles'].items():
+        click.echo(f'{name}: ' + ', '.join(part.get('file') or part['url'] for part in parts))
+    missing = sorted({part['url'] for parts in manifest['bundles'].values() for part in parts if 'url' in part})
+    if missing:
+        click.echo(f'{len(missing)} sources still load from a CDN, run `flask assets vendor` to bundle them')
+    if brotli is None:
+        click.echo('brotli is not installed: wrote .gz siblings only')
+    click.echo(f'{len(manifest["files"])} files fingerprinted into static/{DIST_DIR}/')
+
+
+@assets_cli.command('vendor')
+def vendor_command():
+    vendor_assets(_static_dir(current_app), click.echo)
+    click.echo('Commit website/static/vendor/ and run `flask assets build`')
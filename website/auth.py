@@ -1,12 +1,22 @@
-from flask import Blueprint, render_template, flash, redirect, url_for
+from flask import Blueprint, render_template, flash, redirect, url_for, request
 from .forms import LoginForm, SignUpForm, PasswordChangeForm
 from .models import Customer
+from .cart import clear_cart_summary
+from .identity import store_identity, forget_identity
+from .passwords import HasherBusy
 from . import db
 from flask_login import login_user, login_required, logout_user, current_user
 
 auth = Blueprint('auth', __name__)
 
 
+@auth.app_errorhandler(HasherBusy)
+def hasher_busy(error):
+    # Every password hashing slot stayed busy for PASSWORD_HASH_TIMEOUT seconds
+    flash('Too many people are signing in right now, please try again in a moment.', 'warning')
+    return redirect(request.path)
+
+
 @auth.route('/sign-up', methods=['GET', 'POST'])
 def sign_up():
     form = SignUpForm()
@@ -45,7 +55,16 @@ def login():
 
         if customer:
             if customer.verify_password(password=password):
+                # Stored hash uses old algorithm/cost settings: upgrade it now
+                # while we have the plain password. The password itself is
+                # unchanged, so credentials_version stays and other sessions
+                # are not logged out.
+                if customer.password_needs_rehash():
+                    customer.password = password
+                    db.session.commit()
+
                 login_user(customer)
+                store_identity(customer)
                 
                 # ROLE-BASED REDIRECT
                 if customer.id == 1:
@@ -65,6 +84,8 @@ def login():
 @login_required
 def log_out():
     logout_user()
+    clear_cart_summary()
+    forget_identity()
     return redirect('/')
 
 
@@ -88,7 +109,10 @@ def change_password(customer_id):
         if customer.verify_password(current_password):
             if new_password == confirm_new_password:
                 customer.password = confirm_new_password
+                customer.credentials_version = Customer.credentials_version + 1
                 db.session.commit()
+                if customer.id == current_user.id:
+                    store_identity(customer)
                 flash('Password Updated Successfully', 'success')
                 return redirect(f'/profile/{customer.id}')
             else:
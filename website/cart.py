@@ -0,0 +1,152 @@
+from collections import namedtuple
+from flask import session
+from flask_login import current_user
+from sqlalchemy import func
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import contains_eager, joinedload
+from .models import Cart, Product
+from . import db
+
+
+CartTotals = namedtuple('CartTotals', ['amount', 'quantity', 'lines'])
+
+
+########################################
+# CART ROWS — ONE JOINED QUERY
+########################################
+def cart_items_for(customer_id):
+    # Cart rows with their Product loaded in the same SELECT, so templates
+    # and views can read item.product without a lazy load per row.
+    return Cart.query.join(Cart.product)\
+                     .options(contains_eager(Cart.product))\
+                     .filter(Cart.customer_link == customer_id)\
+                     .order_by(Cart.id)\
+                     .all()
+
+
+def cart_item_for(customer_id, item_id):
+    return Cart.query.options(joinedload(Cart.product))\
+                     .filter_by(id=item_id, customer_link=customer_id)\
+                     .first()
+
+
+########################################
+# ADD TO CART — UPSERT
+########################################
+UPSERT_INSERTS = {'sqlite': sqlite.insert, 'postgresql': postgresql.insert}
+
+
+def add_product_to_cart(customer_id, product_id):
+    # Returns the line's new quantity; 1 means a new cart line was created.
+    insert = UPSERT_INSERTS.get(db.engine.dialect.name)
+
+    if insert is None:
+        existing = Cart.query.filter_by(customer_link=customer_id, product_link=product_id).first()
+        if existing:
+            existing.quantity += 1
+            return existing.quantity
+        db.session.add(Cart(customer_link=customer_id, product_link=product_id, quantity=1))
+        return 1
+
+    # One statement on the uq_cart_customer_product key
+    stmt = insert(Cart).values(customer_link=customer_id, product_link=product_id, quantity=1)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Cart.customer_link, Cart.product_link],
+        set_={'quantity': Cart.quantity + 1}
+    ).returning(Cart.quantity)
+
+    return db.session.execute(stmt).scalar_one()
+
+
+########################################
+# BATCHED CART CHANGES
+########################################
+def apply_cart_changes(customer_id, deltas):
+    # deltas maps cart item id -> quantity change. Lines that drop below 1
+    # are removed. Returns {item id: new quantity} (0 = removed); ids that
+    # are not in this customer's cart are left out. The caller commits.
+    if not deltas:
+        return {}
+
+    items = Cart.query.filter(Cart.customer_link == customer_id, Cart.id.in_(deltas)).all()
+    quantities = {}
+
+    for item in items:
+        item.quantity += deltas[item.id]
+        if item.quantity < 1:
+            db.session.delete(item)
+            quantities[item.id] = 0
+        else:
+            quantities[item.id] = item.quantity
+
+    return quantities
+
+
+########################################
+# CART TOTALS — ONE SQL AGGREGATE
+########################################
+def cart_totals(customer_id):
+    amount, quantity, lines = db.session.query(
+        func.coalesce(func.sum(Cart.quantity * Product.current_price), 0),
+        func.coalesce(func.sum(Cart.quantity), 0),
+        func.count(Cart.id)
+    ).join(Product, Cart.product_link == Product.id)\
+     .filter(Cart.customer_link == customer_id)\
+     .one()
+
+    return CartTotals(float(amount), int(quantity), int(lines))
+
+
+########################################
+# CART SUMMARY — NAVBAR BADGE
+########################################
+# Kept in the signed session and adjusted by every cart mutation, so pages
+# can show the badge without touching the cart table. It is only rebuilt
+# from the database when missing or when it belongs to another customer.
+SUMMARY_KEY = 'cart_summary'
+EMPTY_SUMMARY = {'lines': 0, 'quantity': 0, 'amount': 0.0}
+
+
+def _store_summary(customer_id, lines, quantity, amount):
+    session[SUMMARY_KEY] = {
+        'customer': customer_id,
+        'lines': max(lines, 0),
+        'quantity': max(quantity, 0),
+        'amount': round(max(amount, 0.0), 2)
+    }
+    return session[SUMMARY_KEY]
+
+
+def set_cart_summary(customer_id, totals):
+    return _store_summary(customer_id, totals.lines, totals.quantity, totals.amount)
+
+
+def get_cart_summary(customer_id):
+    summary = session.get(SUMMARY_KEY)
+    if not summary or summary.get('customer') != customer_id:
+        summary = set_cart_summary(customer_id, cart_totals(customer_id))
+    return summary
+
+
+def adjust_cart_summary(customer_id, lines=0, quantity=0, amount=0.0):
+    summary = session.get(SUMMARY_KEY)
+    if not summary or summary.get('customer') != customer_id:
+        # Nothing cached yet; the next read rebuilds it from the database.
+        return None
+    return _store_summary(customer_id,
+                          summary['lines'] + lines,
+                          summary['quantity'] + quantity,
+                          summary['amount'] + amount)
+
+
+def clear_cart_summary(customer_id=None):
+    if customer_id is None:
+        session.pop(SUMMARY_KEY, None)
+    else:
+        _store_summary(customer_id, 0, 0, 0.0)
+
+
+def inject_cart_summary():
+    if not current_user.is_authenticated or current_user.id == 1:
+        return {'cart_summary': EMPTY_SUMMARY}
+    return {'cart_summary': get_cart_summary(current_user.id)}
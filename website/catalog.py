@@ -0,0 +1,114 @@
+import os
+import threading
+import time
+from flask import current_app, render_template
+from markupsafe import Markup
+
+
+########################################
+# CATALOG VERSION
+########################################
+# A token in the instance folder that changes whenever products or stock
+# change. Every worker reads the same file, so a bump from one worker
+# invalidates the cached grid and ETags in all of them.
+VERSION_FILE = 'catalog.version'
+# Coarsest file timestamp we expect (ext3 and FAT/NFS-style mounts tick in
+# whole seconds, FAT in two). Until the file is older than this, another
+# bump could land on the same mtime, so the token is read from the file.
+MTIME_RESOLUTION = 2.0  # seconds
+
+_version = {'stat': None, 'settled': False, 'token': '0'}
+_fragments = {}
+_stats = {'hits': 0, 'misses': 0, 'not_modified': 0}
+
+
+def _version_path():
+    return os.path.join(current_app.instance_path, VERSION_FILE)
+
+
+def catalog_version():
+    path = _version_path()
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return _version['token']
+
+    # bump_catalog_version replaces the file, so a bump changes the inode
+    # as well as (on fine-grained filesystems) the mtime
+    key = (stat.st_ino, stat.st_mtime_ns)
+    if key != _version['stat'] or not _version['settled']:
+        with open(path) as f:
+            _version['token'] = f.read().strip() or '0'
+        _version['stat'] = key
+        _version['settled'] = time.time() - stat.st_mtime >= MTIME_RESOLUTION
+
+    return _version['token']
+
+
+def bump_catalog_version():
+    # Call after the commit that changed the catalog, never before it.
+    path = _version_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    token = f'{time.time_ns():x}{os.getpid():x}'
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(token)
+    os.replace(tmp_path, path)
+
+    _fragments.clear()
+    return token
+
+
+########################################
+# RENDERED FRAGMENTS
+########################################
+def peek_fragment(template):
+    # The cached fragment, or None; for callers that load the context
+    # themselves (asynchronously) before calling cached_fragment.
+    fragment = _fragments.get((template, catalog_version()))
+    if fragment is not None:
+        _stats['hits'] += 1
+    return fragment
+
+
+def cached_fragment(template, load_context):
+    # load_context() is only called (and the database only touched) on a miss.
+    version = catalog_version()
+    key = (template, version)
+
+    fragment = _fragments.get(key)
+    if fragment is not None:
+        _stats['hits'] += 1
+        return fragment
+
+    _stats['misses'] += 1
+    fragment = Markup(render_template(template, **load_context()))
+
+    # Fragments for older versions are never served again.
+    for stale in [k for k in _fragments if k[1] != version]:
+        _fragments.pop(stale, None)
+    _fragments[key] = fragment
+
+    return fragment
+
+
+def catalog_etag():
+    return f'catalog-{catalog_version()}-{current_app.config.get("TEMPLATE_STAMP", "")}'
+
+
+def record_not_modified():
+    _stats['not_modified'] += 1
+
+
+def catalog_cache_stats():
+    return dict(_stats, version=catalog_version(), fragments=len(_fragments))
+
+
+def template_stamp(app):
+    # Changes on deploy, so browsers revalidate against new markup.
+    newest = 0
+    for root, dirs, files in os.walk(os.path.join(app.root_path, app.template_folder)):
+        for name in files:
+            newest = max(newest, os.stat(os.path.join(root, name)).st_mtime_ns)
+    return f'{newest:x}'
@@ -0,0 +1,153 @@
+import os
+from collections import namedtuple
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import bindparam, insert
+from .models import Product, Cart, Order, OrderItem
+from .cart import cart_items_for, cart_totals
+from .sales import record_order_placed
+from .database import retry_on_lock
+from .jobs import enqueue, task
+from .flashsale import take_flash_stock, return_flash_stock
+from . import db
+
+
+StockShortage = namedtuple('StockShortage', ['product_id', 'product_name', 'requested', 'available'])
+
+
+class InsufficientStock(Exception):
+    def __init__(self, shortages):
+        # Empty when stock was restored between the failed update and the
+        # follow-up read; the caller should just ask the customer to retry.
+        super().__init__(', '.join(s.product_name for s in shortages))
+        self.shortages = shortages
+
+
+product_table = Product.__table__
+
+# Decrement only when enough stock is left. The check and the write are one
+# statement, so two workers checking out the same product cannot both pass.
+reserve_stock = product_table.update()\
+    .where(product_table.c.id == bindparam('pid'))\
+    .where(product_table.c.in_stock >= bindparam('qty'))\
+    .values(in_stock=product_table.c.in_stock - bindparam('qty'))
+
+
+########################################
+# PLACE ORDER — ONE TRANSACTION
+########################################
+@retry_on_lock
+def place_cart_order(customer_id, payment_method):
+    cart_items = cart_items_for(customer_id)
+
+    if not cart_items:
+        return None
+
+    wanted = {}
+    for item in cart_items:
+        wanted[item.product_link] = wanted.get(item.product_link, 0) + item.quantity
+
+    total_amount = cart_totals(customer_id).amount
+
+    # 1a. Flash-sale products (FLASH_SALE_INVENTORY) come out of the token store
+    flash_taken, flash_shortages = take_flash_stock(wanted)
+    if flash_shortages:
+        names = {item.product_link: item.product.product_name for item in cart_items}
+        raise InsufficientStock([StockShortage(product_id, names[product_id], requested, available)
+                                 for product_id, requested, available in flash_shortages])
+
+    try:
+        return _write_order(customer_id, payment_method, cart_items, wanted, flash_taken, total_amount)
+    except BaseException:
+        # The order was not saved, so those units are for sale again
+        return_flash_stock(flash_taken)
+        raise
+
+
+def _write_order(customer_id, payment_method, cart_items, wanted, flash_taken, total_amount):
+    # 1b. Conditional stock decrement for every other product in one executemany
+    wanted = {product_id: quantity for product_id, quantity in wanted.items() if product_id not in flash_taken}
+
+    if wanted:
+        result = db.session.execute(reserve_stock, [
+            {'pid': product_id, 'qty': quantity} for product_id, quantity in wanted.items()
+        ])
+
+        if result.rowcount != len(wanted):
+            db.session.rollback()
+            raise InsufficientStock(find_shortages(wanted))
+
+    # 2. Order header
+    new_order = Order(
+        customer_id=customer_id,
+        total_price=total_amount,
+        status="pending",
+        payment_method=payment_method,
+        date_created=datetime.utcnow()
+    )
+    db.session.add(new_order)
+    db.session.flush()
+
+    # 3. Order items in one bulk insert
+    db.session.execute(insert(OrderItem), [
+        {
+            'order_id': new_order.id,
+            'product_id': item.product_link,
+            'quantity': item.quantity,
+            'price_each': item.product.current_price
+        }
+        for item in cart_items
+    ])
+
+    record_order_placed(new_order, [
+        (item.product_link, item.quantity, item.product.current_price) for item in cart_items
+    ])
+
+    # Receipt is written by a background job committed with the order
+    enqueue('orders.receipt', {'order_id': new_order.id})
+
+    # 4. Clear only the cart rows that were ordered
+    Cart.query.filter(Cart.id.in_([item.id for item in cart_items]))\
+              .delete(synchronize_session=False)
+
+    # 5. Single commit
+    db.session.commit()
+
+    return new_order
+
+
+def find_shortages(wanted):
+    rows = db.session.query(Product.id, Product.product_name, Product.in_stock)\
+                     .filter(Product.id.in_(list(wanted)))\
+                     .all()
+    found = {row.id: row for row in rows}
+
+    shortages = []
+    for product_id, requested in wanted.items():
+        row = found.get(product_id)
+        if row is None:
+            shortages.append(StockShortage(product_id, f'Product #{product_id}', requested, 0))
+        elif row.in_stock < requested:
+            shortages.append(StockShortage(product_id, row.product_name, requested, row.in_stock))
+
+    return shortages
+
+
+########################################
+# AFTER THE ORDER — BACKGROUND JOBS
+########################################
+@task('orders.receipt')
+def write_receipt(payload):
+    # Rewrites the whole file, so running the job twice is harmless
+    order = db.session.get(Order, payload['order_id'])
+    if order is None:
+        return
+
+    directory = os.path.join(current_app.instance_path, 'receipts')
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'order-{order.id}.txt')
+
+    with open(f'{path}.tmp', 'w', encoding='utf-8') as f:
+        # Not render_template: there is no request (or current_user) here
+        f.write(current_app.jinja_env.get_template('receipt.txt').render(order=order))
+    os.replace(f'{path}.tmp', path)
@@ -0,0 +1,113 @@
+import os
+import random
+import time
+from functools import wraps
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+from . import db
+
+
+# Applied to every new SQLite connection. WAL lets readers keep reading
+# while one writer commits; busy_timeout makes writers wait for the lock
+# instead of failing straight away with "database is locked".
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,         # ms
+    'cache_size': -20000,         # KiB (about 20 MB) per connection
+    'mmap_size': 128 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+}
+
+
+########################################
+# CONFIG
+########################################
+def database_uri(default):
+    # DATABASE_URL swaps the engine, e.g. postgresql://user:pw@host/aquashop
+    uri = os.environ.get('DATABASE_URL', default)
+    if uri.startswith('postgres://'):
+        uri = 'postgresql://' + uri[len('postgres://'):]
+    return uri
+
+
+def _env_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+def _in_memory(uri):
+    # sqlite://, :memory: and mode=memory URIs get a single-connection pool
+    # (Flask-SQLAlchemy's StaticPool, or SQLAlchemy's SingletonThreadPool),
+    # which takes none of the QueuePool sizing arguments
+    return uri.startswith('sqlite') and (uri.split('?')[0] in ('sqlite://', 'sqlite:///') or ':memory:' in uri
+                                         or 'mode=memory' in uri)
+
+
+def engine_options(uri):
+    options = {}
+    if not _in_memory(uri):
+        options.update({
+            'pool_size': _env_int('DB_POOL_SIZE', 5),
+            'max_overflow': _env_int('DB_MAX_OVERFLOW', 10),
+            'pool_timeout': _env_int('DB_POOL_TIMEOUT', 30),
+            'pool_recycle': _env_int('DB_POOL_RECYCLE', 1800),
+        })
+    if uri.startswith('sqlite'):
+        # Connections are shared across request threads by the pool
+        options['connect_args'] = {'check_same_thread': False}
+    else:
+        options['pool_pre_ping'] = True
+    return options
+
+
+def configure_database(app):
+    app.config.setdefault('SQLITE_PRAGMAS', dict(SQLITE_PRAGMAS))
+    app.config.setdefault('DB_LOCK_RETRIES', _env_int('DB_LOCK_RETRIES', 5))
+    app.config.setdefault('DB_LOCK_BACKOFF', 0.05)
+
+    with app.app_context():
+        engine = db.engine
+        if engine.dialect.name == 'sqlite':
+            pragmas = app.config['SQLITE_PRAGMAS']
+            event.listen(engine, 'connect', lambda conn, record: apply_pragmas(conn, pragmas))
+
+
+def apply_pragmas(dbapi_connection, pragmas):
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+    finally:
+        cursor.close()
+
+
+########################################
+# LOCK CONTENTION — RETRY WITH BACKOFF
+########################################
+def is_lock_error(error):
+    message = str(getattr(error, 'orig', error)).lower()
+    return 'database is locked' in message or 'database table is locked' in message \
+        or 'deadlock detected' in message or 'could not serialize' in message
+
+
+def retry_on_lock(func):
+    # Re-runs a whole unit of work (reads, writes and commit) when the
+    # database reports lock contention. The function must do its side
+    # effects (flash, session, files) only after its commit succeeds.
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        retries = current_app.config.get('DB_LOCK_RETRIES', 5)
+        backoff = current_app.config.get('DB_LOCK_BACKOFF', 0.05)
+
+        for attempt in range(retries + 1):
+            try:
+                return func(*args, **kwargs)
+            except OperationalError as e:
+                db.session.rollback()
+                if attempt == retries or not is_lock_error(e):
+                    raise
+                time.sleep(backoff * (2 ** attempt) * random.uniform(0.5, 1.5))
+
+    return wrapper
@@ -0,0 +1,129 @@
+import csv
+import io
+import json
+from datetime import date, datetime, timedelta
+from flask import Response, stream_with_context
+from sqlalchemy import select
+from .models import Customer, Order, OrderItem, Product
+from . import db
+
+
+# Rows are read YIELD_PER at a time through a server-side cursor and sent
+# to the client as they are encoded, so memory stays flat whatever the
+# size of the export.
+YIELD_PER = 1000
+FORMATS = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+
+PRODUCT_COLUMNS = ('id', 'product_name', 'current_price', 'previous_price', 'in_stock',
+                   'product_picture', 'flash_sale', 'date_added')
+
+ORDER_COLUMNS = ('order_id', 'date_created', 'status', 'payment_method', 'payment_reference', 'order_total',
+                 'customer_id', 'customer_username', 'customer_email',
+                 'product_id', 'product_name', 'quantity', 'price_each', 'line_total')
+
+
+class ExportError(ValueError):
+    pass
+
+
+def _plain(value):
+    if isinstance(value, datetime):
+        return value.isoformat(sep=' ')
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+########################################
+# ENCODERS
+########################################
+def csv_lines(columns, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    writer.writerow(columns)
+    for count, row in enumerate(rows, 1):
+        writer.writerow([_plain(value) for value in row])
+        if count % YIELD_PER == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    yield buffer.getvalue()
+
+
+def jsonl_lines(columns, rows):
+    chunk = []
+    for row in rows:
+        chunk.append(json.dumps(dict(zip(columns, (_plain(value) for value in row)))))
+        if len(chunk) == YIELD_PER:
+            yield '\n'.join(chunk) + '\n'
+            chunk = []
+
+    if chunk:
+        yield '\n'.join(chunk) + '\n'
+
+
+def stream_rows(statement):
+    # Yields result rows in YIELD_PER batches without buffering the result
+    result = db.session.execute(statement.execution_options(yield_per=YIELD_PER))
+    try:
+        for partition in result.partitions():
+            yield from partition
+    finally:
+        result.close()
+
+
+def export_response(filename, export_format, columns, rows):
+    encode = csv_lines if export_format == 'csv' else jsonl_lines
+    response = Response(stream_with_context(encode(columns, rows)), mimetype=FORMATS[export_format])
+    response.headers['Content-Disposition'] = f'attachment; filename={filename}.{export_format}'
+    return response
+
+
+########################################
+# PRODUCTS
+########################################
+def product_rows():
+    columns = [getattr(Product, column) for column in PRODUCT_COLUMNS]
+    return stream_rows(select(*columns).order_by(Product.id))
+
+
+########################################
+# ORDERS — ONE ROW PER ORDER ITEM
+########################################
+def parse_day(value, name):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        raise ExportError(f'{name} must be a date like 2024-01-31')
+
+
+def order_filters(args):
+    # ?from=2024-01-01&to=2024-12-31&status=Picked-Up (all optional, `to` inclusive)
+    filters = []
+    if args.get('from'):
+        filters.append(Order.date_created >= parse_day(args['from'], 'from'))
+    if args.get('to'):
+        filters.append(Order.date_created < parse_day(args['to'], 'to') + timedelta(days=1))
+    statuses = [status for status in args.getlist('status') if status]
+    if statuses:
+        filters.append(Order.status.in_(statuses))
+    return filters
+
+
+def order_rows(filters):
+    # Walks ix_orders_date_created in order; products deleted since the
+    # order was placed still export, without a name.
+    statement = select(
+        Order.id, Order.date_created, Order.status, Order.payment_method, Order.payment_reference,
+        Order.total_price, Customer.id, Customer.username, Customer.email,
+        OrderItem.product_id, Product.product_name, OrderItem.quantity, OrderItem.price_each,
+        OrderItem.quantity * OrderItem.price_each
+    ).join(Customer, Customer.id == Order.customer_id)\
+     .join(OrderItem, OrderItem.order_id == Order.id)\
+     .outerjoin(Product, Product.id == OrderItem.product_id)\
+     .where(*filters)\
+     .order_by(Order.date_created, Order.id, OrderItem.id)
+
+    return stream_rows(statement)
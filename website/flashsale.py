@@ -0,0 +1,258 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from flask import current_app
+from sqlalchemy import bindparam, select
+from .models import FlashSaleLedger, Product
+from .catalog import bump_catalog_version
+from . import db
+
+
+# FLASH_SALE_INVENTORY=1 moves the stock of flash_sale products into a
+# small SQLite file shared by all workers on the host. Checkouts take
+# stock from there instead of from the hot product row, and the flusher
+# thread writes the decrements back to product.in_stock every
+# FLASH_SALE_FLUSH_INTERVAL seconds.
+#
+# The store only ever grows two counters per product (units reserved,
+# units released by failed checkouts). flash_sale_ledger remembers how
+# much of them product.in_stock already includes, so a flush that crashes
+# half way, or runs twice, is corrected by the next one.
+STORE_FILE = 'flash_stock.sqlite3'
+FLUSH_INTERVAL = 1.0  # seconds
+
+
+class TokenStore:
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.execute('PRAGMA synchronous = NORMAL')
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS stock (
+                    product_id INTEGER NOT NULL PRIMARY KEY,
+                    available INTEGER NOT NULL,
+                    reserved INTEGER NOT NULL,
+                    released INTEGER NOT NULL
+                )""")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        # BEGIN IMMEDIATE takes the write lock up front, so the check and
+        # the decrement below cannot interleave with another worker's.
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def reserve(self, wanted):
+        # wanted: {product_id: quantity}. Returns (taken, shortages): taken
+        # holds the products this store manages; nothing is taken when any
+        # of them is short. shortages: [(product_id, requested, available)]
+        ids = list(wanted)
+        with self.transaction() as conn:
+            rows = conn.execute(f"SELECT product_id, available FROM stock "
+                                f"WHERE product_id IN ({', '.join('?' * len(ids))})", ids).fetchall()
+            available = dict(rows)
+            taken = {product_id: wanted[product_id] for product_id in available}
+
+            shortages = [(product_id, quantity, available[product_id])
+                         for product_id, quantity in taken.items() if available[product_id] < quantity]
+            if shortages:
+                return {}, shortages
+
+            conn.executemany("UPDATE stock SET available = available - ?, reserved = reserved + ? "
+                             "WHERE product_id = ?",
+                             [(quantity, quantity, product_id) for product_id, quantity in taken.items()])
+            return taken, []
+
+    def release(self, taken):
+        if not taken:
+            return
+        with self.transaction() as conn:
+            conn.executemany("UPDATE stock SET available = available + ?, released = released + ? "
+                             "WHERE product_id = ?",
+                             [(quantity, quantity, product_id) for product_id, quantity in taken.items()])
+
+    def counters(self, conn=None):
+        conn = conn or self._connection()
+        return conn.execute("SELECT product_id, reserved, released FROM stock").fetchall()
+
+    def stats(self):
+        rows = self._connection().execute("SELECT product_id, available, reserved, released FROM stock")
+        return {product_id: {'available': available, 'reserved': reserved, 'released': released}
+                for product_id, available, reserved, released in rows}
+
+
+def token_store():
+    return current_app.extensions.get('flash_sale_store')
+
+
+########################################
+# CHECKOUT
+########################################
+def take_flash_stock(wanted):
+    store = token_store()
+    if store is None or not wanted:
+        return {}, []
+    return store.reserve(wanted)
+
+
+def return_flash_stock(taken):
+    store = token_store()
+    if store is not None:
+        store.release(taken)
+
+
+########################################
+# WRITE-BEHIND
+########################################
+ledger_table = FlashSaleLedger.__table__
+product_table = Product.__table__
+
+# Compare-and-set: only the flush that saw the current ledger values wins
+advance_ledger = ledger_table.update()\
+    .where(ledger_table.c.product_id == bindparam('pid'))\
+    .where(ledger_table.c.reserved == bindparam('old_reserved'))\
+    .where(ledger_table.c.released == bindparam('old_released'))\
+    .values(reserved=bindparam('new_reserved'), released=bindparam('new_released'))
+
+apply_to_product = product_table.update()\
+    .where(product_table.c.id == bindparam('pid'))\
+    .values(in_stock=product_table.c.in_stock - bindparam('delta'))
+
+
+def flush_flash_stock(conn=None):
+    # Applies the units reserved/released since the last flush to
+    # product.in_stock in one transaction. Returns the products changed.
+    store = token_store()
+    if store is None:
+        return 0
+
+    counters = store.counters(conn)
+    if not counters:
+        return 0
+
+    applied = {row.product_id: row for row in
+               db.session.execute(select(ledger_table).where(ledger_table.c.product_id.in_([c[0] for c in counters])))}
+
+    changed = 0
+    for product_id, reserved, released in counters:
+        ledger = applied.get(product_id)
+        # A stale snapshot (another worker flushed newer counters) is skipped
+        if ledger is None or reserved < ledger.reserved or released < ledger.released:
+            continue
+        if reserved == ledger.reserved and released == ledger.released:
+            continue
+        delta = (reserved - ledger.reserved) - (released - ledger.released)
+
+        result = db.session.execute(advance_ledger, {
+            'pid': product_id, 'old_reserved': ledger.reserved, 'old_released': ledger.released,
+            'new_reserved': reserved, 'new_released': released
+        })
+        if result.rowcount == 1:
+            db.session.execute(apply_to_product, {'pid': product_id, 'delta': delta})
+            changed += 1
+
+    db.session.commit()
+    if changed:
+        # Stock shown on the cached product pages changed
+        bump_catalog_version()
+    return changed
+
+
+########################################
+# RECONCILIATION — STARTUP AND ADMIN EDITS
+########################################
+def reload_flash_stock():
+    # Rebuilds the store from the product table: flushes what is pending,
+    # then loads every flash_sale product's in_stock as its available stock.
+    # Checkouts wait on the store's lock meanwhile.
+    store = token_store()
+    if store is None:
+        return
+
+    with store.transaction() as conn:
+        flush_flash_stock(conn)
+
+        products = db.session.query(Product.id, Product.in_stock).filter(Product.flash_sale.is_(True)).all()
+        ids = [product.id for product in products]
+        ledger = {row.product_id: (row.reserved, row.released)
+                  for row in db.session.execute(select(ledger_table).where(ledger_table.c.product_id.in_(ids)))}
+
+        missing = [{'product_id': product_id, 'reserved': 0, 'released': 0}
+                   for product_id in ids if product_id not in ledger]
+        if missing:
+            db.session.execute(ledger_table.insert(), missing)
+            ledger.update((row['product_id'], (0, 0)) for row in missing)
+        db.session.commit()
+
+        # Counters restart from what product.in_stock already includes
+        conn.execute("DELETE FROM stock")
+        conn.executemany("INSERT INTO stock (product_id, available, reserved, released) VALUES (?, ?, ?, ?)",
+                         [(product.id, max(product.in_stock, 0)) + ledger[product.id] for product in products])
+
+
+class Flusher:
+    def __init__(self, app, interval):
+        self.app = app
+        self.interval = interval
+        self._stop = threading.Event()
+
+    def start(self):
+        threading.Thread(target=self._run, name='flash-sale-flusher', daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        with self.app.app_context():
+            while not self._stop.wait(self.interval):
+                try:
+                    flush_flash_stock()
+                except Exception as e:
+                    db.session.rollback()
+                    print(f'Flash sale flush failed: {e}')
+                finally:
+                    db.session.remove()
+
+
+_flushers = {}
+_flushers_lock = threading.Lock()
+
+
+def init_flash_sale(app):
+    app.config.setdefault('FLASH_SALE_INVENTORY', os.environ.get('FLASH_SALE_INVENTORY', '0') == '1')
+    app.config.setdefault('FLASH_SALE_FLUSH_INTERVAL', FLUSH_INTERVAL)
+
+    if not app.config['FLASH_SALE_INVENTORY']:
+        return
+
+    os.makedirs(app.instance_path, exist_ok=True)
+    app.extensions['flash_sale_store'] = TokenStore(os.path.join(app.instance_path, STORE_FILE))
+
+    with app.app_context():
+        reload_flash_stock()
+
+    # One flusher per process, started like the job workers
+    @app.before_request
+    def start_flash_sale_flusher():
+        if os.getpid() in _flushers:
+            return
+        with _flushers_lock:
+            if os.getpid() not in _flushers:
+                flusher = Flusher(app, app.config['FLASH_SALE_FLUSH_INTERVAL'])
+                flusher.start()
+                _flushers[os.getpid()] = flusher
@@ -1,6 +1,6 @@
 from flask_wtf import FlaskForm
 from wtforms import StringField, IntegerField, FloatField, PasswordField, EmailField, BooleanField, SubmitField, SelectField
-from wtforms.validators import DataRequired, length, NumberRange
+from wtforms.validators import DataRequired, InputRequired, length, NumberRange
 from flask_wtf.file import FileField, FileRequired
 
 
@@ -29,7 +29,7 @@ class ShopItemsForm(FlaskForm):
     product_name = StringField('Name of Product', validators=[DataRequired()])
     current_price = FloatField('Current Price', validators=[DataRequired()])
     previous_price = FloatField('Previous Price', validators=[DataRequired()])
-    in_stock = IntegerField('In Stock', validators=[DataRequired(), NumberRange(min=0)])
+    in_stock = IntegerField('In Stock', validators=[InputRequired(), NumberRange(min=0)])
     product_picture = FileField('Product Picture', validators=[DataRequired()])
     flash_sale = BooleanField('Flash Sale')
 
@@ -37,6 +37,11 @@ class ShopItemsForm(FlaskForm):
     update_product = SubmitField('Update')
 
 
+class ProductImportForm(FlaskForm):
+    products_file = FileField('CSV or JSONL File', validators=[FileRequired()])
+    import_products = SubmitField('Import')
+
+
 class OrderForm(FlaskForm):
     order_status = SelectField('Order Status', choices=[('Pending', 'Pending'), ('Accepted', 'Accepted'),
                                                         ('Ready For Pick-Up', 'Ready For Pick-Up'),
@@ -0,0 +1,92 @@
+import time
+from flask import current_app, request, session
+from flask_login import UserMixin
+from .models import Customer
+from . import db
+
+
+# The logged-in customer's id, username and email are kept in the signed
+# session and trusted for IDENTITY_TTL seconds, so most requests never load
+# the customer row. When the TTL runs out the row is read again; if the
+# customer changed their password in the meantime (credentials_version was
+# bumped from another session) this one is logged out, and username/email
+# edits are picked up. Until then another session can still browse, and may
+# show a stale username, for up to IDENTITY_TTL.
+#
+# Routes that touch the account, spend money or administer the shop don't
+# wait for the TTL: IDENTITY_SENSITIVE_ENDPOINTS (endpoint or blueprint
+# names) re-read the credentials version on every request.
+IDENTITY_KEY = 'identity'
+IDENTITY_TTL = 60
+SENSITIVE_ENDPOINTS = ('admin', 'auth.profile', 'auth.change_password', 'views.checkout', 'views.place_order',
+                       'views.admin_orders', 'views.update_order_status', 'views.admin_page')
+
+
+class Identity(UserMixin):
+    def __init__(self, id, username, email):
+        self.id = id
+        self.username = username
+        self.email = email
+        self._customer = None
+
+    @property
+    def customer(self):
+        # Full Customer row, loaded only for routes that need it
+        if self._customer is None:
+            self._customer = db.session.get(Customer, self.id)
+        return self._customer
+
+    def __getattr__(self, name):
+        # Anything not cached here (password_hash, orders, ...) comes from the row
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.customer, name)
+
+    def __repr__(self):
+        return f"<Identity {self.username}>"
+
+
+def store_identity(customer):
+    session[IDENTITY_KEY] = {
+        'id': customer.id,
+        'username': customer.username,
+        'email': customer.email,
+        'version': customer.credentials_version,
+        'checked': time.time()
+    }
+
+
+def forget_identity():
+    session.pop(IDENTITY_KEY, None)
+
+
+def _sensitive():
+    endpoints = current_app.config.get('IDENTITY_SENSITIVE_ENDPOINTS', SENSITIVE_ENDPOINTS)
+    return request.endpoint in endpoints or request.blueprint in endpoints
+
+
+def load_identity(user_id):
+    ttl = current_app.config.get('IDENTITY_TTL', IDENTITY_TTL)
+    data = session.get(IDENTITY_KEY)
+    if data and data['id'] != user_id:
+        data = None
+
+    if data and time.time() - data['checked'] < ttl and not _sensitive():
+        return Identity(data['id'], data['username'], data['email'])
+
+    # Just the cached columns, not the whole row
+    row = db.session.query(Customer.id, Customer.username, Customer.email,
+                           Customer.credentials_version).filter(Customer.id == user_id).first()
+    if row is None:
+        forget_identity()
+        return None
+
+    if data and data.get('version') != row.credentials_version:
+        # Password was changed elsewhere: this session is no longer valid.
+        # Drop flask-login's key too, or the next request would log back in.
+        forget_identity()
+        session.pop('_user_id', None)
+        return None
+
+    store_identity(row)
+    return Identity(row.id, row.username, row.email)
@@ -0,0 +1,155 @@
+import os
+import posixpath
+import re
+import click
+from flask.cli import AppGroup
+from .media import media_dir, media_url
+from .catalog import bump_catalog_version
+from .jobs import enqueue, task
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional; pages fall back to the original file
+    Image = None
+
+
+# Widths generated for every product picture. Cards on the home page are
+# ~300px wide, cart thumbnails 150px.
+WIDTHS = (160, 320, 640)
+JPEG_QUALITY = 80
+WEBP_QUALITY = 75
+
+DERIVATIVE_RE = re.compile(r'\.\d+w\.[a-z0-9]+$', re.IGNORECASE)
+
+
+########################################
+# PATHS
+########################################
+def derivative_name(filename, width, ext):
+    stem = os.path.splitext(filename)[0]
+    return f'{stem}.{width}w.{ext}'
+
+
+def is_derivative(filename):
+    return bool(DERIVATIVE_RE.search(filename))
+
+
+def _output_ext(filename):
+    ext = os.path.splitext(filename)[1].lower().lstrip('.')
+    if ext in ('jpg', 'jpeg'):
+        return 'jpg'
+    if ext in ('png', 'webp'):
+        return ext
+    # AVIF, GIF, ... get JPEG fallbacks for browsers without support
+    return 'jpg'
+
+
+########################################
+# DERIVATIVES
+########################################
+def generate_derivatives(path, force=False):
+    # Writes <name>.<width>w.<ext> and <name>.<width>w.webp next to the
+    # original. Returns the list of files written.
+    if Image is None or is_derivative(path):
+        return []
+
+    directory, filename = os.path.split(path)
+    out_ext = _output_ext(filename)
+    written = []
+
+    try:
+        with Image.open(path) as original:
+            original = ImageOps.exif_transpose(original)
+
+            for width in WIDTHS:
+                if original.width <= width:
+                    continue
+
+                height = round(original.height * width / original.width)
+                resized = original.resize((width, height), Image.LANCZOS)
+
+                for ext in dict.fromkeys((out_ext, 'webp')):
+                    target = os.path.join(directory, derivative_name(filename, width, ext))
+                    if not force and os.path.exists(target) \
+                            and os.path.getmtime(target) >= os.path.getmtime(path):
+                        continue
+                    _save(resized, target, ext)
+                    written.append(target)
+    except (OSError, ValueError) as e:
+        print('Image derivatives not generated', path, e)
+
+    return written
+
+
+def _save(image, target, ext):
+    tmp_target = f'{target}.tmp'
+    if ext == 'jpg':
+        image.convert('RGB').save(tmp_target, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+    elif ext == 'webp':
+        image.save(tmp_target, 'WEBP', quality=WEBP_QUALITY, method=4)
+    else:
+        image.save(tmp_target, ext.upper(), optimize=True)
+    # Readers never see a half-written file
+    os.replace(tmp_target, target)
+
+
+def schedule_derivatives(path):
+    # Resizing a multi-megabyte photo takes longer than the rest of the
+    # request, so it is queued as a job saved by the product's commit.
+    if Image is None:
+        return None
+    return enqueue('images.derivatives', {'path': os.path.abspath(path)})
+
+
+@task('images.derivatives', max_attempts=3)
+def derivatives_job(payload):
+    if not os.path.isfile(payload['path']):
+        return  # replaced or deleted since the job was queued
+    if generate_derivatives(payload['path']):
+        # Cached pages were rendered before these files existed
+        bump_catalog_version()
+
+
+########################################
+# TEMPLATE HELPERS
+########################################
+def media_srcset(url, ext=None):
+    # srcset for the derivatives that exist on disk; '' when there are none
+    # yet, in which case templates just use the original src.
+    if not url:
+        return ''
+
+    filename = posixpath.basename(url)
+    ext = ext or _output_ext(filename)
+    base_url = posixpath.dirname(url)
+    directory = media_dir()
+
+    candidates = []
+    for width in WIDTHS:
+        name = derivative_name(filename, width, ext)
+        if os.path.exists(os.path.join(directory, name)):
+            candidates.append(f'{media_url(posixpath.join(base_url, name))} {width}w')
+
+    return ', '.join(candidates)
+
+
+########################################
+# CLI — flask images backfill
+########################################
+images_cli = AppGroup('images', help='Product picture derivatives.')
+
+
+@images_cli.command('backfill')
+@click.option('--force', is_flag=True, help='Regenerate derivatives that already exist.')
+def backfill_command(force):
+    if Image is None:
+        click.echo('Pillow is not installed')
+        return
+
+    directory = media_dir()
+    for filename in sorted(os.listdir(directory)):
+        path = os.path.join(directory, filename)
+        if not os.path.isfile(path) or is_derivative(filename) or filename.endswith('.tmp'):
+            continue
+        written = generate_derivatives(path, force=force)
+        click.echo(f'{filename}: {len(written)} files')
@@ -0,0 +1,254 @@
+import codecs
+import csv
+import json
+import os
+import posixpath
+import click
+from flask.cli import AppGroup
+from sqlalchemy import select
+from sqlalchemy.exc import SQLAlchemyError
+from werkzeug.datastructures import MultiDict
+from werkzeug.utils import secure_filename
+from .cart import UPSERT_INSERTS
+from .catalog import bump_catalog_version
+from .flashsale import reload_flash_stock
+from .exports import PRODUCT_COLUMNS, csv_lines, jsonl_lines, product_rows
+from .forms import ShopItemsForm
+from .media import media_dir
+from .models import Product
+from .search import index_products
+from . import db
+
+
+# The upload is read row by row and written IMPORT_BATCH rows per
+# transaction, so memory depends on the batch size, not the file size.
+# A batch the database rejects is rolled back and reported; earlier
+# batches stay committed.
+IMPORT_BATCH = 500
+MAX_REPORTED_ERRORS = 200
+
+IMPORT_FIELDS = ('product_name', 'current_price', 'previous_price', 'in_stock', 'product_picture', 'flash_sale')
+FALSE_VALUES = ('', '0', 'false', 'no', 'n', 'off')
+IMPORT_FORMATS = {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl'}
+
+product_table = Product.__table__
+
+
+class ImportReport:
+    def __init__(self):
+        self.inserted = 0
+        self.updated = 0
+        self.failed = 0
+        self.errors = []
+
+    def error(self, line, messages):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, messages))
+
+    def as_dict(self):
+        return {'inserted': self.inserted, 'updated': self.updated, 'failed': self.failed,
+                'errors': [{'line': line, 'errors': messages} for line, messages in self.errors]}
+
+
+def import_format(filename):
+    return IMPORT_FORMATS.get(os.path.splitext(filename or '')[1].lower())
+
+
+########################################
+# READING
+########################################
+def read_rows(stream, file_format):
+    # Yields (line number, row dict); row is None for a line that is not a JSON object
+    lines = codecs.iterdecode(stream, 'utf-8-sig')
+
+    if file_format == 'csv':
+        reader = csv.DictReader(lines)
+        for row in reader:
+            yield reader.line_num, row
+        return
+
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield number, row if isinstance(row, dict) else None
+
+
+def _text(value):
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'y' if value else ''
+    return str(value).strip()
+
+
+########################################
+# VALIDATION — SAME RULES AS THE ADD PRODUCT FORM
+########################################
+def row_form():
+    # One form for the whole import, re-filled for every row. The picture
+    # is not uploaded here: it must name a file already in media/.
+    form = ShopItemsForm(formdata=None, meta={'csrf': False})
+    del form['product_picture']
+    return form
+
+
+def validate_row(form, row):
+    # Returns (values for the product table, list of error messages)
+    if row is None:
+        return None, ['line is not a JSON object']
+
+    data = {field: _text(row.get(field)) for field in IMPORT_FIELDS}
+    if data['flash_sale'].lower() in FALSE_VALUES:
+        data['flash_sale'] = ''
+
+    form.process(MultiDict(data))
+
+    errors = []
+    if not form.validate():
+        for field, messages in form.errors.items():
+            errors.extend(f'{field}: {message}' for message in messages)
+
+    picture = secure_filename(posixpath.basename(data['product_picture'].replace('\\', '/')))
+    if not picture:
+        errors.append('product_picture: This field is required.')
+    elif not os.path.isfile(os.path.join(media_dir(), picture)):
+        errors.append(f'product_picture: {picture} is not in the media folder')
+
+    product_id = _text(row.get('id'))
+    if product_id and (not product_id.isdigit() or int(product_id) < 1):
+        errors.append('id: must be a positive whole number')
+
+    if errors:
+        return None, errors
+
+    values = {
+        'product_name': form.product_name.data,
+        'current_price': form.current_price.data,
+        'previous_price': form.previous_price.data,
+        'in_stock': form.in_stock.data,
+        'product_picture': f'./media/{picture}',
+        'flash_sale': form.flash_sale.data
+    }
+    if product_id:
+        values['id'] = int(product_id)
+    return values, []
+
+
+########################################
+# WRITING — ONE TRANSACTION PER BATCH
+########################################
+def _upsert_by_id(rows):
+    insert = UPSERT_INSERTS.get(db.engine.dialect.name)
+
+    if insert is None:
+        for row in rows:
+            db.session.merge(Product(**row))
+        return
+
+    stmt = insert(product_table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[product_table.c.id],
+        set_={field: stmt.excluded[field] for field in IMPORT_FIELDS}
+    )
+    db.session.execute(stmt, rows)
+
+
+def write_batch(batch, report):
+    # batch: list of (line number, values)
+    with_id = [values for _, values in batch if 'id' in values]
+    without_id = [values for _, values in batch if 'id' not in values]
+
+    try:
+        indexed = []
+        existing = set()
+
+        if with_id:
+            ids = {values['id'] for values in with_id}
+            existing = set(db.session.scalars(select(Product.id).where(Product.id.in_(ids))))
+            _upsert_by_id(with_id)
+            indexed.extend(with_id)
+
+        if without_id:
+            result = db.session.execute(
+                product_table.insert().returning(product_table.c.id, product_table.c.product_name),
+                without_id
+            )
+            indexed.extend({'id': row.id, 'product_name': row.product_name} for row in result)
+
+        index_products(indexed)
+        db.session.commit()
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        message = str(getattr(e, 'orig', e))
+        for line, _ in batch:
+            report.error(line, [f'not saved: {message}'])
+        return
+
+    updated = sum(1 for values in with_id if values['id'] in existing)
+    report.updated += updated
+    report.inserted += len(batch) - updated
+
+
+def import_products(stream, file_format, batch_size=IMPORT_BATCH):
+    report = ImportReport()
+    form = row_form()
+    batch = []
+
+    for line, row in read_rows(stream, file_format):
+        values, errors = validate_row(form, row)
+        if errors:
+            report.error(line, errors)
+            continue
+
+        batch.append((line, values))
+        if len(batch) >= batch_size:
+            write_batch(batch, report)
+            batch = []
+
+    if batch:
+        write_batch(batch, report)
+
+    if report.inserted or report.updated:
+        bump_catalog_version()
+        reload_flash_stock()
+
+    return report
+
+
+########################################
+# CLI — flask products import | export
+########################################
+products_cli = AppGroup('products', help='Bulk product import and export.')
+
+
+@products_cli.command('import')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'file_format', type=click.Choice(['csv', 'jsonl']), default=None,
+              help='Defaults to the file extension.')
+def import_command(path, file_format):
+    file_format = file_format or import_format(path)
+    if file_format is None:
+        raise click.UsageError('Cannot tell the format from the file name, pass --format')
+
+    with open(path, 'rb') as f:
+        report = import_products(f, file_format)
+
+    click.echo(f'{report.inserted} inserted, {report.updated} updated, {report.failed} failed')
+    for line, messages in report.errors:
+        click.echo(f'  line {line}: ' + '; '.join(messages))
+    if report.failed > len(report.errors):
+        click.echo(f'  ... and {report.failed - len(report.errors)} more')
+
+
+@products_cli.command('export')
+@click.option('--format', 'file_format', type=click.Choice(['csv', 'jsonl']), default='csv')
+@click.option('-o', '--output', type=click.File('w'), default='-')
+def export_command(file_format, output):
+    encode = csv_lines if file_format == 'csv' else jsonl_lines
+    for chunk in encode(PRODUCT_COLUMNS, product_rows()):
+        output.write(chunk)
@@ -0,0 +1,294 @@
+import json
+import os
+import random
+import socket
+import threading
+import time
+import traceback
+from collections import namedtuple
+from datetime import datetime, timedelta
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import and_, event, func, or_, select
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+from .models import Job
+from . import db
+
+
+# Work that can happen after the response (resizing pictures, receipts)
+# is saved as a row in the jobs table by the request's own transaction,
+# then picked up by worker threads. A worker leases a job for JOB_LEASE
+# seconds; if it dies mid-job the lease runs out and another worker runs
+# it again, so tasks must be safe to run more than once.
+JOB_WORKERS = 2
+JOB_LEASE = 300            # seconds
+JOB_POLL_INTERVAL = 1.0    # seconds between polls when idle
+JOB_RETRY_BACKOFF = 5      # seconds, doubled on every failed attempt
+JOB_MAX_BACKOFF = 3600
+
+Task = namedtuple('Task', ['func', 'max_attempts'])
+TASKS = {}
+
+jobs_table = Job.__table__
+_wake = threading.Event()
+
+
+def task(name, max_attempts=5):
+    # Registers func(payload) to run jobs enqueued under `name`
+    def register(func):
+        TASKS[name] = Task(func, max_attempts)
+        return func
+    return register
+
+
+########################################
+# ENQUEUE — FROM VIEWS
+########################################
+def enqueue(name, payload=None, delay=0):
+    # Added to db.session: the job is saved by the caller's commit, and
+    # vanishes with its rollback, together with the change it belongs to.
+    if name not in TASKS:
+        raise KeyError(f'unknown task {name}')
+
+    job = Job(
+        task=name,
+        payload=json.dumps(payload or {}),
+        status='queued',
+        attempts=0,
+        max_attempts=TASKS[name].max_attempts,
+        run_after=datetime.utcnow() + timedelta(seconds=delay)
+    )
+    db.session.add(job)
+    db.session.info['jobs_enqueued'] = True
+    return job
+
+
+@event.listens_for(Session, 'after_commit')
+def _wake_workers(session):
+    if session.info.pop('jobs_enqueued', False):
+        _wake.set()
+
+
+########################################
+# CLAIM / FINISH
+########################################
+def _ready(now):
+    return or_(
+        and_(jobs_table.c.status == 'queued', jobs_table.c.run_after <= now),
+        and_(jobs_table.c.status == 'running', jobs_table.c.locked_until < now,
+             jobs_table.c.attempts < jobs_table.c.max_attempts)
+    )
+
+
+def claim_job(worker_id, lease):
+    # One UPDATE ... RETURNING picks the oldest ready job and leases it, so
+    # two workers can never claim the same job. Idle polls stop at a plain
+    # read: they don't take the write lock when there is nothing to claim.
+    now = datetime.utcnow()
+    with db.engine.connect() as conn:
+        if conn.execute(select(jobs_table.c.id).where(_ready(now)).limit(1)).first() is None:
+            return None
+
+    next_id = select(jobs_table.c.id)\
+        .where(_ready(now))\
+        .order_by(jobs_table.c.run_after, jobs_table.c.id)\
+        .limit(1)\
+        .with_for_update(skip_locked=True)\
+        .scalar_subquery()
+
+    stmt = jobs_table.update()\
+        .where(jobs_table.c.id == next_id)\
+        .where(_ready(now))\
+        .values(status='running', attempts=jobs_table.c.attempts + 1,
+                locked_by=worker_id, locked_until=now + timedelta(seconds=lease))\
+        .returning(jobs_table.c.id, jobs_table.c.task, jobs_table.c.payload,
+                   jobs_table.c.attempts, jobs_table.c.max_attempts)
+
+    with db.engine.begin() as conn:
+        return conn.execute(stmt).first()
+
+
+def finish_job(job, worker_id, error=None):
+    now = datetime.utcnow()
+    if error is None:
+        values = {'status': 'done', 'date_finished': now, 'locked_until': None, 'last_error': None}
+    elif job.attempts >= job.max_attempts:
+        values = {'status': 'failed', 'date_finished': now, 'locked_until': None, 'last_error': error}
+    else:
+        backoff = current_app.config.get('JOB_RETRY_BACKOFF', JOB_RETRY_BACKOFF)
+        delay = min(backoff * 2 ** (job.attempts - 1), JOB_MAX_BACKOFF) * random.uniform(0.5, 1.5)
+        values = {'status': 'queued', 'run_after': now + timedelta(seconds=delay),
+                  'locked_until': None, 'last_error': error}
+
+    # A worker whose lease ran out (and was re-claimed) must not overwrite the new owner's state
+    with db.engine.begin() as conn:
+        conn.execute(jobs_table.update()
+                     .where(jobs_table.c.id == job.id, jobs_table.c.locked_by == worker_id,
+                            jobs_table.c.status == 'running')
+                     .values(**values))
+
+
+def fail_abandoned_jobs():
+    # Jobs whose worker died on their last allowed attempt
+    with db.engine.begin() as conn:
+        conn.execute(jobs_table.update()
+                     .where(jobs_table.c.status == 'running',
+                            jobs_table.c.locked_until < datetime.utcnow(),
+                            jobs_table.c.attempts >= jobs_table.c.max_attempts)
+                     .values(status='failed', last_error='worker stopped before finishing the job'))
+
+
+def run_next_job(worker_id):
+    # Runs one job inside the current app context; False when none is ready
+    job = claim_job(worker_id, current_app.config.get('JOB_LEASE', JOB_LEASE))
+    if job is None:
+        return False
+
+    error = None
+    try:
+        registered = TASKS.get(job.task)
+        if registered is None:
+            raise LookupError(f'unknown task {job.task}')
+        registered.func(json.loads(job.payload))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        error = traceback.format_exc(limit=5)
+        print(f'Job {job.id} ({job.task}) failed, attempt {job.attempts}/{job.max_attempts}')
+    finally:
+        db.session.remove()
+
+    finish_job(job, worker_id, error)
+    return True
+
+
+########################################
+# WORKER THREADS
+########################################
+class JobWorkers:
+    def __init__(self, app, threads):
+        self.app = app
+        self.threads = threads
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        for index in range(self.threads):
+            thread = threading.Thread(target=self._run, args=(index,), name=f'jobs-{index}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        _wake.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _run(self, index):
+        worker_id = f'{socket.gethostname()}:{os.getpid()}:{index}'
+        poll = self.app.config.get('JOB_POLL_INTERVAL', JOB_POLL_INTERVAL)
+        last_reap = 0
+
+        with self.app.app_context():
+            while not self._stop.is_set():
+                try:
+                    ran = run_next_job(worker_id)
+                    if not ran and index == 0 and time.monotonic() - last_reap > 60:
+                        fail_abandoned_jobs()
+                        last_reap = time.monotonic()
+                except OperationalError as e:
+                    # e.g. database locked for longer than busy_timeout
+                    print(f'Job worker {worker_id}: {e}')
+                    ran = False
+
+                if not ran:
+                    _wake.wait(poll)
+                    _wake.clear()
+
+
+_workers = {}
+_workers_lock = threading.Lock()
+
+
+def init_jobs(app):
+    app.config.setdefault('JOB_WORKERS', int(os.environ.get('JOB_WORKERS', JOB_WORKERS)))
+    app.config.setdefault('JOB_LEASE', JOB_LEASE)
+    app.config.setdefault('JOB_POLL_INTERVAL', JOB_POLL_INTERVAL)
+    app.config.setdefault('JOB_RETRY_BACKOFF', JOB_RETRY_BACKOFF)
+
+    # Started by the first request of each process rather than here, so CLI
+    # commands don't spawn workers and gunicorn's forked workers get their own.
+    # JOB_WORKERS=0 leaves all jobs to `flask jobs work`.
+    @app.before_request
+    def start_job_workers():
+        if not app.config['JOB_WORKERS'] or os.getpid() in _workers:
+            return
+        with _workers_lock:
+            if os.getpid() not in _workers:
+                workers = JobWorkers(app, app.config['JOB_WORKERS'])
+                workers.start()
+                _workers[os.getpid()] = workers
+
+
+########################################
+# CLI — flask jobs work | status | retry | purge
+########################################
+jobs_cli = AppGroup('jobs', help='Background job queue.')
+
+
+@jobs_cli.command('work')
+@click.option('--threads', type=int, default=JOB_WORKERS, help='Worker threads.')
+@click.option('--burst', is_flag=True, help='Exit once no job is ready.')
+def work_command(threads, burst):
+    if burst:
+        worker_id = f'{socket.gethostname()}:{os.getpid()}:cli'
+        count = 0
+        while run_next_job(worker_id):
+            count += 1
+        click.echo(f'Ran {count} jobs')
+        return
+
+    workers = JobWorkers(current_app._get_current_object(), threads)
+    workers.start()
+    click.echo(f'Running {threads} job workers, Ctrl+C to stop')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        click.echo('Stopping; running jobs will be retried once their lease expires')
+        workers.stop(timeout=5)
+
+
+@jobs_cli.command('status')
+def status_command():
+    counts = db.session.query(Job.status, func.count(Job.id)).group_by(Job.status).all()
+    for status, count in counts:
+        click.echo(f'{status:>8} {count}')
+
+    for job in Job.query.filter_by(status='failed').order_by(Job.id.desc()).limit(10):
+        last_line = (job.last_error or '').strip().splitlines()[-1:] or ['']
+        click.echo(f'  failed #{job.id} {job.task}: {last_line[0]}')
+
+
+@jobs_cli.command('retry')
+@click.argument('job_ids', nargs=-1, type=int)
+def retry_command(job_ids):
+    query = Job.query.filter_by(status='failed')
+    if job_ids:
+        query = query.filter(Job.id.in_(job_ids))
+    count = query.update({'status': 'queued', 'attempts': 0, 'run_after': datetime.utcnow()},
+                         synchronize_session=False)
+    db.session.commit()
+    click.echo(f'Requeued {count} jobs')
+
+
+@jobs_cli.command('purge')
+@click.option('--days', type=int, default=7, help='Delete finished jobs older than this.')
+def purge_command(days):
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    count = Job.query.filter(Job.status == 'done', Job.date_finished < cutoff)\
+                     .delete(synchronize_session=False)
+    db.session.commit()
+    click.echo(f'Deleted {count} finished jobs')
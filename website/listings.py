@@ -0,0 +1,88 @@
+from sqlalchemy import func, select
+from sqlalchemy.orm import selectinload
+from .models import Customer, Product, Order, OrderItem
+from .pagination import keyset_page, page_size
+from . import db
+
+
+########################################
+# ADMIN — ORDERS
+########################################
+# Customer fields are joined in and the item count is a correlated
+# subquery, so a page costs one statement no matter how many orders exist.
+def order_page(args):
+    item_count = select(func.count(OrderItem.id))\
+        .where(OrderItem.order_id == Order.id)\
+        .correlate(Order)\
+        .scalar_subquery()
+
+    query = db.session.query(
+        Order,
+        Customer.username,
+        Customer.email,
+        item_count.label('item_count')
+    ).outerjoin(Customer, Order.customer_id == Customer.id)
+
+    return keyset_page(query, Order.date_created, Order.id,
+                       key=lambda row: (row.Order.date_created, row.Order.id),
+                       after=args.get('after'), before=args.get('before'),
+                       descending=True, per_page=page_size(args))
+
+
+########################################
+# ADMIN — CUSTOMERS
+########################################
+def customer_page(args):
+    order_count = select(func.count(Order.id))\
+        .where(Order.customer_id == Customer.id)\
+        .correlate(Customer)\
+        .scalar_subquery()
+
+    lifetime_value = select(func.coalesce(func.sum(Order.total_price), 0))\
+        .where(Order.customer_id == Customer.id)\
+        .correlate(Customer)\
+        .scalar_subquery()
+
+    query = db.session.query(
+        Customer,
+        order_count.label('order_count'),
+        lifetime_value.label('lifetime_value')
+    )
+
+    return keyset_page(query, Customer.date_joined, Customer.id,
+                       key=lambda row: (row.Customer.date_joined, row.Customer.id),
+                       after=args.get('after'), before=args.get('before'),
+                       per_page=page_size(args))
+
+
+########################################
+# ADMIN — SHOP ITEMS
+########################################
+def product_page(args):
+    return keyset_page(Product.query, Product.date_added, Product.id,
+                       key=lambda item: (item.date_added, item.id),
+                       after=args.get('after'), before=args.get('before'),
+                       per_page=page_size(args))
+
+
+########################################
+# CUSTOMER — OWN ORDERS
+########################################
+# Items and their products are loaded up front (two extra statements in
+# total, not two per order): the templates walk order.items and
+# item.product, and the async views in asgi.py cannot lazy-load at all.
+def customer_orders(customer_id):
+    return select(Order)\
+        .where(Order.customer_id == customer_id)\
+        .order_by(Order.date_created.desc())\
+        .options(selectinload(Order.items).selectinload(OrderItem.product))
+
+
+def customer_order(customer_id, order_id):
+    return select(Order).where(Order.id == order_id, Order.customer_id == customer_id)
+
+
+def order_items(order_id):
+    return select(OrderItem)\
+        .where(OrderItem.order_id == order_id)\
+        .options(selectinload(OrderItem.product))
@@ -0,0 +1,136 @@
+import hashlib
+import mimetypes
+import os
+import posixpath
+import threading
+from collections import OrderedDict
+from flask import Response, abort, current_app, request, send_file
+from werkzeug.security import safe_join
+
+
+# Files up to HOT_FILE_MAX bytes are kept in memory, up to CACHE_BUDGET
+# bytes in total per worker (MEDIA_CACHE_BUDGET; 0 turns the cache off),
+# least recently used evicted first.
+HOT_FILE_MAX = 256 * 1024
+CACHE_BUDGET = 32 * 1024 * 1024
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'public, no-cache'
+FINGERPRINT_LENGTH = 16
+
+
+def media_dir():
+    return os.path.abspath(os.path.join(current_app.root_path, '..', 'media'))
+
+
+class MediaCache:
+    def __init__(self, budget=CACHE_BUDGET):
+        self.budget = budget
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._files = OrderedDict()
+        self._digests = {}
+        self._lock = threading.Lock()
+
+    def digest(self, path, stat):
+        # Content hash, recomputed only when the file's mtime or size changes.
+        key = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            cached = self._digests.get(path)
+        if cached and cached[0] == key:
+            return cached[1]
+
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(64 * 1024), b''):
+                sha.update(chunk)
+        digest = sha.hexdigest()
+
+        with self._lock:
+            self._digests[path] = (key, digest)
+        return digest
+
+    def read(self, path, stat):
+        key = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            cached = self._files.get(path)
+            if cached and cached[0] == key:
+                self._files.move_to_end(path)
+                self.hits += 1
+                return cached[1]
+            self.misses += 1
+
+        with open(path, 'rb') as f:
+            data = f.read()
+
+        with self._lock:
+            old = self._files.pop(path, None)
+            if old:
+                self.size -= len(old[1])
+            self._files[path] = (key, data)
+            self.size += len(data)
+            while self.size > self.budget and self._files:
+                _, (_, evicted) = self._files.popitem(last=False)
+                self.size -= len(evicted)
+
+        return data
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'files': len(self._files),
+                    'bytes': self.size, 'budget': self.budget}
+
+
+media_cache = MediaCache()
+
+
+def init_media(app):
+    app.config.setdefault('MEDIA_CACHE_BUDGET', int(os.environ.get('MEDIA_CACHE_BUDGET', CACHE_BUDGET)))
+    media_cache.budget = app.config['MEDIA_CACHE_BUDGET']
+
+
+########################################
+# SERVING
+########################################
+def serve_media(filename):
+    path = safe_join(media_dir(), filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+
+    stat = os.stat(path)
+    etag = media_cache.digest(path, stat)
+
+    # ?v= matching the current content hash means the URL can never point at
+    # other bytes, so browsers may keep it for a year without revalidating.
+    fingerprinted = request.args.get('v') == etag[:FINGERPRINT_LENGTH]
+
+    if stat.st_size <= min(HOT_FILE_MAX, media_cache.budget):
+        data = media_cache.read(path, stat)
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        response = Response(data, mimetype=mimetype)
+        response.set_etag(etag)
+        response.last_modified = stat.st_mtime
+        response = response.make_conditional(request, accept_ranges=True, complete_length=len(data))
+    else:
+        response = send_file(path, etag=etag, conditional=True, last_modified=stat.st_mtime)
+
+    response.headers['Cache-Control'] = IMMUTABLE if fingerprinted else REVALIDATE
+    return response
+
+
+########################################
+# TEMPLATE HELPER
+########################################
+def media_url(url):
+    # './media/tuna.jpg' -> './media/tuna.jpg?v=<content hash>'
+    if not url:
+        return url
+
+    path = safe_join(media_dir(), posixpath.basename(url))
+    try:
+        stat = os.stat(path)
+    except (TypeError, OSError):
+        return url
+
+    return f'{url}?v={media_cache.digest(path, stat)[:FINGERPRINT_LENGTH]}'
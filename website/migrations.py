@@ -0,0 +1,393 @@
+import os
+from datetime import datetime
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import IntegrityError
+from . import db
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process lock, run `flask db upgrade` instead
+    fcntl = None
+
+
+# Every migration must be safe to run against a database that already has
+# its changes (older databases were created by hand from database/*.sql or
+# by db.create_all()), so each one checks before it alters anything.
+#
+# The migrations are SQLite SQL: they reconcile databases this app created
+# over time. Any other database (DATABASE_URL=postgresql://...) started out
+# on the current models, so upgrade() builds it from them and records the
+# versions as applied (see _upgrade_from_models).
+MIGRATIONS = []
+
+
+def migration(version, name):
+    def register(func):
+        MIGRATIONS.append((version, name, func))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return func
+    return register
+
+
+def _columns(conn, table):
+    return {column['name'] for column in inspect(conn).get_columns(table)}
+
+
+########################################
+# 0001 — BASELINE TABLES
+########################################
+@migration(1, 'baseline tables')
+def baseline(conn):
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS customer (
+            id INTEGER NOT NULL,
+            email VARCHAR(100),
+            username VARCHAR(100),
+            password_hash VARCHAR(150),
+            date_joined DATETIME,
+            PRIMARY KEY (id),
+            UNIQUE (email)
+        )"""))
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS product (
+            id INTEGER NOT NULL,
+            product_name VARCHAR(100) NOT NULL,
+            current_price FLOAT NOT NULL,
+            previous_price FLOAT NOT NULL,
+            in_stock INTEGER NOT NULL,
+            product_picture VARCHAR(1000) NOT NULL,
+            flash_sale BOOLEAN,
+            date_added DATETIME,
+            PRIMARY KEY (id)
+        )"""))
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS cart (
+            id INTEGER NOT NULL,
+            quantity INTEGER NOT NULL,
+            customer_link INTEGER NOT NULL,
+            product_link INTEGER NOT NULL,
+            PRIMARY KEY (id),
+            FOREIGN KEY(customer_link) REFERENCES customer (id),
+            FOREIGN KEY(product_link) REFERENCES product (id)
+        )"""))
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS orders (
+            id INTEGER NOT NULL,
+            customer_id INTEGER NOT NULL,
+            total_price FLOAT NOT NULL,
+            payment_method VARCHAR(50),
+            status VARCHAR(50),
+            payment_reference VARCHAR(200),
+            date_created DATETIME,
+            PRIMARY KEY (id),
+            FOREIGN KEY(customer_id) REFERENCES customer (id)
+        )"""))
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS order_items (
+            id INTEGER NOT NULL,
+            order_id INTEGER NOT NULL,
+            product_id INTEGER NOT NULL,
+            quantity INTEGER NOT NULL,
+            price_each FLOAT NOT NULL,
+            PRIMARY KEY (id),
+            FOREIGN KEY(order_id) REFERENCES orders (id),
+            FOREIGN KEY(product_id) REFERENCES product (id)
+        )"""))
+
+
+########################################
+# 0002 — orders.created_at -> date_created
+########################################
+@migration(2, 'reconcile orders.created_at with date_created')
+def orders_date_created(conn):
+    # schema_v1/v2.sql used created_at, models.py uses date_created.
+    columns = _columns(conn, 'orders')
+
+    if 'date_created' not in columns:
+        conn.execute(text("ALTER TABLE orders ADD COLUMN date_created DATETIME"))
+
+    if 'created_at' in columns:
+        conn.execute(text("UPDATE orders SET date_created = created_at "
+                          "WHERE date_created IS NULL AND created_at IS NOT NULL"))
+        conn.execute(text("ALTER TABLE orders DROP COLUMN created_at"))
+
+    # Keyset pagination orders by these columns, so they must not be NULL.
+    now = datetime.utcnow().isoformat(sep=' ')
+    conn.execute(text("UPDATE orders SET date_created = :now WHERE date_created IS NULL"), {'now': now})
+    conn.execute(text("UPDATE customer SET date_joined = :now WHERE date_joined IS NULL"), {'now': now})
+    conn.execute(text("UPDATE product SET date_added = :now WHERE date_added IS NULL"), {'now': now})
+
+
+########################################
+# 0003 — ONE CART ROW PER CUSTOMER/PRODUCT
+########################################
+@migration(3, 'merge duplicate cart rows')
+def dedupe_cart(conn):
+    conn.execute(text("""
+        UPDATE cart SET quantity = (
+            SELECT SUM(c2.quantity) FROM cart c2
+            WHERE c2.customer_link = cart.customer_link AND c2.product_link = cart.product_link
+        )
+        WHERE id IN (
+            SELECT MIN(id) FROM cart GROUP BY customer_link, product_link HAVING COUNT(*) > 1
+        )"""))
+    conn.execute(text("""
+        DELETE FROM cart WHERE id NOT IN (
+            SELECT MIN(id) FROM cart GROUP BY customer_link, product_link
+        )"""))
+
+
+########################################
+# 0004 — HOT-PATH INDEXES
+########################################
+@migration(4, 'hot path indexes')
+def hot_path_indexes(conn):
+    # The unique cart key also serves lookups by customer_link alone
+    # (leftmost column), so no separate index is needed for those.
+    conn.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS uq_cart_customer_product "
+                      "ON cart (customer_link, product_link)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_orders_customer_date "
+                      "ON orders (customer_id, date_created)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_orders_date_created "
+                      "ON orders (date_created, id)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_order_items_order "
+                      "ON order_items (order_id)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_customer_date_joined "
+                      "ON customer (date_joined, id)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_product_date_added "
+                      "ON product (date_added, id)"))
+
+
+########################################
+# 0005 — SALES ROLLUP TABLES
+########################################
+@migration(5, 'sales rollup tables')
+def sales_rollups(conn):
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS sales_daily (
+            day DATE NOT NULL,
+            orders INTEGER NOT NULL,
+            units INTEGER NOT NULL,
+            revenue FLOAT NOT NULL,
+            PRIMARY KEY (day)
+        )"""))
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS sales_product (
+            product_id INTEGER NOT NULL,
+            units INTEGER NOT NULL,
+            revenue FLOAT NOT NULL,
+            PRIMARY KEY (product_id)
+        )"""))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_sales_product_units ON sales_product (units)"))
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS sales_status (
+            status VARCHAR(50) NOT NULL,
+            orders INTEGER NOT NULL,
+            PRIMARY KEY (status)
+        )"""))
+
+    # Fill them from the order history that already exists
+    from .sales import rebuild_sales_rollups
+    rebuild_sales_rollups(conn)
+
+
+########################################
+# 0006 — BACKGROUND JOBS
+########################################
+@migration(6, 'background jobs table')
+def jobs_table(conn):
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER NOT NULL,
+            task VARCHAR(100) NOT NULL,
+            payload TEXT NOT NULL,
+            status VARCHAR(20) NOT NULL,
+            attempts INTEGER NOT NULL,
+            max_attempts INTEGER NOT NULL,
+            last_error TEXT,
+            run_after DATETIME NOT NULL,
+            locked_until DATETIME,
+            locked_by VARCHAR(100),
+            date_created DATETIME,
+            date_finished DATETIME,
+            PRIMARY KEY (id)
+        )"""))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_jobs_status_run_after ON jobs (status, run_after)"))
+
+
+########################################
+# 0007 — FLASH SALE LEDGER
+########################################
+@migration(7, 'flash sale ledger')
+def flash_sale_ledger(conn):
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS flash_sale_ledger (
+            product_id INTEGER NOT NULL,
+            reserved INTEGER NOT NULL,
+            released INTEGER NOT NULL,
+            PRIMARY KEY (product_id)
+        )"""))
+
+
+########################################
+# 0008 — CUSTOMER CREDENTIALS VERSION
+########################################
+@migration(8, 'customer credentials version')
+def credentials_version(conn):
+    if 'credentials_version' not in _columns(conn, 'customer'):
+        conn.execute(text("ALTER TABLE customer ADD COLUMN credentials_version INTEGER NOT NULL DEFAULT 0"))
+
+
+########################################
+# RUNNER
+########################################
+def _ensure_version_table(conn):
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER NOT NULL,
+            name VARCHAR(200),
+            applied_at TIMESTAMP,
+            PRIMARY KEY (version)
+        )"""))
+
+
+def applied_versions():
+    with db.engine.begin() as conn:
+        _ensure_version_table(conn)
+        return {row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+
+
+def _record(conn, version, name):
+    conn.execute(text("INSERT INTO schema_migrations (version, name, applied_at) "
+                      "VALUES (:version, :name, :applied_at)"),
+                 {'version': version, 'name': name, 'applied_at': datetime.utcnow().isoformat(sep=' ')})
+
+
+def _upgrade_from_models(pending):
+    from .sales import rebuild_sales_rollups
+    with db.engine.begin() as conn:
+        # Creates only the tables and indexes that are missing
+        db.metadata.create_all(conn)
+        if any(version == 5 for version, _, _ in pending):
+            rebuild_sales_rollups(conn)
+        for version, name, _ in pending:
+            _record(conn, version, name)
+    return [(version, name) for version, name, _ in pending]
+
+
+def upgrade(target=None):
+    applied = applied_versions()
+
+    if db.engine.dialect.name != 'sqlite':
+        pending = [m for m in MIGRATIONS if m[0] not in applied and (target is None or m[0] <= target)]
+        try:
+            return _upgrade_from_models(pending) if pending else []
+        except IntegrityError:
+            # Another process upgraded first; ours was rolled back.
+            return []
+
+    ran = []
+    for version, name, func in MIGRATIONS:
+        if version in applied or (target is not None and version > target):
+            continue
+        try:
+            with db.engine.begin() as conn:
+                func(conn)
+                _record(conn, version, name)
+            ran.append((version, name))
+        except IntegrityError:
+            # Another process recorded this version first; ours was rolled back.
+            pass
+
+    return ran
+
+
+def migrate_on_startup(app):
+    if not app.config.get('AUTO_MIGRATE', True):
+        return
+
+    # Gunicorn starts several workers at once; only one may migrate at a time.
+    os.makedirs(app.instance_path, exist_ok=True)
+    with open(os.path.join(app.instance_path, 'migrations.lock'), 'w') as lock:
+        if fcntl:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            with app.app_context():
+                for version, name in upgrade():
+                    print(f'Applied migration {version:04d} {name}')
+        finally:
+            if fcntl:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+########################################
+# QUERY PLANS FOR THE HOT PATHS
+########################################
+HOT_QUERIES = {
+    'cart rows for customer':
+        "SELECT * FROM cart JOIN product ON product.id = cart.product_link WHERE cart.customer_link = 1",
+    'cart line for add_to_cart':
+        "SELECT * FROM cart WHERE customer_link = 1 AND product_link = 1",
+    'order history':
+        "SELECT * FROM orders WHERE customer_id = 1 ORDER BY date_created DESC",
+    'order details':
+        "SELECT * FROM order_items WHERE order_id = 1",
+    'admin orders page':
+        "SELECT * FROM orders WHERE date_created < '2100-01-01' ORDER BY date_created DESC, id DESC LIMIT 50",
+}
+
+
+def explain_hot_queries():
+    plans = {}
+    with db.engine.connect() as conn:
+        for label, sql in HOT_QUERIES.items():
+            rows = conn.execute(text(f"EXPLAIN QUERY PLAN {sql}")).all()
+            plans[label] = [row[-1] for row in rows]
+    return plans
+
+
+########################################
+# CLI — flask db upgrade | status | explain
+########################################
+db_cli = AppGroup('db', help='Schema migrations.')
+
+
+@db_cli.command('upgrade')
+@click.option('--to', 'target', type=int, default=None, help='Stop after this version.')
+def upgrade_command(target):
+    ran = upgrade(target)
+    for version, name in ran:
+        click.echo(f'Applied {version:04d} {name}')
+    if not ran:
+        click.echo('Database is up to date')
+
+
+@db_cli.command('status')
+def status_command():
+    applied = applied_versions()
+    for version, name, _ in MIGRATIONS:
+        mark = 'x' if version in applied else ' '
+        click.echo(f'[{mark}] {version:04d} {name}')
+
+
+@db_cli.command('explain')
+def explain_command():
+    if db.engine.dialect.name != 'sqlite':
+        click.echo('explain only understands SQLite query plans')
+        return
+
+    scans = 0
+    for label, plan in explain_hot_queries().items():
+        click.echo(label)
+        for step in plan:
+            # "SCAN <table>" without an index means a full table scan
+            full_scan = step.startswith('SCAN') and 'INDEX' not in step
+            scans += full_scan
+            click.echo(f"    {'!!' if full_scan else '  '} {step}")
+
+    if scans:
+        current_app.logger.warning('%s hot query steps scan a whole table', scans)
+        raise SystemExit(1)
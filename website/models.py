@@ -1,17 +1,24 @@
 from . import db
 from flask_login import UserMixin
 from datetime import datetime
-from werkzeug.security import generate_password_hash, check_password_hash
+from .passwords import password_hasher
 
 
 ###############################################
 # CUSTOMER MODEL
 ###############################################
 class Customer(db.Model, UserMixin):
+    __table_args__ = (
+        db.Index('ix_customer_date_joined', 'date_joined', 'id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(100), unique=True)
     username = db.Column(db.String(100))
     password_hash = db.Column(db.String(150))
+    # Bumped when the customer changes their password (not on a rehash);
+    # sessions that stored an older value are logged out, see identity.py
+    credentials_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     date_joined = db.Column(db.DateTime(), default=datetime.utcnow)
 
     # Relationships
@@ -24,10 +31,13 @@ class Customer(db.Model, UserMixin):
 
     @password.setter
     def password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = password_hasher().hash(password)
 
     def verify_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return password_hasher().verify(self.password_hash, password)
+
+    def password_needs_rehash(self):
+        return password_hasher().needs_rehash(self.password_hash)
 
     def __repr__(self):
         return f"<Customer {self.username}>"
@@ -37,6 +47,10 @@ class Customer(db.Model, UserMixin):
 # PRODUCT MODEL
 ###############################################
 class Product(db.Model):
+    __table_args__ = (
+        db.Index('ix_product_date_added', 'date_added', 'id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     product_name = db.Column(db.String(100), nullable=False)
     current_price = db.Column(db.Float, nullable=False)
@@ -57,6 +71,11 @@ class Product(db.Model):
 # CART MODEL
 ###############################################
 class Cart(db.Model):
+    __table_args__ = (
+        # One row per customer/product; add_to_cart upserts on this key
+        db.Index('uq_cart_customer_product', 'customer_link', 'product_link', unique=True),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     quantity = db.Column(db.Integer, nullable=False)
 
@@ -72,6 +91,10 @@ class Cart(db.Model):
 ###############################################
 class Order(db.Model):
     __tablename__ = 'orders'
+    __table_args__ = (
+        db.Index('ix_orders_customer_date', 'customer_id', 'date_created'),
+        db.Index('ix_orders_date_created', 'date_created', 'id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
 
@@ -96,6 +119,9 @@ class Order(db.Model):
 ###############################################
 class OrderItem(db.Model):
     __tablename__ = 'order_items'
+    __table_args__ = (
+        db.Index('ix_order_items_order', 'order_id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
 
@@ -110,3 +136,74 @@ class OrderItem(db.Model):
 
     def __repr__(self):
         return f"<OrderItem {self.id} - Order {self.order_id}>"
+
+
+###############################################
+# SALES ROLLUPS (kept up to date by sales.py)
+###############################################
+class SalesDaily(db.Model):
+    __tablename__ = 'sales_daily'
+
+    day = db.Column(db.Date, primary_key=True)
+    orders = db.Column(db.Integer, nullable=False, default=0)
+    units = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0)
+
+
+class SalesProduct(db.Model):
+    __tablename__ = 'sales_product'
+    __table_args__ = (
+        db.Index('ix_sales_product_units', 'units'),
+    )
+
+    product_id = db.Column(db.Integer, primary_key=True)
+    units = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0)
+
+
+class SalesStatus(db.Model):
+    __tablename__ = 'sales_status'
+
+    status = db.Column(db.String(50), primary_key=True)
+    orders = db.Column(db.Integer, nullable=False, default=0)
+
+
+###############################################
+# BACKGROUND JOB (see jobs.py)
+###############################################
+class Job(db.Model):
+    __tablename__ = 'jobs'
+    __table_args__ = (
+        db.Index('ix_jobs_status_run_after', 'status', 'run_after'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    task = db.Column(db.String(100), nullable=False)
+    payload = db.Column(db.Text, nullable=False, default='{}')
+
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, done, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+    last_error = db.Column(db.Text)
+
+    run_after = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_until = db.Column(db.DateTime)
+    locked_by = db.Column(db.String(100))
+
+    date_created = db.Column(db.DateTime, default=datetime.utcnow)
+    date_finished = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return f"<Job {self.id} {self.task} {self.status}>"
+
+
+###############################################
+# FLASH SALE LEDGER (see flashsale.py)
+###############################################
+class FlashSaleLedger(db.Model):
+    __tablename__ = 'flash_sale_ledger'
+
+    # Token store counters already applied to product.in_stock
+    product_id = db.Column(db.Integer, primary_key=True)
+    reserved = db.Column(db.Integer, nullable=False, default=0)
+    released = db.Column(db.Integer, nullable=False, default=0)
@@ -0,0 +1,84 @@
+import base64
+import binascii
+from collections import namedtuple
+from datetime import datetime
+from sqlalchemy import and_, or_
+
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+KeysetPage = namedtuple('KeysetPage', ['items', 'next_cursor', 'prev_cursor', 'per_page'])
+
+
+########################################
+# CURSORS
+########################################
+# A cursor is the (sort date, id) of the last row on a page, so the next
+# page is a range scan from that key instead of an OFFSET over every
+# earlier row.
+def encode_cursor(sort_value, row_id):
+    raw = f'{sort_value.isoformat()}|{row_id}'.encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode()
+        sort_value, row_id = raw.rsplit('|', 1)
+        return datetime.fromisoformat(sort_value), int(row_id)
+    except (ValueError, binascii.Error, UnicodeDecodeError):
+        return None
+
+
+def page_size(args):
+    per_page = args.get('per_page', PAGE_SIZE, type=int)
+    return max(1, min(per_page, MAX_PAGE_SIZE))
+
+
+########################################
+# KEYSET PAGE
+########################################
+def keyset_page(query, sort_col, id_col, key, after=None, before=None, descending=False, per_page=PAGE_SIZE):
+    # key(row) -> (sort value, id) for a result row
+    forward = not before
+    cursor = decode_cursor(after if forward else before)
+
+    # Walking forward through a descending list (or backward through an
+    # ascending one) means scanning towards smaller keys.
+    towards_smaller = descending == forward
+
+    if cursor:
+        sort_value, row_id = cursor
+        if towards_smaller:
+            query = query.filter(or_(sort_col < sort_value, and_(sort_col == sort_value, id_col < row_id)))
+        else:
+            query = query.filter(or_(sort_col > sort_value, and_(sort_col == sort_value, id_col > row_id)))
+
+    if towards_smaller:
+        query = query.order_by(sort_col.desc(), id_col.desc())
+    else:
+        query = query.order_by(sort_col.asc(), id_col.asc())
+
+    rows = query.limit(per_page + 1).all()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+
+    if not forward:
+        rows.reverse()
+
+    if not rows:
+        return KeysetPage(rows, None, None, per_page)
+
+    first, last = encode_cursor(*key(rows[0])), encode_cursor(*key(rows[-1]))
+
+    if forward:
+        next_cursor = last if has_more else None
+        prev_cursor = first if cursor else None
+    else:
+        next_cursor = last if cursor else None
+        prev_cursor = first if has_more else None
+
+    return KeysetPage(rows, next_cursor, prev_cursor, per_page)
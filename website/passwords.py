@@ -0,0 +1,142 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from flask import current_app
+from werkzeug.security import generate_password_hash, check_password_hash, DEFAULT_PBKDF2_ITERATIONS
+
+try:
+    import fcntl
+except ImportError:  # Windows: the limit is per worker process only
+    fcntl = None
+
+
+DEFAULT_METHOD = f'pbkdf2:sha256:{DEFAULT_PBKDF2_ITERATIONS}'
+SLOT_POLL_INTERVAL = 0.01   # seconds between a waiter's passes over the slot files
+
+
+class HasherBusy(Exception):
+    pass
+
+
+def normalize_method(method):
+    # Spell out werkzeug's defaults so stored hashes compare equal:
+    # 'pbkdf2' -> 'pbkdf2:sha256:600000', 'scrypt' -> 'scrypt:32768:8:1'
+    parts = method.split(':')
+    if parts[0] == 'pbkdf2':
+        hash_name = parts[1] if len(parts) > 1 else 'sha256'
+        iterations = parts[2] if len(parts) > 2 else DEFAULT_PBKDF2_ITERATIONS
+        return f'pbkdf2:{hash_name}:{iterations}'
+    if parts[0] == 'scrypt':
+        n, r, p = (parts[1:] + ['32768', '8', '1'][len(parts) - 1:])[:3]
+        return f'scrypt:{n}:{r}:{p}'
+    return method
+
+
+########################################
+# HASHING SLOTS
+########################################
+# Each slot is a lock file, so the limit holds across all gunicorn workers
+# on the host, not just inside one process. A login that finds every slot
+# taken retries the slot files every SLOT_POLL_INTERVAL for at most
+# PASSWORD_HASH_TIMEOUT (half a second by default), then fails fast with
+# HasherBusy instead of queueing behind a login storm.
+#
+# The retries sleep in the request's own thread: with sync gunicorn workers
+# that worker serves nothing else while it waits. The Dockerfile runs gthread
+# workers with more threads than PASSWORD_HASH_CONCURRENCY, so a worker whose
+# logins are all waiting for a slot still has threads left for other
+# requests. PASSWORD_HASH_CONCURRENCY=0 turns the limit off.
+class HashingSlots:
+    def __init__(self, directory, size, timeout):
+        self.directory = directory
+        self.size = size
+        self.timeout = timeout
+        self._local = threading.BoundedSemaphore(size)
+
+    @contextmanager
+    def acquire(self):
+        # One deadline for both waits, so a login never waits longer than `timeout`
+        deadline = time.monotonic() + self.timeout
+        if not self._local.acquire(timeout=self.timeout):
+            raise HasherBusy()
+        try:
+            if fcntl is None:
+                yield
+            else:
+                with self._acquire_slot_file(deadline):
+                    yield
+        finally:
+            self._local.release()
+
+    @contextmanager
+    def _acquire_slot_file(self, deadline):
+        os.makedirs(self.directory, exist_ok=True)
+
+        while True:
+            for slot in range(self.size):
+                f = open(os.path.join(self.directory, f'slot-{slot}.lock'), 'a')
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    f.close()
+                    continue
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+                    f.close()
+                return
+
+            if time.monotonic() > deadline:
+                raise HasherBusy()
+            time.sleep(SLOT_POLL_INTERVAL)
+
+
+########################################
+# HASHER
+########################################
+class PasswordHasher:
+    def __init__(self, method=DEFAULT_METHOD, slots=None):
+        self.method = normalize_method(method)
+        self.slots = slots
+
+    @contextmanager
+    def _slot(self):
+        if self.slots is None:
+            yield
+        else:
+            with self.slots.acquire():
+                yield
+
+    def hash(self, password):
+        with self._slot():
+            return generate_password_hash(password, method=self.method)
+
+    def verify(self, password_hash, password):
+        if not password_hash:
+            return False
+        with self._slot():
+            return check_password_hash(password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        method = password_hash.split('$', 1)[0]
+        return normalize_method(method) != self.method
+
+
+def init_password_hasher(app):
+    app.config.setdefault('PASSWORD_HASH_METHOD', os.environ.get('PASSWORD_HASH_METHOD', DEFAULT_METHOD))
+    app.config.setdefault('PASSWORD_HASH_CONCURRENCY',
+                          int(os.environ.get('PASSWORD_HASH_CONCURRENCY', max(1, (os.cpu_count() or 2) // 2))))
+    app.config.setdefault('PASSWORD_HASH_TIMEOUT', float(os.environ.get('PASSWORD_HASH_TIMEOUT', 0.5)))
+
+    slots = None
+    if app.config['PASSWORD_HASH_CONCURRENCY'] > 0:
+        slots = HashingSlots(os.path.join(app.instance_path, 'hash_slots'),
+                             app.config['PASSWORD_HASH_CONCURRENCY'],
+                             app.config['PASSWORD_HASH_TIMEOUT'])
+    app.extensions['password_hasher'] = PasswordHasher(app.config['PASSWORD_HASH_METHOD'], slots)
+
+
+def password_hasher():
+    return current_app.extensions['password_hasher']
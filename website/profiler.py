@@ -0,0 +1,206 @@
+import cProfile
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import deque
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from . import db
+
+
+# SQL_PROFILER=1 (development and staging, not production) counts and
+# times every statement a request runs, groups them by fingerprint (the
+# SQL with its IN lists collapsed) and flags a likely N+1 loop when a
+# SELECT repeats SQL_PROFILER_REPEATS times or more. Each response gets
+# an X-SQL-Profile header; /admin/perf shows the totals per route and the
+# latest flagged requests.
+#
+# SQL_PROFILER_CPROFILE=0.01 also runs cProfile on that share of requests
+# (optionally only SQL_PROFILER_CPROFILE_ROUTES=views.cart,admin.order_view)
+# and writes instance/profiles/<endpoint>-<time>.prof for snakeviz/pstats.
+PROFILER_REPEATS = 5
+PROFILER_HISTORY = 50      # flagged requests kept for /admin/perf
+PROFILES_DIR = 'profiles'
+
+_in_list = re.compile(r'IN \((?:[?%:$][\w()]*(?:, )?)+\)')
+_spaces = re.compile(r'\s+')
+
+
+def fingerprint(statement):
+    return _in_list.sub('IN (...)', _spaces.sub(' ', statement).strip())
+
+
+def _origin():
+    # Where the statement came from: the innermost template line and the
+    # innermost line of our own code, found by walking up the stack.
+    package = os.path.dirname(__file__)
+    template = code = None
+    frame = sys._getframe(2)
+    while frame is not None and (template is None or code is None):
+        jinja_template = frame.f_globals.get('__jinja_template__')
+        filename = frame.f_code.co_filename
+        if jinja_template is not None:
+            if template is None:
+                lineno = jinja_template.get_corresponding_lineno(frame.f_lineno)
+                template = f'{jinja_template.name}:{lineno}'
+        elif code is None and filename.startswith(package) and filename != __file__:
+            code = f'{os.path.relpath(filename, package)}:{frame.f_lineno} in {frame.f_code.co_name}'
+        frame = frame.f_back
+    return template, code
+
+
+class RequestProfile:
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+        self.statements = {}   # fingerprint -> [count, seconds, template, code]
+
+    def record(self, statement, seconds):
+        self.queries += 1
+        self.seconds += seconds
+        key = fingerprint(statement)
+        entry = self.statements.get(key)
+        if entry is None:
+            self.statements[key] = [1, seconds, None, None]
+            return
+        entry[0] += 1
+        entry[1] += seconds
+        if entry[0] == 2:
+            # The first repeat is where a loop shows itself
+            entry[2], entry[3] = _origin()
+
+    def repeated(self, threshold):
+        return [{'sql': key, 'count': count, 'seconds': seconds, 'template': template, 'code': code}
+                for key, (count, seconds, template, code) in self.statements.items()
+                if count >= threshold and key.lstrip('(').upper().startswith(('SELECT', 'WITH'))]
+
+
+class ProfilerStats:
+    def __init__(self, history):
+        self._lock = threading.Lock()
+        self.routes = {}
+        self.flagged = deque(maxlen=history)
+
+    def add(self, endpoint, method, path, profile, suspects):
+        with self._lock:
+            route = self.routes.setdefault(endpoint, {'requests': 0, 'queries': 0, 'max_queries': 0,
+                                                     'seconds': 0.0, 'flagged': 0})
+            route['requests'] += 1
+            route['queries'] += profile.queries
+            route['max_queries'] = max(route['max_queries'], profile.queries)
+            route['seconds'] += profile.seconds
+            if suspects:
+                route['flagged'] += 1
+                self.flagged.appendleft({'endpoint': endpoint, 'method': method, 'path': path,
+                                         'queries': profile.queries, 'seconds': profile.seconds,
+                                         'suspects': suspects, 'time': time.time()})
+
+    def snapshot(self):
+        with self._lock:
+            routes = sorted(({'endpoint': endpoint, **route} for endpoint, route in self.routes.items()),
+                            key=lambda route: route['queries'], reverse=True)
+            return routes, list(self.flagged)
+
+    def clear(self):
+        with self._lock:
+            self.routes.clear()
+            self.flagged.clear()
+
+
+def profiler_stats():
+    return current_app.extensions.get('sql_profiler')
+
+
+########################################
+# ENGINE EVENTS
+########################################
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context.profiler_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # Job workers and CLI commands have no request to charge the query to
+    if context is None or not has_request_context():
+        return
+    profile = g.get('sql_profile')
+    if profile is not None:
+        profile.record(statement, time.perf_counter() - context.profiler_started)
+
+
+def watch_engine(engine):
+    # Also used for the async engine of the ASGI app (its sync_engine)
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+########################################
+# REQUEST HOOKS
+########################################
+_cprofile_lock = threading.Lock()
+
+
+def _start_profile():
+    g.sql_profile = RequestProfile()
+
+    rate = current_app.config['SQL_PROFILER_CPROFILE']
+    routes = current_app.config['SQL_PROFILER_CPROFILE_ROUTES']
+    if not rate or random.random() >= rate or (routes and request.endpoint not in routes):
+        return
+    # One cProfile at a time keeps the dumps readable under concurrency
+    if _cprofile_lock.acquire(blocking=False):
+        g.cprofile = cProfile.Profile()
+        g.cprofile.enable()
+
+
+def _finish_profile(response):
+    profile = g.pop('sql_profile', None)
+    if profile is None:
+        return response
+
+    suspects = profile.repeated(current_app.config['SQL_PROFILER_REPEATS'])
+    endpoint = request.endpoint or 'unmatched'
+    profiler_stats().add(endpoint, request.method, request.full_path.rstrip('?'), profile, suspects)
+
+    response.headers['X-SQL-Profile'] = f'queries={profile.queries}; time={profile.seconds * 1000:.1f}ms; ' \
+                                        f'n_plus_one={len(suspects)}'
+    response.headers.add('Server-Timing', f'sql;dur={profile.seconds * 1000:.1f};desc="{profile.queries} queries"')
+    if suspects:
+        worst = max(suspects, key=lambda suspect: suspect['count'])
+        print(f'Possible N+1 in {endpoint}: {worst["count"]}x {worst["sql"][:120]} '
+              f'from {worst["template"] or worst["code"]}')
+    return response
+
+
+def _dump_cprofile(error=None):
+    # In teardown so the lock is released even when the view raised
+    cprofile = g.pop('cprofile', None)
+    if cprofile is None:
+        return
+    cprofile.disable()
+    _cprofile_lock.release()
+    directory = os.path.join(current_app.instance_path, PROFILES_DIR)
+    os.makedirs(directory, exist_ok=True)
+    cprofile.dump_stats(os.path.join(directory, f'{request.endpoint}-{time.time_ns()}.prof'))
+
+
+def init_profiler(app):
+    app.config.setdefault('SQL_PROFILER', os.environ.get('SQL_PROFILER', '0') == '1')
+    app.config.setdefault('SQL_PROFILER_REPEATS', int(os.environ.get('SQL_PROFILER_REPEATS', PROFILER_REPEATS)))
+    app.config.setdefault('SQL_PROFILER_CPROFILE', float(os.environ.get('SQL_PROFILER_CPROFILE', 0)))
+    app.config.setdefault('SQL_PROFILER_CPROFILE_ROUTES',
+                          [route for route in os.environ.get('SQL_PROFILER_CPROFILE_ROUTES', '').split(',') if route])
+
+    if not app.config['SQL_PROFILER']:
+        return
+
+    app.extensions['sql_profiler'] = ProfilerStats(PROFILER_HISTORY)
+    with app.app_context():
+        watch_engine(db.engine)
+
+    app.before_request(_start_profile)
+    app.after_request(_finish_profile)
+    app.teardown_request(_dump_cprofile)
@@ -0,0 +1,212 @@
+from collections import namedtuple
+from datetime import datetime, timedelta
+import click
+from flask.cli import AppGroup
+from sqlalchemy import delete, func, insert, or_, select
+from .cart import UPSERT_INSERTS
+from .models import Order, OrderItem, Product, SalesDaily, SalesProduct, SalesStatus
+from . import db
+
+
+# Orders in these statuses still count per status, but not towards revenue
+# and units sold.
+EXCLUDED_STATUSES = ('Canceled',)
+DEFAULT_STATUS = 'Pending'
+
+DASHBOARD_DAYS = 30
+TOP_PRODUCTS = 10
+
+SalesDashboard = namedtuple('SalesDashboard', ['days', 'peak_revenue', 'totals', 'top_products', 'statuses'])
+
+
+def _counted(status):
+    return (status or DEFAULT_STATUS) not in EXCLUDED_STATUSES
+
+
+########################################
+# INCREMENTAL UPDATES
+########################################
+# Called inside the transaction that changes the order, before its commit,
+# so the rollups can never disagree with the orders they summarise.
+def _bump(model, key, **amounts):
+    # Adds `amounts` to the row for `key`, creating the row if needed
+    table = model.__table__
+    insert_ = UPSERT_INSERTS.get(db.engine.dialect.name)
+
+    if insert_ is not None:
+        stmt = insert_(table).values(**key, **amounts)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=list(key),
+            set_={name: table.c[name] + stmt.excluded[name] for name in amounts}
+        )
+        db.session.execute(stmt)
+        return
+
+    row = db.session.get(model, next(iter(key.values())))
+    if row is None:
+        db.session.add(model(**key, **amounts))
+    else:
+        for name, amount in amounts.items():
+            setattr(row, name, getattr(row, name) + amount)
+
+
+def _bump_many(model, key_name, rows):
+    # rows: [{key_name: ..., amount_name: ...}], one executemany for all of them
+    if not rows:
+        return
+    table = model.__table__
+    insert_ = UPSERT_INSERTS.get(db.engine.dialect.name)
+
+    if insert_ is None:
+        for row in rows:
+            amounts = dict(row)
+            _bump(model, {key_name: amounts.pop(key_name)}, **amounts)
+        return
+
+    stmt = insert_(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[key_name],
+        set_={name: table.c[name] + stmt.excluded[name] for name in rows[0] if name != key_name}
+    )
+    db.session.execute(stmt, rows)
+
+
+def _count_sales(order, lines, sign):
+    # lines: (product_id, quantity, price_each) for every item of the order
+    per_product = {}
+    for product_id, quantity, price_each in lines:
+        units, revenue = per_product.get(product_id, (0, 0.0))
+        per_product[product_id] = (units + quantity, revenue + quantity * price_each)
+
+    _bump(SalesDaily, {'day': order.date_created.date()},
+          orders=sign,
+          units=sign * sum(units for units, _ in per_product.values()),
+          revenue=sign * order.total_price)
+
+    _bump_many(SalesProduct, 'product_id', [
+        {'product_id': product_id, 'units': sign * units, 'revenue': sign * revenue}
+        for product_id, (units, revenue) in per_product.items()
+    ])
+
+
+def record_order_placed(order, lines):
+    _bump(SalesStatus, {'status': order.status or DEFAULT_STATUS}, orders=1)
+    if _counted(order.status):
+        _count_sales(order, lines, 1)
+
+
+def record_status_change(order, old_status, new_status):
+    old_status, new_status = old_status or DEFAULT_STATUS, new_status or DEFAULT_STATUS
+    if old_status == new_status:
+        return
+
+    _bump(SalesStatus, {'status': old_status}, orders=-1)
+    _bump(SalesStatus, {'status': new_status}, orders=1)
+
+    # Cancelling (or un-cancelling) moves the order out of (or into) the sales figures
+    if _counted(old_status) != _counted(new_status):
+        lines = db.session.query(OrderItem.product_id, OrderItem.quantity, OrderItem.price_each)\
+                          .filter(OrderItem.order_id == order.id)\
+                          .all()
+        _count_sales(order, lines, 1 if _counted(new_status) else -1)
+
+
+########################################
+# FULL REBUILD FROM ORDER HISTORY
+########################################
+def rebuild_sales_rollups(conn):
+    counted = or_(Order.status.is_(None), Order.status.notin_(EXCLUDED_STATUSES))
+    day = func.date(Order.date_created)
+    status = func.coalesce(Order.status, DEFAULT_STATUS)
+
+    for model in (SalesDaily, SalesProduct, SalesStatus):
+        conn.execute(delete(model))
+
+    order_units = select(OrderItem.order_id, func.sum(OrderItem.quantity).label('units'))\
+        .group_by(OrderItem.order_id)\
+        .subquery()
+
+    conn.execute(insert(SalesDaily).from_select(
+        ['day', 'orders', 'units', 'revenue'],
+        select(day, func.count(Order.id), func.coalesce(func.sum(order_units.c.units), 0),
+               func.sum(Order.total_price))
+        .outerjoin(order_units, order_units.c.order_id == Order.id)
+        .where(counted, Order.date_created.isnot(None))
+        .group_by(day)
+    ))
+
+    conn.execute(insert(SalesProduct).from_select(
+        ['product_id', 'units', 'revenue'],
+        select(OrderItem.product_id, func.sum(OrderItem.quantity),
+               func.sum(OrderItem.quantity * OrderItem.price_each))
+        .join(Order, Order.id == OrderItem.order_id)
+        .where(counted)
+        .group_by(OrderItem.product_id)
+    ))
+
+    conn.execute(insert(SalesStatus).from_select(
+        ['status', 'orders'],
+        select(status, func.count(Order.id)).group_by(status)
+    ))
+
+
+########################################
+# DASHBOARD
+########################################
+# Reads at most `days` + `top` + (number of statuses) rollup rows, however
+# many orders there are.
+def sales_dashboard(days=DASHBOARD_DAYS, top=TOP_PRODUCTS):
+    today = datetime.utcnow().date()
+    since = today - timedelta(days=days - 1)
+
+    rows = {row.day: row for row in SalesDaily.query.filter(SalesDaily.day >= since)}
+    daily = []
+    for offset in range(days):
+        day = since + timedelta(days=offset)
+        row = rows.get(day)
+        daily.append({
+            'day': day,
+            'orders': row.orders if row else 0,
+            'units': row.units if row else 0,
+            'revenue': row.revenue if row else 0.0
+        })
+
+    totals = {
+        'orders': sum(d['orders'] for d in daily),
+        'units': sum(d['units'] for d in daily),
+        'revenue': sum(d['revenue'] for d in daily)
+    }
+
+    top_products = db.session.query(SalesProduct, Product.product_name)\
+                             .outerjoin(Product, Product.id == SalesProduct.product_id)\
+                             .filter(SalesProduct.units > 0)\
+                             .order_by(SalesProduct.units.desc())\
+                             .limit(top)\
+                             .all()
+
+    statuses = SalesStatus.query.filter(SalesStatus.orders > 0)\
+                                .order_by(SalesStatus.orders.desc())\
+                                .all()
+
+    peak = max(d['revenue'] for d in daily)
+    return SalesDashboard(daily, peak, totals, top_products, statuses)
+
+
+def order_statuses():
+    return [row.status for row in SalesStatus.query.filter(SalesStatus.orders > 0).order_by(SalesStatus.status)]
+
+
+########################################
+# CLI — flask sales rebuild
+########################################
+sales_cli = AppGroup('sales', help='Sales rollup tables.')
+
+
+@sales_cli.command('rebuild')
+def rebuild_command():
+    with db.engine.begin() as conn:
+        rebuild_sales_rollups(conn)
+
+    days = SalesDaily.query.count()
+    products = SalesProduct.query.count()
+    click.echo(f'Rebuilt sales rollups: {days} days, {products} products')
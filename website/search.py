@@ -0,0 +1,234 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import select, text
+from sqlalchemy.exc import OperationalError
+from .models import Product
+from . import db
+
+
+# Product columns copied into the full-text index. Add description/category
+# here once they exist on Product; the index is rebuilt when this changes.
+SEARCH_COLUMNS = ('product_name',)
+FTS_TABLE = 'product_fts'
+
+SUGGEST_LIMIT = 8
+SUGGEST_CACHE_SIZE = 256
+SUGGEST_CACHE_TTL = 60
+INDEX_RETRY_INTERVAL = 30  # seconds between attempts to create a missing index
+
+# Shared by every thread of the worker: all access goes through _suggest_lock.
+# A clear bumps the generation, so a suggestion computed before a catalog
+# change can't be put back into the cache after it.
+_suggest_cache = OrderedDict()
+_suggest_lock = threading.Lock()
+_suggest_generation = 0
+
+
+########################################
+# INDEX SETUP
+########################################
+def _clear_suggestions():
+    global _suggest_generation
+    with _suggest_lock:
+        _suggest_cache.clear()
+        _suggest_generation += 1
+
+
+def _index_columns(conn):
+    rows = conn.execute(text(f"PRAGMA table_info({FTS_TABLE})")).all()
+    return tuple(row[1] for row in rows)
+
+
+def _create_index(conn):
+    columns = ', '.join(SEARCH_COLUMNS)
+    conn.execute(text(f"DROP TABLE IF EXISTS {FTS_TABLE}"))
+    conn.execute(text(f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5("
+                      f"{columns}, tokenize='unicode61 remove_diacritics 2', prefix='2 3')"))
+    _fill_index(conn)
+
+
+def _fill_index(conn):
+    columns = ', '.join(SEARCH_COLUMNS)
+    conn.execute(text(f"DELETE FROM {FTS_TABLE}"))
+    conn.execute(text(f"INSERT INTO {FTS_TABLE}(rowid, {columns}) SELECT id, {columns} FROM product"))
+
+
+def init_search_index(app):
+    # Runs once per worker at start-up. Falls back to LIKE search for good
+    # when the database is not SQLite or SQLite has no FTS5. Any other
+    # failure (a locked database, tables not migrated yet) leaves the state
+    # unknown: search_enabled() checks again before the next search or
+    # index write, so this worker never skips writes to a live index.
+    app.extensions['product_search'] = None
+    with app.app_context():
+        if db.engine.dialect.name != 'sqlite':
+            app.extensions['product_search'] = False
+        else:
+            _setup_index(app)
+
+
+def _setup_index(app):
+    try:
+        with db.engine.begin() as conn:
+            if _index_columns(conn) != SEARCH_COLUMNS:
+                _create_index(conn)
+    except OperationalError as e:
+        if 'no such module' in str(e.orig):
+            app.logger.error('SQLite has no FTS5, search falls back to LIKE: %s', e.orig)
+            app.extensions['product_search'] = False
+        else:
+            app.logger.error('Search index unavailable, will retry: %s', e.orig)
+        return False
+
+    app.extensions['product_search'] = True
+    return True
+
+
+def search_enabled(setup=True):
+    app = current_app._get_current_object()
+    enabled = app.extensions.get('product_search')
+    if enabled is None:
+        # Set up by another worker since, or retried here (rate limited).
+        # Index writes pass setup=False: their session already holds the
+        # write lock, and a missing index is rebuilt from product anyway.
+        with db.engine.connect() as conn:
+            if _index_columns(conn) == SEARCH_COLUMNS:
+                app.extensions['product_search'] = True
+                return True
+        if setup and time.monotonic() >= app.extensions.get('product_search_retry', 0):
+            app.extensions['product_search_retry'] = time.monotonic() + INDEX_RETRY_INTERVAL
+            return _setup_index(app)
+        return False
+    return enabled
+
+
+########################################
+# INDEX SYNC — CALLED BY ADMIN ROUTES
+########################################
+# These run on db.session, so the index changes commit or roll back
+# together with the product change that caused them.
+def index_product(product):
+    index_products([{column: getattr(product, column) for column in ('id',) + SEARCH_COLUMNS}])
+
+
+def index_products(rows):
+    # rows: dicts with 'id' and every SEARCH_COLUMNS key; one executemany each
+    if not rows or not search_enabled(setup=False):
+        return
+    columns = ', '.join(SEARCH_COLUMNS)
+    values = ', '.join(f':{column}' for column in SEARCH_COLUMNS)
+    params = [{column: row[column] for column in ('id',) + SEARCH_COLUMNS} for row in rows]
+
+    db.session.execute(text(f"DELETE FROM {FTS_TABLE} WHERE rowid = :id"), params)
+    db.session.execute(text(f"INSERT INTO {FTS_TABLE}(rowid, {columns}) VALUES (:id, {values})"), params)
+    _clear_suggestions()
+
+
+def unindex_product(product_id):
+    if not search_enabled(setup=False):
+        return
+    db.session.execute(text(f"DELETE FROM {FTS_TABLE} WHERE rowid = :id"), {'id': product_id})
+    _clear_suggestions()
+
+
+def rebuild_search_index():
+    if db.engine.dialect.name != 'sqlite':
+        return False
+    with db.engine.begin() as conn:
+        _create_index(conn)
+    current_app.extensions['product_search'] = True
+    _clear_suggestions()
+    return True
+
+
+########################################
+# QUERIES
+########################################
+def match_expression(query):
+    # Every word must match as a prefix: "fre tun" -> "fre"* "tun"*
+    tokens = re.findall(r'\w+', query.lower())
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+
+def search_statement(query, limit=None):
+    # A select of Product rows, best match first; None for an empty query.
+    # Shared by the Flask view and the async one in asgi.py.
+    expression = match_expression(query)
+    if not expression:
+        return None
+
+    if not search_enabled():
+        statement = select(Product).where(Product.product_name.ilike(f"%{query}%"))
+        return statement.limit(limit) if limit else statement
+
+    sql = (f"SELECT product.* FROM {FTS_TABLE} "
+           f"JOIN product ON product.id = {FTS_TABLE}.rowid "
+           f"WHERE {FTS_TABLE} MATCH :q ORDER BY {FTS_TABLE}.rank")
+    params = {'q': expression}
+    if limit:
+        sql += " LIMIT :limit"
+        params['limit'] = limit
+
+    return select(Product).from_statement(text(sql).bindparams(**params))
+
+
+def search_products(query, limit=None):
+    statement = search_statement(query, limit)
+    if statement is None:
+        return []
+    return db.session.scalars(statement).all()
+
+
+def suggest_products(query):
+    key = ' '.join(re.findall(r'\w+', query.lower()))
+    if not key:
+        return []
+
+    now = time.monotonic()
+    with _suggest_lock:
+        generation = _suggest_generation
+        cached = _suggest_cache.get(key)
+        if cached and now - cached[0] < SUGGEST_CACHE_TTL:
+            _suggest_cache.move_to_end(key)
+            return cached[1]
+
+    if search_enabled():
+        rows = db.session.execute(text(
+            f"SELECT product.id, product.product_name, product.current_price FROM {FTS_TABLE} "
+            f"JOIN product ON product.id = {FTS_TABLE}.rowid "
+            f"WHERE {FTS_TABLE} MATCH :q ORDER BY {FTS_TABLE}.rank LIMIT :limit"
+        ), {'q': match_expression(key), 'limit': SUGGEST_LIMIT}).all()
+    else:
+        rows = db.session.query(Product.id, Product.product_name, Product.current_price)\
+                         .filter(Product.product_name.ilike(f"%{key}%"))\
+                         .limit(SUGGEST_LIMIT)\
+                         .all()
+
+    suggestions = [{'id': row[0], 'name': row[1], 'price': row[2]} for row in rows]
+
+    with _suggest_lock:
+        if generation == _suggest_generation:
+            _suggest_cache[key] = (now, suggestions)
+            while len(_suggest_cache) > SUGGEST_CACHE_SIZE:
+                _suggest_cache.popitem(last=False)
+
+    return suggestions
+
+
+########################################
+# CLI — flask search rebuild
+########################################
+search_cli = AppGroup('search', help='Product search index.')
+
+
+@search_cli.command('rebuild')
+def rebuild_command():
+    if rebuild_search_index():
+        click.echo('Search index rebuilt')
+    else:
+        click.echo('Full-text search needs SQLite; using LIKE search instead')
@@ -1,41 +1,142 @@
-$(".plus-cart").click(function() {
-    var id = $(this).attr("pid");
-    var quantity = this.parentNode.children[2];
+// Cart +/- buttons: clicks update the page at once and are queued; the
+// queue is sent to /cart/batch as one request once clicking pauses.
+var cartBatchUrl = "/cart/batch";
+var pendingCart = {};
+var cartTimer = null;
+var cartInFlight = false;
 
-    $.ajax({
-        type: "POST",
-        url: "/update-cart",
-        data: {
-            item_id: id,
-            action: "plus"
-        },
-        success: function(data) {
-            quantity.innerText = data.quantity;
-            document.getElementById(`quantity${id}`).innerText = data.quantity;
+function pendingDelta(id) {
+    return pendingCart[id] || 0;
+}
+
+function showCartQuantity(id, quantity) {
+    if (quantity < 1) {
+        $("#cart-item-" + id).next("hr").remove();
+        $("#cart-item-" + id).remove();
+        $("#summary-item-" + id).remove();
+        return;
+    }
+    $("#quantity" + id).text(quantity);
+    $("#summary-qty-" + id).text("x " + quantity);
+}
+
+function queueCartChange(id, delta) {
+    var shown = parseInt($("#quantity" + id).text(), 10) || 0;
+    if (shown + delta < 0) {
+        return;
+    }
+
+    pendingCart[id] = pendingDelta(id) + delta;
+    showCartQuantity(id, shown + delta);
+
+    clearTimeout(cartTimer);
+    cartTimer = setTimeout(flushCart, 400);
+}
+
+function cartOps() {
+    var ops = [];
+    for (var id in pendingCart) {
+        if (pendingCart[id] !== 0) {
+            ops.push({ item_id: id, delta: pendingCart[id] });
         }
-    });
-});
+    }
+    pendingCart = {};
+    return ops;
+}
 
-$(".minus-cart").click(function() {
-    var id = $(this).attr("pid");
-    var quantity = this.parentNode.children[2];
+function flushCart(done) {
+    if (cartInFlight) {
+        cartTimer = setTimeout(function() { flushCart(done); }, 100);
+        return;
+    }
+
+    var ops = cartOps();
+    if (!ops.length) {
+        if (done) done();
+        return;
+    }
 
+    cartInFlight = true;
     $.ajax({
         type: "POST",
-        url: "/update-cart",
-        data: {
-            item_id: id,
-            action: "minus"
-        },
+        url: cartBatchUrl,
+        contentType: "application/json",
+        data: JSON.stringify({ ops: ops }),
         success: function(data) {
-            if (data.delete) {
-                // Remove item
-                document.getElementById(`cart-item-${id}`).remove();
+            // Clicks made while this request was out are still queued
+            for (var id in data.quantities) {
+                showCartQuantity(id, data.quantities[id] + pendingDelta(id));
+            }
+            if (data.lines === 0) {
+                window.location.reload();
                 return;
             }
-
-            quantity.innerText = data.quantity;
-            document.getElementById(`quantity${id}`).innerText = data.quantity;
+            $("#amount").text("Php " + data.amount);
+            $("#total").html("<strong>Php " + data.total + "</strong>");
+        },
+        error: function() {
+            window.location.reload();
+        },
+        complete: function() {
+            cartInFlight = false;
+            if (done) done();
         }
     });
+}
+
+$(".plus-cart").click(function() {
+    queueCartChange($(this).attr("pid"), 1);
+});
+
+$(".minus-cart").click(function() {
+    queueCartChange($(this).attr("pid"), -1);
+});
+
+// Checkout must see the saved quantities, so send the queue first
+$("a[href='/checkout']").click(function(event) {
+    if ($.isEmptyObject(pendingCart) && !cartInFlight) {
+        return;
+    }
+    event.preventDefault();
+    clearTimeout(cartTimer);
+
+    var href = this.href;
+    flushCart(function() { window.location = href; });
+});
+
+// Don't lose queued clicks when leaving the page some other way
+window.addEventListener("pagehide", function() {
+    var ops = cartOps();
+    if (ops.length) {
+        navigator.sendBeacon(cartBatchUrl, new Blob([JSON.stringify({ ops: ops })], { type: "application/json" }));
+    }
+});
+
+// Search typeahead: ask /search/suggest once typing pauses
+var suggestTimer = null;
+var lastSuggestQuery = "";
+
+$("input[data-suggest-url]").on("input", function() {
+    var input = this;
+    var query = input.value.trim();
+
+    clearTimeout(suggestTimer);
+    if (query.length < 2 || query === lastSuggestQuery) {
+        return;
+    }
+
+    suggestTimer = setTimeout(function() {
+        lastSuggestQuery = query;
+
+        $.getJSON(input.dataset.suggestUrl, { q: query }, function(data) {
+            var list = document.getElementById(input.getAttribute("list"));
+            list.innerHTML = "";
+
+            data.forEach(function(item) {
+                var option = document.createElement("option");
+                option.value = item.name;
+                list.appendChild(option);
+            });
+        });
+    }, 150);
 });
@@ -0,0 +1,103 @@
+import os
+import threading
+import time
+from flask import current_app, g, has_request_context, before_render_template, template_rendered
+from jinja2 import FileSystemBytecodeCache
+
+
+# Compiled templates are kept in instance/jinja_cache, shared by every
+# worker on the host: a new or recycled worker loads the bytecode instead
+# of parsing and compiling the source again. Jinja checks the source
+# checksum, so an edited template is recompiled on its next load.
+#
+# With TEMPLATE_PRECOMPILE=1 (the default) create_app loads every template
+# up front, so no request pays for compiling one.
+BYTECODE_CACHE_DIR = 'jinja_cache'
+PRECOMPILE_EXTENSIONS = ('.html', '.txt')
+
+
+class RenderTimings:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.templates = {}
+
+    def add(self, name, seconds):
+        with self._lock:
+            timing = self.templates.setdefault(name, {'renders': 0, 'seconds': 0.0, 'max_seconds': 0.0})
+            timing['renders'] += 1
+            timing['seconds'] += seconds
+            timing['max_seconds'] = max(timing['max_seconds'], seconds)
+
+    def snapshot(self):
+        with self._lock:
+            return sorted(({'template': name, **timing} for name, timing in self.templates.items()),
+                          key=lambda timing: timing['seconds'], reverse=True)
+
+    def clear(self):
+        with self._lock:
+            self.templates.clear()
+
+
+def render_timings():
+    return current_app.extensions['template_timings']
+
+
+def precompile_templates(app):
+    # Returns the number of templates loaded (from bytecode or compiled)
+    count = 0
+    for name in app.jinja_env.list_templates(extensions=[ext.lstrip('.') for ext in PRECOMPILE_EXTENSIONS]):
+        app.jinja_env.get_template(name)
+        count += 1
+    return count
+
+
+########################################
+# RENDER TIMING — FLASK SIGNALS
+########################################
+# render_template() and render_template_string() only; templates pulled in
+# with {% extends %} / {% include %} count towards the one being rendered.
+_started = threading.local()
+
+
+def _before_render(sender, template, context, **extra):
+    _started.__dict__.setdefault('stack', []).append(time.perf_counter())
+
+
+def _after_render(sender, template, context, **extra):
+    stack = getattr(_started, 'stack', None)
+    if not stack:
+        return
+    seconds = time.perf_counter() - stack.pop()
+    sender.extensions['template_timings'].add(template.name or '<string>', seconds)
+    if has_request_context():
+        g.render_seconds = g.get('render_seconds', 0.0) + seconds
+
+
+def _reset_render_stack():
+    # A template that raised never sent template_rendered
+    _started.stack = []
+
+
+def _render_server_timing(response):
+    seconds = g.pop('render_seconds', None)
+    if seconds is not None:
+        response.headers.add('Server-Timing', f'render;dur={seconds * 1000:.1f}')
+    return response
+
+
+def init_templates(app):
+    # Before anything touches app.jinja_env: the environment reads
+    # jinja_options once, when it is created.
+    app.config.setdefault('TEMPLATE_BYTECODE_CACHE', os.environ.get('TEMPLATE_BYTECODE_CACHE', '1') == '1')
+    app.config.setdefault('TEMPLATE_PRECOMPILE', os.environ.get('TEMPLATE_PRECOMPILE', '1') == '1')
+
+    if app.config['TEMPLATE_BYTECODE_CACHE']:
+        directory = os.path.join(app.instance_path, BYTECODE_CACHE_DIR)
+        os.makedirs(directory, exist_ok=True)
+        app.jinja_options = dict(app.jinja_options, bytecode_cache=FileSystemBytecodeCache(directory))
+
+    app.extensions['template_timings'] = RenderTimings()
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_after_render, app)
+    app.before_request(_reset_render_stack)
+    app.after_request(_render_server_timing)
@@ -1,33 +1,51 @@
-from flask import Blueprint, render_template, flash, redirect, url_for, request, jsonify
+from flask import Blueprint, render_template, flash, redirect, url_for, request, jsonify, session, make_response
 from flask_login import login_required, current_user
-from .models import Product, Cart, Order, OrderItem
+from .models import Product, Order
+from .checkout import place_cart_order, InsufficientStock
+from .listings import order_page, customer_orders, customer_order, order_items
+from .sales import record_status_change, sales_dashboard, order_statuses
+from .search import search_products, suggest_products
+from .database import retry_on_lock
+from .assets import serve_asset
+from .catalog import cached_fragment, catalog_etag, bump_catalog_version, record_not_modified
+from .cart import cart_items_for, cart_item_for, cart_totals, add_product_to_cart, apply_cart_changes, \
+    set_cart_summary, adjust_cart_summary, clear_cart_summary
 from . import db
-from datetime import datetime
 
 views = Blueprint('views', __name__)
 
 
+########################################
+# FINGERPRINTED STATIC FILES
+########################################
+@views.route('/assets/<path:filename>')
+def get_asset(filename):
+    return serve_asset(filename)
+
+
 ########################################
 # AJAX — PLUS CART
 ########################################
 @views.route('/pluscart')
 @login_required
+@retry_on_lock
 def plus_cart():
-    item_id = request.args.get('item_id')
-    cart_item = Cart.query.get(int(item_id))
+    item_id = request.args.get('item_id', type=int)
+    cart_item = cart_item_for(current_user.id, item_id)
+
+    if not cart_item:
+        return jsonify({'error': 'Item not found'}), 404
 
     cart_item.quantity += 1
     db.session.commit()
 
-    cart_items = Cart.query.filter_by(customer_link=current_user.id).all()
-
-    amount = sum(i.quantity * i.product.current_price for i in cart_items)
-    total = amount
+    totals = cart_totals(current_user.id)
+    set_cart_summary(current_user.id, totals)
 
     return jsonify({
         'quantity': cart_item.quantity,
-        'amount': amount,
-        'total': total
+        'amount': totals.amount,
+        'total': totals.amount
     })
 
 
@@ -36,24 +54,26 @@ def plus_cart():
 ########################################
 @views.route('/minuscart')
 @login_required
+@retry_on_lock
 def minus_cart():
-    item_id = request.args.get('item_id')
-    cart_item = Cart.query.get(int(item_id))
+    item_id = request.args.get('item_id', type=int)
+    cart_item = cart_item_for(current_user.id, item_id)
+
+    if not cart_item:
+        return jsonify({'error': 'Item not found'}), 404
 
     if cart_item.quantity > 1:
         cart_item.quantity -= 1
 
     db.session.commit()
 
-    cart_items = Cart.query.filter_by(customer_link=current_user.id).all()
-
-    amount = sum(i.quantity * i.product.current_price for i in cart_items)
-    total = amount
+    totals = cart_totals(current_user.id)
+    set_cart_summary(current_user.id, totals)
 
     return jsonify({
         'quantity': cart_item.quantity,
-        'amount': amount,
-        'total': total
+        'amount': totals.amount,
+        'total': totals.amount
     })
 
 
@@ -67,29 +87,42 @@ def home():
     if current_user.is_authenticated and current_user.id == 1:
         return redirect(url_for('views.admin_page'))
 
-    items = Product.query.all()
-    return render_template("home.html", items=items)
+    # Anonymous visitors without pending flash messages all get the same
+    # page, so it can be revalidated by ETag without touching the database.
+    cacheable = not current_user.is_authenticated and '_flashes' not in session
+    etag = catalog_etag()
+
+    if cacheable and etag in request.if_none_match:
+        record_not_modified()
+        response = make_response('', 304)
+        response.set_etag(etag)
+        return response
+
+    product_grid = cached_fragment("_product_grid.html", lambda: {'items': Product.query.all()})
+    response = make_response(render_template("home.html", product_grid=product_grid))
+
+    if cacheable:
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+
+    return response
 
 ########################################
 # OUR STORY PAGE
 ########################################
 @views.route('/story')
 def story_page():
-    cart_length = 0
-
-    if current_user.is_authenticated:
-        if current_user.id == 1:
-            return redirect(url_for('views.admin_orders'))
-
-        cart_length = Cart.query.filter_by(customer_link=current_user.id).count()
+    if current_user.is_authenticated and current_user.id == 1:
+        return redirect(url_for('views.admin_orders'))
 
-    return render_template("story.html", cart=list(range(cart_length)))
+    return render_template("story.html")
 
 ########################################
 # ADD TO CART
 ########################################
 @views.route("/add-to-cart/<int:product_id>")
 @login_required
+@retry_on_lock
 def add_to_cart(product_id):
 
     # BLOCK ADMIN FROM ORDERING
@@ -99,22 +132,10 @@ def add_to_cart(product_id):
 
     product = Product.query.get_or_404(product_id)
 
-    existing = Cart.query.filter_by(
-        customer_link=current_user.id,
-        product_link=product_id
-    ).first()
-
-    if existing:
-        existing.quantity += 1
-    else:
-        new_item = Cart(
-            product_link=product_id,
-            customer_link=current_user.id,
-            quantity=1
-        )
-        db.session.add(new_item)
+    quantity = add_product_to_cart(current_user.id, product_id)
 
     db.session.commit()
+    adjust_cart_summary(current_user.id, lines=1 if quantity == 1 else 0, quantity=1, amount=product.current_price)
     flash("Added to cart!", "success")
     return redirect(url_for('views.cart'))
 
@@ -130,15 +151,15 @@ def cart():
     if current_user.id == 1:
         return redirect(url_for('views.admin_orders'))
 
-    cart_items = Cart.query.filter_by(customer_link=current_user.id).all()
-    amount = sum(item.quantity * item.product.current_price for item in cart_items)
-    total = amount
+    cart_items = cart_items_for(current_user.id)
+    totals = cart_totals(current_user.id)
+    set_cart_summary(current_user.id, totals)
 
     return render_template(
         "cart.html",
         cart=cart_items,
-        amount=amount,
-        total=amount
+        amount=totals.amount,
+        total=totals.amount
     )
 
 
@@ -147,15 +168,15 @@ def cart():
 ########################################
 @views.route("/remove-from-cart/<int:item_id>")
 @login_required
+@retry_on_lock
 def remove_from_cart(item_id):
-    item = Cart.query.filter_by(
-        id=item_id,
-        customer_link=current_user.id
-    ).first()
+    item = cart_item_for(current_user.id, item_id)
 
     if item:
+        quantity, price = item.quantity, item.product.current_price
         db.session.delete(item)
         db.session.commit()
+        adjust_cart_summary(current_user.id, lines=-1, quantity=-quantity, amount=-quantity * price)
         flash("Item removed from cart!", "success")
     else:
         flash("Item not found!", "danger")
@@ -169,33 +190,76 @@ def remove_from_cart(item_id):
 ########################################
 @views.route("/update-cart", methods=["POST"])
 @login_required
+@retry_on_lock
 def update_cart():
     item_id = request.form.get("item_id")
     action = request.form.get("action")
 
-    item = Cart.query.filter_by(
-        id=item_id,
-        customer_link=current_user.id
-    ).first()
+    item = cart_item_for(current_user.id, item_id)
 
     if not item:
         return jsonify({"error": "Item not found"}), 404
 
     if action == "plus":
         item.quantity += 1
-
     elif action == "minus":
         item.quantity -= 1
-        if item.quantity < 1:
-            db.session.delete(item)
-            db.session.commit()
-            return jsonify({"success": True, "delete": True})
 
+    quantity = max(item.quantity, 0)
+    if quantity == 0:
+        db.session.delete(item)
+    db.session.commit()
+
+    totals = cart_totals(current_user.id)
+    set_cart_summary(current_user.id, totals)
+
+    return jsonify({
+        "success": True,
+        "delete": quantity == 0,
+        "quantity": quantity,
+        "amount": totals.amount,
+        "total": totals.amount
+    })
+
+
+########################################
+# BATCHED CART CHANGES — AJAX
+########################################
+# Body: {"ops": [{"item_id": 3, "delta": 1}, {"item_id": 3, "delta": -2}, ...]}
+# All operations are applied in one transaction.
+MAX_BATCH_OPS = 500
+
+
+@views.route("/cart/batch", methods=["POST"])
+@login_required
+@retry_on_lock
+def cart_batch():
+    ops = (request.get_json(silent=True) or {}).get("ops")
+
+    if not isinstance(ops, list) or not 0 < len(ops) <= MAX_BATCH_OPS:
+        return jsonify({"error": f"ops must be a list of 1 to {MAX_BATCH_OPS} operations"}), 400
+
+    deltas = {}
+    try:
+        for op in ops:
+            item_id, delta = int(op["item_id"]), int(op["delta"])
+            deltas[item_id] = deltas.get(item_id, 0) + delta
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"error": "each operation needs an integer item_id and delta"}), 400
+
+    quantities = apply_cart_changes(current_user.id, deltas)
     db.session.commit()
 
+    totals = cart_totals(current_user.id)
+    set_cart_summary(current_user.id, totals)
+
     return jsonify({
         "success": True,
-        "quantity": item.quantity
+        "quantities": {str(item_id): quantity for item_id, quantity in quantities.items()},
+        "missing": [item_id for item_id in deltas if item_id not in quantities],
+        "lines": totals.lines,
+        "amount": totals.amount,
+        "total": totals.amount
     })
 
 
@@ -209,17 +273,16 @@ def checkout():
     if current_user.id == 1:
         return redirect(url_for('views.admin_orders'))
 
-    cart_items = Cart.query.filter_by(customer_link=current_user.id).all()
+    cart_items = cart_items_for(current_user.id)
 
     if not cart_items:
         flash("Your cart is empty.", "warning")
         return redirect(url_for('views.cart'))
 
-    total_amount = sum(
-        item.quantity * item.product.current_price for item in cart_items
-    )
+    totals = cart_totals(current_user.id)
+    set_cart_summary(current_user.id, totals)
 
-    return render_template("checkout.html", cart=cart_items, total=total_amount)
+    return render_template("checkout.html", cart=cart_items, total=totals.amount)
 
 ########################################
 # PLACE ORDER — FINAL
@@ -234,58 +297,22 @@ def place_order():
 
     payment_method = request.form.get("payment_method")
 
-    # Get items in cart
-    cart_items = Cart.query.filter_by(customer_link=current_user.id).all()
-
-    if not cart_items:
+    try:
+        new_order = place_cart_order(current_user.id, payment_method)
+    except InsufficientStock as e:
+        for shortage in e.shortages:
+            flash(f"Insufficient stock for {shortage.product_name}: you asked for {shortage.requested}, "
+                  f"only {shortage.available} left.", "danger")
+        if not e.shortages:
+            flash("Stock changed while placing your order, please try again.", "warning")
+        return redirect(url_for("views.checkout"))
+
+    if new_order is None:
         flash("Your cart is empty.", "warning")
         return redirect(url_for("views.cart"))
 
-    # Compute total amount
-    total_amount = sum(item.quantity * item.product.current_price for item in cart_items)
-
-    # Create order
-    new_order = Order(
-        customer_id=current_user.id,
-        total_price=total_amount,
-        status="pending",
-        payment_method=payment_method,
-        date_created=datetime.utcnow()
-    )
-
-    db.session.add(new_order)
-    db.session.flush()
-
-    # PROCESS EACH ITEM
-    for item in cart_items:
-
-        # 1. Get actual product
-        product = Product.query.get(item.product_link)
-
-        # STOCK CHECK
-        if product.in_stock < item.quantity:
-            flash(f"Insufficient stock for {product.product_name}.", "danger")
-            db.session.rollback()
-            return redirect(url_for("views.checkout"))
-
-        # 3. Deduct stock
-        product.in_stock -= item.quantity
-        db.session.add(product)
-
-        # 4. Create Order Item entry
-        order_item = OrderItem(
-            order_id=new_order.id,
-            product_id=item.product_link,
-            quantity=item.quantity,
-            price_each=item.product.current_price
-        )
-        db.session.add(order_item)
-
-    # 5. Clear cart
-    Cart.query.filter_by(customer_link=current_user.id).delete()
-
-    # 6. Final commit
-    db.session.commit()
+    clear_cart_summary(current_user.id)
+    bump_catalog_version()
 
     flash("Order placed successfully!", "success")
     return redirect(url_for("views.orders"))
@@ -302,9 +329,7 @@ def orders():
     if current_user.id == 1:
         return redirect(url_for('views.admin_orders'))
 
-    orders = Order.query.filter_by(customer_id=current_user.id)\
-                        .order_by(Order.date_created.desc())\
-                        .all()
+    orders = db.session.scalars(customer_orders(current_user.id)).all()
 
     return render_template("orders.html", orders=orders)
 
@@ -316,12 +341,8 @@ def orders():
 @login_required
 def order_details(order_id):
 
-    order = Order.query.filter_by(
-        id=order_id,
-        customer_id=current_user.id
-    ).first_or_404()
-
-    items = OrderItem.query.filter_by(order_id=order_id).all()
+    order = db.first_or_404(customer_order(current_user.id, order_id))
+    items = db.session.scalars(order_items(order_id)).all()
 
     return render_template("order_details.html", order=order, items=items)
 
@@ -335,8 +356,8 @@ def admin_orders():
     if current_user.id != 1:
         return redirect(url_for('views.home'))
 
-    orders = Order.query.order_by(Order.date_created.desc()).all()
-    return render_template("view_orders.html", orders=orders)
+    page = order_page(request.args)
+    return render_template("view_orders.html", page=page, statuses=order_statuses())
 
 
 ########################################
@@ -354,6 +375,7 @@ def update_order_status(order_id):
     if request.method == "POST":
         new_status = request.form.get("status")
         if new_status:
+            record_status_change(order, order.status, new_status)
             order.status = new_status
             db.session.commit()
             flash("Order status updated!", "success")
@@ -372,13 +394,20 @@ def search():
         flash("Please enter a search term.", "warning")
         return redirect(request.referrer)
 
-    # FIND ITEMS MATCHING SEARCH
-    items = Product.query.filter(
-        Product.product_name.ilike(f"%{query}%")
-    ).all()
+    # FIND ITEMS MATCHING SEARCH (ranked, prefix matching)
+    items = search_products(query)
 
     return render_template("search.html", items=items)
 
+
+########################################
+# SEARCH — TYPEAHEAD SUGGESTIONS
+########################################
+@views.route('/search/suggest')
+def search_suggest():
+    query = request.args.get('q', '').strip()
+    return jsonify(suggest_products(query))
+
 ########################################
 # ADMIN PAGE / DASHBOARD
 ########################################
@@ -389,4 +418,4 @@ def admin_page():
     if current_user.id != 1:
         return redirect(url_for('views.home'))
 
-    return render_template("admin.html")
+    return render_template("admin.html", sales=sales_dashboard())